@@ -0,0 +1,155 @@
+"""
+Caches em memória do processo (por worker gunicorn).
+
+TTLCache: LRU com TTL por entrada e tags para invalidação em grupo
+(ex.: todas as sessões de um usuário). Cada instância se registra pelo
+nome e aparece em cache_stats() / /api/internal/metrics.
+
+Nada aqui é compartilhado entre workers: invalidar num processo não
+afeta o outro, então o TTL é o limite de desatualização entre workers.
+"""
+from __future__ import annotations
+
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Hashable, Iterable, Optional, Set, Tuple
+
+_MISSING = object()
+
+
+class TTLCache:
+    """
+    LRU thread-safe com expiração por entrada.
+
+    - max_size: ao estourar, a entrada menos usada sai (evictions).
+    - ttl: segundos de vida padrão (set() aceita ttl próprio).
+    - tags: set(..., tags=[...]) associa a entrada a tags; invalidate_tag()
+      remove todas as entradas da tag.
+    """
+
+    def __init__(self, name: str, max_size: int, ttl: float) -> None:
+        self.name = name
+        self.max_size = max(1, max_size)
+        self.ttl = ttl
+        self._data: "OrderedDict[Hashable, Tuple[Any, float, Tuple[Hashable, ...]]]" = OrderedDict()
+        self._tags: Dict[Hashable, Set[Hashable]] = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.invalidations = 0
+        _register(self)
+
+    # -- internos (chamados com o lock) --
+    def _unlink(self, key: Hashable, tags: Tuple[Hashable, ...]) -> None:
+        for tag in tags:
+            keys = self._tags.get(tag)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._tags[tag]
+
+    def _remove(self, key: Hashable) -> bool:
+        entry = self._data.pop(key, None)
+        if entry is None:
+            return False
+        self._unlink(key, entry[2])
+        return True
+
+    # -- API --
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        now = time.monotonic()
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                self.misses += 1
+                return default
+            value, expires_at, _ = entry
+            if expires_at <= now:
+                self._remove(key)
+                self.expirations += 1
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key: Hashable, value: Any, ttl: Optional[float] = None, tags: Iterable[Hashable] = ()) -> None:
+        ttl = self.ttl if ttl is None else ttl
+        if ttl <= 0:
+            return
+        tags = tuple(tags)
+        with self._lock:
+            self._remove(key)
+            self._data[key] = (value, time.monotonic() + ttl, tags)
+            for tag in tags:
+                self._tags.setdefault(tag, set()).add(key)
+            while len(self._data) > self.max_size:
+                old_key, (_, _, old_tags) = self._data.popitem(last=False)
+                self._unlink(old_key, old_tags)
+                self.evictions += 1
+
+    def get_or_load(self, key: Hashable, loader, ttl: Optional[float] = None, tags: Iterable[Hashable] = ()) -> Any:
+        """get(); em miss chama loader() e guarda o resultado (None não é guardado)."""
+        value = self.get(key, _MISSING)
+        if value is not _MISSING:
+            return value
+        value = loader()
+        if value is not None:
+            self.set(key, value, ttl=ttl, tags=tags)
+        return value
+
+    def pop(self, key: Hashable) -> None:
+        with self._lock:
+            if self._remove(key):
+                self.invalidations += 1
+
+    def invalidate_tag(self, tag: Hashable) -> int:
+        with self._lock:
+            keys = list(self._tags.get(tag, ()))
+            for key in keys:
+                self._remove(key)
+            self.invalidations += len(keys)
+            return len(keys)
+
+    def clear(self) -> None:
+        with self._lock:
+            self.invalidations += len(self._data)
+            self._data.clear()
+            self._tags.clear()
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": len(self._data),
+                "maxSize": self.max_size,
+                "ttlSeconds": self.ttl,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hitRate": round(self.hits / lookups, 4) if lookups else None,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+                "invalidations": self.invalidations,
+            }
+
+
+_caches: Dict[str, TTLCache] = {}
+_caches_lock = threading.Lock()
+
+
+def _register(cache: TTLCache) -> None:
+    with _caches_lock:
+        _caches[cache.name] = cache
+
+
+def cache_stats() -> Dict[str, Dict[str, Any]]:
+    """Estatísticas de todos os TTLCache do processo, por nome."""
+    with _caches_lock:
+        caches = list(_caches.values())
+    return {c.name: c.stats() for c in caches}
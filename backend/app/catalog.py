@@ -0,0 +1,182 @@
+"""
+Snapshot do catálogo público (systems + tenants ativos), por worker.
+
+/api/systems, /api/systems/<slug>/tenants, /api/tenants/available e
+/api/admin/tenants respondem daqui. O snapshot roda as duas queries do
+catálogo uma vez; cada view (registrada pela rota com @catalog_view) monta
+o payload na primeira chamada e guarda o JSON já serializado + ETag (hash
+do conteúdo: igual em todos os workers). Com If-None-Match batendo, a
+resposta é 304 sem DB nem serialização.
+
+Invalidação: invalidate_catalog() nas rotas de create/update/delete de
+systems e tenants do super-admin (após o COMMIT). Nos outros workers a
+mudança aparece em até CATALOG_SNAPSHOT_TTL segundos, que também limita
+a desatualização de memberCount.
+"""
+from __future__ import annotations
+
+import hashlib
+import os
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from flask import current_app, request
+
+from app import queries as _queries  # noqa: F401 (registra as queries nomeadas)
+from app.db import after_commit, query_all
+
+CATALOG_SNAPSHOT_TTL = float(os.getenv("CATALOG_SNAPSHOT_TTL", "30"))
+# Limite de payloads guardados por snapshot (chave = slug vindo da URL)
+CATALOG_VIEW_KEYS_MAX = int(os.getenv("CATALOG_VIEW_KEYS_MAX", "256"))
+
+
+class CatalogData:
+    """Linhas do snapshot: catalog.active_systems e catalog.active_tenants."""
+
+    __slots__ = ("systems", "tenants")
+
+    def __init__(self, systems: List[Dict[str, Any]], tenants: List[Dict[str, Any]]) -> None:
+        self.systems = systems
+        self.tenants = tenants
+
+
+class CatalogPayload:
+    __slots__ = ("status", "body", "etag")
+
+    def __init__(self, status: int, body: bytes, etag: str) -> None:
+        self.status = status
+        self.body = body
+        self.etag = etag
+
+
+ViewFn = Callable[[CatalogData, Optional[str]], Tuple[int, Any]]
+_views: Dict[str, ViewFn] = {}
+
+
+def catalog_view(name: str):
+    """Registra uma view: fn(data, key) -> (status, objeto JSON)."""
+    def decorator(fn: ViewFn) -> ViewFn:
+        if name in _views:
+            raise ValueError(f"View de catálogo '{name}' já registrada")
+        _views[name] = fn
+        return fn
+    return decorator
+
+
+class CatalogSnapshot:
+    def __init__(self, version: int, data: CatalogData) -> None:
+        self.version = version
+        self.data = data
+        self.built_at = time.monotonic()
+        self._payloads: Dict[Tuple[str, Optional[str]], CatalogPayload] = {}
+        self._lock = threading.Lock()
+
+    def payload(self, view: str, key: Optional[str] = None) -> CatalogPayload:
+        cached = self._payloads.get((view, key))
+        if cached is not None:
+            return cached
+
+        status, obj = _views[view](self.data, key)
+        # Mesmo encoder do jsonify: bytes idênticos aos da resposta antiga
+        body = (current_app.json.dumps(obj) + "\n").encode("utf-8")
+        payload = CatalogPayload(status, body, hashlib.sha256(body).hexdigest()[:32])
+        with self._lock:
+            if len(self._payloads) < CATALOG_VIEW_KEYS_MAX:
+                self._payloads[(view, key)] = payload
+        return payload
+
+    def __len__(self) -> int:
+        return len(self._payloads)
+
+
+class CatalogStore:
+    def __init__(self, ttl: float) -> None:
+        self.ttl = ttl
+        self._snapshot: Optional[CatalogSnapshot] = None
+        self._version = 0
+        self._lock = threading.Lock()
+        self._build_lock = threading.Lock()
+        self.builds = 0
+        self.responses = 0
+        self.not_modified = 0
+
+    def _fresh(self, snap: Optional[CatalogSnapshot]) -> bool:
+        return (
+            snap is not None
+            and snap.version == self._version
+            and time.monotonic() - snap.built_at < self.ttl
+        )
+
+    def snapshot(self) -> CatalogSnapshot:
+        snap = self._snapshot
+        if self._fresh(snap):
+            return snap
+        with self._build_lock:
+            snap = self._snapshot
+            if self._fresh(snap):
+                return snap
+            version = self._version
+            # Primário: o rebuild costuma vir logo após uma edição do super-admin
+            data = CatalogData(
+                query_all("catalog.active_systems", primary=True),
+                query_all("catalog.active_tenants", primary=True),
+            )
+            snap = CatalogSnapshot(version, data)
+            with self._lock:
+                self.builds += 1
+                if self._version == version:
+                    self._snapshot = snap
+            return snap
+
+    def invalidate(self) -> None:
+        with self._lock:
+            self._version += 1
+            self._snapshot = None
+
+    def count(self, not_modified: bool) -> None:
+        with self._lock:
+            self.responses += 1
+            if not_modified:
+                self.not_modified += 1
+
+    def stats(self) -> Dict[str, Any]:
+        snap = self._snapshot
+        return {
+            "version": self._version,
+            "ttlSeconds": self.ttl,
+            "ageSeconds": round(time.monotonic() - snap.built_at, 1) if snap is not None else None,
+            "payloads": len(snap) if snap is not None else 0,
+            "builds": self.builds,
+            "responses": self.responses,
+            "notModified": self.not_modified,
+        }
+
+
+catalog = CatalogStore(CATALOG_SNAPSHOT_TTL)
+
+
+def catalog_response(view: str, key: Optional[str] = None, public: bool = True):
+    """
+    Resposta da view a partir do snapshot. public=True adiciona ETag e
+    responde 304 quando o If-None-Match do cliente bate.
+    """
+    payload = catalog.snapshot().payload(view, key)
+    if public and payload.status == 200 and request.if_none_match.contains_weak(payload.etag):
+        catalog.count(not_modified=True)
+        response = current_app.response_class(status=304)
+        response.set_etag(payload.etag)
+        response.headers["Cache-Control"] = "no-cache"
+        return response
+
+    catalog.count(not_modified=False)
+    response = current_app.response_class(payload.body, status=payload.status, mimetype="application/json")
+    if public and payload.status == 200:
+        response.set_etag(payload.etag)
+        response.headers["Cache-Control"] = "no-cache"
+    return response
+
+
+def invalidate_catalog() -> None:
+    """Descarta o snapshot deste worker (após o COMMIT, se em transaction())."""
+    after_commit(catalog.invalidate)
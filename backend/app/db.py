@@ -3,13 +3,24 @@ from __future__ import annotations
 import logging
 import os
 import re
+import threading
 import time
+from collections import Counter, OrderedDict
+from contextlib import contextmanager
+from contextvars import ContextVar
+from functools import lru_cache
 from pathlib import Path
-from typing import Any, Dict, List, Optional
+from typing import Any, Callable, Dict, Iterator, List, Optional, Sequence, Tuple, Union
 
-from sqlalchemy import create_engine, text
+from flask import Flask, g, has_app_context, has_request_context, request
+from sqlalchemy import create_engine, event, text
+from sqlalchemy.engine import Connection
+from sqlalchemy.sql.elements import TextClause
 from sqlalchemy.engine import Engine
-from sqlalchemy.exc import OperationalError, SQLAlchemyError
+from sqlalchemy.exc import DisconnectionError, OperationalError, SQLAlchemyError
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
+
+from app.cache import TTLCache
 
 logger = logging.getLogger(__name__)
 
@@ -29,6 +40,43 @@ if not MASTER_DATABASE_URL:
 
 ENV = os.getenv("ENV", "dev")
 
+# Pool do MASTER (gunicorn: workers x threads disputam este pool)
+MASTER_DB_POOL_SIZE = int(os.getenv("MASTER_DB_POOL_SIZE", "8"))
+MASTER_DB_MAX_OVERFLOW = int(os.getenv("MASTER_DB_MAX_OVERFLOW", "8"))
+MASTER_DB_POOL_RECYCLE = int(os.getenv("MASTER_DB_POOL_RECYCLE", "1800"))
+MASTER_DB_POOL_TIMEOUT = float(os.getenv("MASTER_DB_POOL_TIMEOUT", "10"))
+# Estratégia de pre-ping:
+#   "always" -> ping em todo checkout (padrão do SQLAlchemy com pool_pre_ping)
+#   "idle"   -> ping só se a conexão ficou parada mais que MASTER_DB_PRE_PING_IDLE_SECONDS
+#   "never"  -> sem ping (confia em pool_recycle)
+MASTER_DB_PRE_PING = os.getenv("MASTER_DB_PRE_PING", "idle").strip().lower()
+if MASTER_DB_PRE_PING not in ("always", "idle", "never"):
+    raise RuntimeError("MASTER_DB_PRE_PING must be 'always', 'idle' or 'never'.")
+MASTER_DB_PRE_PING_IDLE_SECONDS = float(os.getenv("MASTER_DB_PRE_PING_IDLE_SECONDS", "30"))
+
+# Réplicas de leitura do MASTER (opcional, URLs separadas por vírgula)
+MASTER_DB_REPLICA_URLS = [u.strip() for u in os.getenv("MASTER_DB_REPLICA_URLS", "").split(",") if u.strip()]
+# "round_robin" ou "least_latency"
+MASTER_DB_REPLICA_STRATEGY = os.getenv("MASTER_DB_REPLICA_STRATEGY", "round_robin").strip().lower()
+if MASTER_DB_REPLICA_STRATEGY not in ("round_robin", "least_latency"):
+    raise RuntimeError("MASTER_DB_REPLICA_STRATEGY must be 'round_robin' or 'least_latency'.")
+MASTER_DB_REPLICA_MAX_LAG_SECONDS = float(os.getenv("MASTER_DB_REPLICA_MAX_LAG_SECONDS", "5"))
+MASTER_DB_REPLICA_CHECK_SECONDS = float(os.getenv("MASTER_DB_REPLICA_CHECK_SECONDS", "10"))
+
+# Instrumentação por requisição (ver init_db_instrumentation)
+DB_INSTRUMENTATION = os.getenv("DB_INSTRUMENTATION", "1") == "1"
+DB_SLOW_REQUEST_QUERIES = int(os.getenv("DB_SLOW_REQUEST_QUERIES", "15"))
+DB_SLOW_REQUEST_MS = float(os.getenv("DB_SLOW_REQUEST_MS", "300"))
+DB_N_PLUS_ONE_THRESHOLD = int(os.getenv("DB_N_PLUS_ONE_THRESHOLD", "5"))
+
+# Linhas por lote no cursor server-side de fetch_iter
+FETCH_ITER_BATCH_SIZE = int(os.getenv("FETCH_ITER_BATCH_SIZE", "500"))
+
+# Cache de resultados de cached_fetch_one / cached_fetch_all (por worker).
+# TTL curto: é o atraso máximo com que os outros workers veem uma escrita
+QUERY_CACHE_TTL = float(os.getenv("QUERY_CACHE_TTL", "5"))
+QUERY_CACHE_MAX = int(os.getenv("QUERY_CACHE_MAX", "2000"))
+
 # Target (MySQL do Varzea onde os DBs dos tenants serão criados)
 TENANT_DB_HOST = os.getenv("TENANT_DB_HOST", "varzea-prime-db-1")
 TENANT_DB_PORT = int(os.getenv("TENANT_DB_PORT", "3306"))
@@ -38,27 +86,483 @@ TENANT_DB_PASS = os.getenv("TENANT_DB_PASS", "")
 if ENV != "dev" and not TENANT_DB_PASS:
     raise RuntimeError("TENANT_DB_PASS is required in non-dev environments.")
 
+# Registry de engines dos tenants (ver TenantEngineRegistry)
+TENANT_ENGINE_CACHE_MAX = int(os.getenv("TENANT_ENGINE_CACHE_MAX", "32"))
+TENANT_ENGINE_IDLE_SECONDS = int(os.getenv("TENANT_ENGINE_IDLE_SECONDS", "600"))
+TENANT_DB_POOL_SIZE = int(os.getenv("TENANT_DB_POOL_SIZE", "2"))
+TENANT_DB_MAX_OVERFLOW = int(os.getenv("TENANT_DB_MAX_OVERFLOW", "3"))
+
+# Modo de conexão nos DBs dos tenants:
+#   "database" -> um pool por (host, db_name) (registry LRU)
+#   "host"     -> um pool compartilhado por host; tenant_connection faz USE <db> ao pegar a
+#                 conexão e o pool volta ao schema neutro no check-in (evento reset)
+TENANT_DB_CONNECTION_MODE = os.getenv("TENANT_DB_CONNECTION_MODE", "database").strip().lower()
+if TENANT_DB_CONNECTION_MODE not in ("database", "host"):
+    raise RuntimeError("TENANT_DB_CONNECTION_MODE must be 'database' or 'host'.")
+TENANT_HOST_POOL_SIZE = int(os.getenv("TENANT_HOST_POOL_SIZE", "10"))
+TENANT_HOST_MAX_OVERFLOW = int(os.getenv("TENANT_HOST_MAX_OVERFLOW", "10"))
+# Schema neutro para onde a conexão volta ao ser devolvida ao pool
+TENANT_NEUTRAL_SCHEMA = "information_schema"
+
+# ============================================================
+# Instrumentação por requisição (queries, tempo, N+1)
+# ============================================================
+# Máximo de statements guardados por requisição (contadores seguem além disso)
+_DB_STATS_MAX_RECORDS = 500
+
+_FP_STRING_RE = re.compile(r"'(?:[^'\\]|\\.|'')*'")
+_FP_NUMBER_RE = re.compile(r"\b\d+(?:\.\d+)?\b")
+_FP_PARAM_RE = re.compile(r"%\(\w+\)s|%s|:\w+|\?")
+_FP_IN_LIST_RE = re.compile(r"\bIN\s*\((?:\s*\?\s*,)*\s*\?\s*\)", re.IGNORECASE)
+_FP_VALUES_RE = re.compile(r"\bVALUES\s*(\([^()]*\))(?:\s*,\s*\([^()]*\))+", re.IGNORECASE)
+_FP_SPACE_RE = re.compile(r"\s+")
+
+
+@lru_cache(maxsize=2048)
+def sql_fingerprint(statement: str) -> str:
+    """
+    Normaliza um statement para agrupar execuções da mesma query:
+    literais e parâmetros viram '?', listas IN/VALUES colapsam, espaços somem.
+    """
+    fp = _FP_STRING_RE.sub("?", statement)
+    fp = _FP_PARAM_RE.sub("?", fp)
+    fp = _FP_NUMBER_RE.sub("?", fp)
+    fp = _FP_IN_LIST_RE.sub("IN (?)", fp)
+    fp = _FP_VALUES_RE.sub(r"VALUES \1", fp)
+    return _FP_SPACE_RE.sub(" ", fp).strip()
+
+
+class RequestDbStats:
+    """Statements executados durante uma requisição Flask."""
+
+    __slots__ = ("count", "total_seconds", "records")
+
+    def __init__(self) -> None:
+        self.count = 0
+        self.total_seconds = 0.0
+        self.records: List[Tuple[str, float, int]] = []
+
+    def add(self, statement: str, seconds: float, rowcount: int) -> None:
+        self.count += 1
+        self.total_seconds += seconds
+        if len(self.records) < _DB_STATS_MAX_RECORDS:
+            self.records.append((sql_fingerprint(statement), seconds, rowcount))
+
+    def repeated(self, threshold: int) -> List[Tuple[str, int]]:
+        counts = Counter(fp for fp, _, _ in self.records)
+        return [(fp, n) for fp, n in counts.most_common() if n >= threshold]
+
+
+def current_db_stats() -> Optional[RequestDbStats]:
+    if not has_request_context():
+        return None
+    return g.get("_db_stats")
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany) -> None:
+    # No contexto da execução (morre com o statement), não em conn.info: se o
+    # statement falha o after não roda, e conn.info vive com a conexão do pool
+    context._query_started = time.perf_counter()
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany) -> None:
+    started = getattr(context, "_query_started", None)
+    if started is None:
+        return
+    elapsed = time.perf_counter() - started
+    stats = current_db_stats()
+    if stats is not None:
+        stats.add(statement, elapsed, cursor.rowcount if cursor.rowcount is not None else -1)
+
+
+def _instrument_engine(eng: Engine) -> Engine:
+    if DB_INSTRUMENTATION:
+        event.listen(eng, "before_cursor_execute", _before_cursor_execute)
+        event.listen(eng, "after_cursor_execute", _after_cursor_execute)
+    return eng
+
+
+def _db_stats_begin() -> None:
+    g._db_stats = RequestDbStats()
+
+
+def _db_stats_finish(response):
+    # Respostas em streaming: só entra o que rodou até aqui (ver app.streaming)
+    stats = g.pop("_db_stats", None)
+    if stats is None or stats.count == 0:
+        return response
+
+    db_ms = stats.total_seconds * 1000
+    response.headers.add("Server-Timing", f'db;dur={db_ms:.1f};desc="{stats.count} queries"')
+
+    if stats.count >= DB_SLOW_REQUEST_QUERIES or db_ms >= DB_SLOW_REQUEST_MS:
+        logger.warning(
+            "DB pesado: %s %s -> %d queries, %.1fms",
+            request.method, request.path, stats.count, db_ms,
+        )
+    for fp, n in stats.repeated(DB_N_PLUS_ONE_THRESHOLD):
+        logger.warning("Possível N+1 em %s %s: %dx %s", request.method, request.path, n, fp[:300])
+    return response
+
+
+def init_db_instrumentation(app: Flask) -> None:
+    """Registra os hooks de instrumentação de DB por requisição no app Flask."""
+    if not DB_INSTRUMENTATION:
+        return
+    app.before_request(_db_stats_begin)
+    app.after_request(_db_stats_finish)
+
+
 # ============================================================
 # Engines (cache simples)
 # ============================================================
 _master_engine: Optional[Engine] = None
 _target_admin_engines: Dict[str, Engine] = {}
+_tenant_host_engines: Dict[str, Engine] = {}
+_tenant_host_lock = threading.Lock()
+
+
+class PoolStats:
+    """Contadores de checkout de um pool (tempo de espera e timeouts)."""
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self.checkouts = 0
+        self.timeouts = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+        self.pings = 0
+        self.ping_failures = 0
+
+    def record_wait(self, seconds: float) -> None:
+        with self._lock:
+            self.checkouts += 1
+            self.wait_total += seconds
+            if seconds > self.wait_max:
+                self.wait_max = seconds
+
+    def record_timeout(self) -> None:
+        with self._lock:
+            self.timeouts += 1
+
+    def record_ping(self, failed: bool) -> None:
+        with self._lock:
+            self.pings += 1
+            if failed:
+                self.ping_failures += 1
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "checkouts": self.checkouts,
+                "checkoutTimeouts": self.timeouts,
+                "waitAvgMs": round(self.wait_total / self.checkouts * 1000, 3) if self.checkouts else 0.0,
+                "waitMaxMs": round(self.wait_max * 1000, 3),
+                "pings": self.pings,
+                "pingFailures": self.ping_failures,
+            }
+
+
+master_pool_stats_counters = PoolStats()
+
+
+def _on_master_checkin(dbapi_connection, connection_record) -> None:
+    connection_record.info["checked_in_at"] = time.monotonic()
+
+
+def _on_master_checkout(dbapi_connection, connection_record, connection_proxy) -> None:
+    """Pre-ping "idle": só pinga conexões paradas há mais de MASTER_DB_PRE_PING_IDLE_SECONDS."""
+    last = connection_record.info.get("checked_in_at")
+    if last is None or time.monotonic() - last < MASTER_DB_PRE_PING_IDLE_SECONDS:
+        return
+    cursor = dbapi_connection.cursor()
+    try:
+        cursor.execute("SELECT 1")
+        master_pool_stats_counters.record_ping(failed=False)
+    except Exception as e:
+        master_pool_stats_counters.record_ping(failed=True)
+        # o pool descarta a conexão e tenta outra
+        raise DisconnectionError() from e
+    finally:
+        try:
+            cursor.close()
+        except Exception:
+            pass
 
 
 def get_master_engine() -> Engine:
     """
     Engine do banco MASTER do Seletor (onde ficam systems/tenants/super_admins).
+    Pool configurável via MASTER_DB_* (ver ENV / CONFIG).
     """
     global _master_engine
     if _master_engine is None:
-        _master_engine = create_engine(
+        eng = create_engine(
             MASTER_DATABASE_URL,
-            pool_pre_ping=True,
+            pool_size=MASTER_DB_POOL_SIZE,
+            max_overflow=MASTER_DB_MAX_OVERFLOW,
+            pool_recycle=MASTER_DB_POOL_RECYCLE,
+            pool_timeout=MASTER_DB_POOL_TIMEOUT,
+            pool_pre_ping=MASTER_DB_PRE_PING == "always",
             future=True,
         )
+        if MASTER_DB_PRE_PING == "idle":
+            event.listen(eng.pool, "checkin", _on_master_checkin)
+            event.listen(eng.pool, "checkout", _on_master_checkout)
+        _master_engine = _instrument_engine(eng)
     return _master_engine
 
 
+def _master_connect() -> Connection:
+    """Checkout no pool do MASTER medindo espera e contando timeouts."""
+    eng = get_master_engine()
+    started = time.perf_counter()
+    try:
+        conn = eng.connect()
+    except PoolTimeoutError:
+        master_pool_stats_counters.record_timeout()
+        raise
+    master_pool_stats_counters.record_wait(time.perf_counter() - started)
+    return conn
+
+
+def master_pool_stats() -> Dict[str, Any]:
+    """Estado atual do pool do MASTER + contadores acumulados do processo."""
+    pool = get_master_engine().pool
+    stats: Dict[str, Any] = {
+        "pid": os.getpid(),
+        "poolSize": MASTER_DB_POOL_SIZE,
+        "maxOverflow": MASTER_DB_MAX_OVERFLOW,
+        "timeout": MASTER_DB_POOL_TIMEOUT,
+        "prePing": MASTER_DB_PRE_PING,
+        "checkedOut": pool.checkedout() if hasattr(pool, "checkedout") else None,
+        "checkedIn": pool.checkedin() if hasattr(pool, "checkedin") else None,
+        "overflow": pool.overflow() if hasattr(pool, "overflow") else None,
+    }
+    stats.update(master_pool_stats_counters.snapshot())
+    return stats
+
+
+# ============================================================
+# Réplicas de leitura
+# ============================================================
+class _Replica:
+    """Uma réplica de leitura: engine própria + saúde/lag/latência medidos."""
+
+    def __init__(self, url: str) -> None:
+        self.url = url
+        self.engine = create_engine(
+            url,
+            pool_size=MASTER_DB_POOL_SIZE,
+            max_overflow=MASTER_DB_MAX_OVERFLOW,
+            pool_recycle=MASTER_DB_POOL_RECYCLE,
+            pool_timeout=MASTER_DB_POOL_TIMEOUT,
+            pool_pre_ping=True,
+            future=True,
+        )
+        _instrument_engine(self.engine)
+        self.healthy = True
+        self.lag_seconds: Optional[float] = None
+        self.latency_ewma: Optional[float] = None
+        self.checked_at = 0.0
+        self.reads = 0
+        self.errors = 0
+
+    def observe_latency(self, seconds: float) -> None:
+        self.reads += 1
+        if self.latency_ewma is None:
+            self.latency_ewma = seconds
+        else:
+            self.latency_ewma = 0.8 * self.latency_ewma + 0.2 * seconds
+
+    def check(self) -> None:
+        """Mede lag de replicação; réplica parada ou atrasada sai da rotação."""
+        self.checked_at = time.monotonic()
+        started = time.perf_counter()
+        try:
+            with self.engine.connect() as conn:
+                lag = _replica_lag_seconds(conn)
+            self.observe_latency(time.perf_counter() - started)
+            self.lag_seconds = lag
+            self.healthy = lag is not None and lag <= MASTER_DB_REPLICA_MAX_LAG_SECONDS
+        except SQLAlchemyError as e:
+            logger.warning("Réplica indisponível (%s): %s", self.engine.url.host, e)
+            self.errors += 1
+            self.lag_seconds = None
+            self.healthy = False
+
+    def mark_down(self) -> None:
+        # Volta à rotação só depois do próximo check (MASTER_DB_REPLICA_CHECK_SECONDS)
+        self.errors += 1
+        self.healthy = False
+        self.checked_at = time.monotonic()
+
+
+def _replica_lag_seconds(conn: Connection) -> Optional[float]:
+    """
+    Seconds_Behind_Source (MySQL >= 8.0.22) ou Seconds_Behind_Master (legado).
+    None = replicação parada / não configurada.
+    """
+    for sql, col in (
+        ("SHOW REPLICA STATUS", "Seconds_Behind_Source"),
+        ("SHOW SLAVE STATUS", "Seconds_Behind_Master"),
+    ):
+        try:
+            row = conn.exec_driver_sql(sql).mappings().first()
+        except SQLAlchemyError:
+            continue
+        if row is None:
+            return None
+        lag = row.get(col)
+        return float(lag) if lag is not None else None
+    return None
+
+
+class ReplicaRouter:
+    """Escolhe a réplica de leitura (round-robin ou menor latência) entre as saudáveis."""
+
+    def __init__(self, urls: List[str], strategy: str) -> None:
+        self.replicas = [_Replica(u) for u in urls]
+        self.strategy = strategy
+        self._lock = threading.Lock()
+        self._rr = 0
+        self.primary_fallbacks = 0
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.replicas)
+
+    def _claim_due(self) -> List[_Replica]:
+        """Réplicas com check vencido (chamado com o lock). Quem pega, checa."""
+        now = time.monotonic()
+        due = [r for r in self.replicas if now - r.checked_at >= MASTER_DB_REPLICA_CHECK_SECONDS]
+        for r in due:
+            # Marca já: as outras threads não repetem o check enquanto este roda
+            r.checked_at = now
+        return due
+
+    def pick(self) -> Optional[_Replica]:
+        with self._lock:
+            due = self._claim_due()
+        # Check (ida à rede, com connect timeout) fora do lock: réplica morta
+        # não trava as leituras das outras threads
+        for r in due:
+            r.check()
+        with self._lock:
+            healthy = [r for r in self.replicas if r.healthy]
+            if not healthy:
+                self.primary_fallbacks += 1
+                return None
+            if self.strategy == "least_latency":
+                return min(healthy, key=lambda r: r.latency_ewma if r.latency_ewma is not None else 0.0)
+            self._rr = (self._rr + 1) % len(healthy)
+            return healthy[self._rr]
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "strategy": self.strategy,
+            "primaryFallbacks": self.primary_fallbacks,
+            "replicas": [
+                {
+                    "host": r.engine.url.host,
+                    "healthy": r.healthy,
+                    "lagSeconds": r.lag_seconds,
+                    "latencyMs": round(r.latency_ewma * 1000, 3) if r.latency_ewma is not None else None,
+                    "reads": r.reads,
+                    "errors": r.errors,
+                }
+                for r in self.replicas
+            ],
+        }
+
+
+replica_router = ReplicaRouter(MASTER_DB_REPLICA_URLS, MASTER_DB_REPLICA_STRATEGY)
+
+
+def mark_primary_sticky() -> None:
+    """
+    Read-your-writes: após uma escrita, o resto da requisição lê do primário.
+    Fora de contexto Flask (scripts, startup) não há o que marcar.
+    """
+    if has_app_context():
+        g._db_sticky_primary = True
+
+
+def is_primary_sticky() -> bool:
+    return has_app_context() and bool(g.get("_db_sticky_primary"))
+
+
+def _pick_replica(primary: bool) -> Optional[_Replica]:
+    if primary or not replica_router.enabled or is_primary_sticky():
+        return None
+    return replica_router.pick()
+
+
+def _read(primary: bool, run: Callable[[Connection], Any]) -> Any:
+    """
+    Executa run(conn) numa conexão de leitura: réplica quando habilitada,
+    saudável e sem escrita prévia nesta requisição; senão o primário.
+    OperationalError na réplica (conexão ou a própria query) tira a réplica
+    da rotação e a leitura é repetida uma vez no primário.
+    """
+    tx_conn = _current_tx.get()
+    if tx_conn is not None:
+        # dentro de transaction(): lê na própria transação
+        return run(tx_conn)
+
+    replica = _pick_replica(primary)
+    if replica is not None:
+        started = time.perf_counter()
+        try:
+            with replica.engine.connect() as conn:
+                result = run(conn)
+        except OperationalError as e:
+            logger.warning("Leitura na réplica falhou, usando primário: %s", e)
+            replica.mark_down()
+        else:
+            replica.observe_latency(time.perf_counter() - started)
+            return result
+
+    with _master_connect() as conn:
+        return run(conn)
+
+
+@contextmanager
+def _read_connection(primary: bool = False) -> Iterator[Connection]:
+    """
+    Conexão de leitura para streaming (fetch_iter), mesma escolha de _read.
+    Falha de conexão na réplica cai no primário; erro no meio do stream não
+    dá para repetir (linhas já entregues), só tira a réplica da rotação.
+    """
+    tx_conn = _current_tx.get()
+    if tx_conn is not None:
+        yield tx_conn
+        return
+
+    replica = _pick_replica(primary)
+    conn: Optional[Connection] = None
+    if replica is not None:
+        try:
+            conn = replica.engine.connect()
+        except OperationalError as e:
+            logger.warning("Leitura na réplica falhou, usando primário: %s", e)
+            replica.mark_down()
+
+    if replica is None or conn is None:
+        with _master_connect() as master_conn:
+            yield master_conn
+        return
+
+    started = time.perf_counter()
+    try:
+        with conn:
+            yield conn
+    except OperationalError:
+        replica.mark_down()
+        raise
+    replica.observe_latency(time.perf_counter() - started)
+
+
 def get_target_admin_engine(host: Optional[str] = None) -> Engine:
     """
     Engine para conectar no MySQL do Varzea SEM schema (apenas para CREATE/DROP DATABASE).
@@ -69,9 +573,8 @@ def get_target_admin_engine(host: Optional[str] = None) -> Engine:
         return _target_admin_engines[h]
 
     # Conexão "sem database" para comandos de administração
-    admin_url = f"mysql+pymysql://{TENANT_DB_USER}:{TENANT_DB_PASS}@{h}:{TENANT_DB_PORT}"
     eng = create_engine(
-        admin_url,
+        _build_host_url(h),
         isolation_level="AUTOCOMMIT",
         pool_pre_ping=True,
         future=True,
@@ -80,29 +583,692 @@ def get_target_admin_engine(host: Optional[str] = None) -> Engine:
     return eng
 
 
+def _build_host_url(host: str) -> str:
+    return f"mysql+pymysql://{TENANT_DB_USER}:{TENANT_DB_PASS}@{host}:{TENANT_DB_PORT}"
+
+
+def _reset_tenant_schema(dbapi_connection, connection_record, reset_state) -> None:
+    """
+    Evento reset do pool: roda no check-in (devolução da conexão), logo
+    antes do rollback do reset-on-return. Volta para um schema neutro para
+    que nenhuma query sem USE caia no DB de outro tenant. Se o USE falhar, a
+    conexão é invalidada (soft: o rollback ainda roda e o próximo checkout
+    reconecta) em vez de ser reaproveitada no schema anterior.
+    """
+    try:
+        cursor = dbapi_connection.cursor()
+        try:
+            cursor.execute(f"USE `{TENANT_NEUTRAL_SCHEMA}`")
+        finally:
+            cursor.close()
+    except Exception as e:
+        logger.warning("Falha ao voltar conexão de tenant para o schema neutro: %s", e)
+        connection_record.invalidate(e, soft=True)
+        return
+    connection_record.info.pop("tenant_db", None)
+
+
+def get_tenant_host_engine(host: Optional[str] = None) -> Engine:
+    """
+    Engine compartilhada por host para o modo TENANT_DB_CONNECTION_MODE=host.
+    Diferente da admin engine (AUTOCOMMIT), esta é transacional e multiplexa
+    todos os DBs de tenants do host: milhares de tenants custam só o tamanho do pool.
+    """
+    h = (host or "").strip() or TENANT_DB_HOST
+    eng = _tenant_host_engines.get(h)
+    if eng is not None:
+        return eng
+
+    with _tenant_host_lock:
+        eng = _tenant_host_engines.get(h)
+        if eng is None:
+            eng = create_engine(
+                f"{_build_host_url(h)}/{TENANT_NEUTRAL_SCHEMA}",
+                pool_size=TENANT_HOST_POOL_SIZE,
+                max_overflow=TENANT_HOST_MAX_OVERFLOW,
+                pool_recycle=1800,
+                pool_pre_ping=True,
+                future=True,
+            )
+            event.listen(eng.pool, "reset", _reset_tenant_schema)
+            _tenant_host_engines[h] = _instrument_engine(eng)
+    return eng
+
+
+class TenantEngineRegistry:
+    """
+    Cache LRU de engines dos DBs de tenants, chaveado por (host, db_name).
+
+    - max_size: ao estourar, a engine menos usada é removida e tem o pool descartado.
+    - idle_seconds: engines sem uso por mais tempo que isso expiram (pool descartado).
+    - hits/misses/evictions/expirations: contadores para métricas.
+    """
+
+    def __init__(self, max_size: int, idle_seconds: int) -> None:
+        self.max_size = max(1, max_size)
+        self.idle_seconds = idle_seconds
+        self._engines: "OrderedDict[Tuple[str, str], Tuple[Engine, float]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def _create(self, host: str, db_name: str) -> Engine:
+        eng = create_engine(
+            build_tenant_database_url(host, db_name),
+            pool_size=TENANT_DB_POOL_SIZE,
+            max_overflow=TENANT_DB_MAX_OVERFLOW,
+            pool_recycle=max(self.idle_seconds, 60),
+            pool_pre_ping=True,
+            future=True,
+        )
+        return _instrument_engine(eng)
+
+    def _expire_idle(self, now: float) -> List[Engine]:
+        if self.idle_seconds <= 0:
+            return []
+        expired: List[Engine] = []
+        for key, (eng, last_used) in list(self._engines.items()):
+            if now - last_used > self.idle_seconds:
+                del self._engines[key]
+                expired.append(eng)
+        self.expirations += len(expired)
+        return expired
+
+    def get(self, host: Optional[str], db_name: str) -> Engine:
+        key = ((host or "").strip() or TENANT_DB_HOST, db_name)
+        now = time.monotonic()
+        to_dispose: List[Engine] = []
+
+        with self._lock:
+            to_dispose.extend(self._expire_idle(now))
+
+            entry = self._engines.get(key)
+            if entry is not None:
+                self.hits += 1
+                eng = entry[0]
+                self._engines[key] = (eng, now)
+                self._engines.move_to_end(key)
+            else:
+                self.misses += 1
+                eng = self._create(*key)
+                self._engines[key] = (eng, now)
+                while len(self._engines) > self.max_size:
+                    _, (old, _) = self._engines.popitem(last=False)
+                    to_dispose.append(old)
+                    self.evictions += 1
+
+        # dispose fora do lock (fecha conexões via rede)
+        for old in to_dispose:
+            old.dispose()
+        return eng
+
+    def discard(self, host: Optional[str], db_name: str) -> None:
+        """Remove a engine do cache (ex: após DROP DATABASE)."""
+        key = ((host or "").strip() or TENANT_DB_HOST, db_name)
+        with self._lock:
+            entry = self._engines.pop(key, None)
+        if entry is not None:
+            entry[0].dispose()
+
+    def clear(self) -> None:
+        with self._lock:
+            engines = [eng for eng, _ in self._engines.values()]
+            self._engines.clear()
+        for eng in engines:
+            eng.dispose()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "size": len(self._engines),
+                "maxSize": self.max_size,
+                "idleSeconds": self.idle_seconds,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+            }
+
+
+tenant_engines = TenantEngineRegistry(TENANT_ENGINE_CACHE_MAX, TENANT_ENGINE_IDLE_SECONDS)
+
+
+def get_tenant_engine(target_host: Optional[str], db_name: str) -> Engine:
+    """
+    Engine do DB de um tenant (MySQL do Varzea), reaproveitada via registry LRU.
+    Não chamar dispose() na engine retornada: o pool é do registry.
+    """
+    return tenant_engines.get(target_host, db_name)
+
+
+@contextmanager
+def tenant_connection(target_host: Optional[str], db_name: str, begin: bool = False) -> Iterator[Connection]:
+    """
+    Conexão no DB de um tenant, respeitando TENANT_DB_CONNECTION_MODE.
+
+    - "database": conexão do pool dedicado (registry LRU).
+    - "host": conexão do pool do host com `USE <db_name>` no checkout;
+      ao devolver, o pool faz rollback e volta para o schema neutro.
+
+    A conexão sai sem transação aberta nos dois modos (o USE é commitado na
+    hora): quem recebe pode usar conn.begin() ou conn.commit() igual.
+    begin=True abre transação (commit no fim, rollback em erro).
+    """
+    if not re.match(r"^[A-Za-z0-9_]+$", db_name or ""):
+        raise ValueError("database_name inválido")
+
+    if TENANT_DB_CONNECTION_MODE == "host":
+        eng = get_tenant_host_engine(target_host)
+    else:
+        eng = get_tenant_engine(target_host, db_name)
+
+    with eng.connect() as conn:
+        if TENANT_DB_CONNECTION_MODE == "host":
+            conn.exec_driver_sql(f"USE `{db_name}`")
+            # O USE faz autobegin: fecha para o conn.begin() de quem recebe não falhar
+            conn.commit()
+            conn.connection.info["tenant_db"] = db_name
+        if begin:
+            with conn.begin():
+                yield conn
+        else:
+            yield conn
+
+
+def tenant_pool_stats() -> Dict[str, Any]:
+    """Resumo dos pools de tenants (registry por DB + pools por host)."""
+    return {
+        "mode": TENANT_DB_CONNECTION_MODE,
+        "registry": tenant_engines.stats(),
+        "hosts": {
+            h: {"checkedOut": eng.pool.checkedout(), "size": eng.pool.size()}
+            for h, eng in list(_tenant_host_engines.items())
+        },
+    }
+
+
+# ============================================================
+# Queries nomeadas (registry)
+# ============================================================
+class NamedQuery:
+    """
+    Query quente declarada uma vez: o text() é montado no registro (bind params
+    parseados uma vez por processo) e cada execução acumula contagem/tempo.
+    """
+
+    __slots__ = ("name", "sql", "statement", "calls", "total_seconds", "max_seconds", "_lock")
+
+    def __init__(self, name: str, sql: str) -> None:
+        self.name = name
+        self.sql = sql
+        self.statement: TextClause = text(sql)
+        self.calls = 0
+        self.total_seconds = 0.0
+        self.max_seconds = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, seconds: float) -> None:
+        with self._lock:
+            self.calls += 1
+            self.total_seconds += seconds
+            if seconds > self.max_seconds:
+                self.max_seconds = seconds
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "calls": self.calls,
+                "totalMs": round(self.total_seconds * 1000, 3),
+                "avgMs": round(self.total_seconds / self.calls * 1000, 3) if self.calls else 0.0,
+                "maxMs": round(self.max_seconds * 1000, 3),
+            }
+
+
+QUERY_REGISTRY: Dict[str, NamedQuery] = {}
+
+SqlLike = Union[str, NamedQuery]
+
+
+def register_query(name: str, sql: str) -> NamedQuery:
+    """Declara uma query nomeada. Nome duplicado é erro (inventário único)."""
+    if name in QUERY_REGISTRY:
+        raise ValueError(f"Query '{name}' já registrada")
+    nq = NamedQuery(name, sql)
+    QUERY_REGISTRY[name] = nq
+    return nq
+
+
+def get_query(name: str) -> NamedQuery:
+    return QUERY_REGISTRY[name]
+
+
+def named_query_stats() -> Dict[str, Any]:
+    return {name: nq.stats() for name, nq in sorted(QUERY_REGISTRY.items())}
+
+
+def _statement(sql: SqlLike) -> Tuple[TextClause, Optional[NamedQuery]]:
+    if isinstance(sql, NamedQuery):
+        return sql.statement, sql
+    return text(sql), None
+
+
+@contextmanager
+def _observe(nq: Optional[NamedQuery]) -> Iterator[None]:
+    if nq is None:
+        yield
+        return
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        nq.observe(time.perf_counter() - started)
+
+
+# ============================================================
+# Records enxutos (projeção explícita de colunas)
+# ============================================================
+class Record:
+    """
+    Base dos records de record_type(): uma linha com __slots__ em vez de dict.
+    Aceita row["col"] e row.get("col") para servir aos mesmos helpers de DTO.
+    """
+
+    __slots__ = ()
+    _fields: Tuple[str, ...] = ()
+
+    def __init__(self, *values: Any) -> None:
+        for name, value in zip(self._fields, values):
+            object.__setattr__(self, name, value)
+
+    def __getitem__(self, key: str) -> Any:
+        try:
+            return getattr(self, key)
+        except AttributeError:
+            raise KeyError(key) from None
+
+    def get(self, key: str, default: Any = None) -> Any:
+        return getattr(self, key, default)
+
+    def keys(self) -> Tuple[str, ...]:
+        return self._fields
+
+    def as_dict(self) -> Dict[str, Any]:
+        return {name: getattr(self, name) for name in self._fields}
+
+    def __repr__(self) -> str:
+        body = ", ".join(f"{n}={getattr(self, n, None)!r}" for n in self._fields)
+        return f"{type(self).__name__}({body})"
+
+
+def record_type(name: str, fields: Sequence[str]) -> type:
+    """Cria um tipo Record com __slots__ = fields (nomes de coluna/alias do SELECT)."""
+    fields = tuple(fields)
+    for f in fields:
+        if not f.isidentifier():
+            raise ValueError(f"Nome de coluna inválido para record: {f!r}")
+    return type(name, (Record,), {"__slots__": fields, "_fields": fields})
+
+
+def select_list(record: type, alias: Optional[str] = None, **overrides: str) -> str:
+    """
+    Lista de colunas do SELECT na ordem de record._fields.
+    overrides mapeia campo -> expressão (ex.: role="ut.role").
+    """
+    prefix = f"{alias}." if alias else ""
+    return ", ".join(overrides.get(f, f"{prefix}{f}") for f in record._fields)
+
+
 # ============================================================
 # SQL helpers (MASTER DB)
 # ============================================================
-def execute_sql(sql: str, params: Optional[Dict[str, Any]] = None) -> None:
-    eng = get_master_engine()
-    with eng.begin() as conn:
-        conn.execute(text(sql), params or {})
+_current_tx: ContextVar[Optional[Connection]] = ContextVar("_current_tx", default=None)
+_tx_after_commit: ContextVar[Optional[List[Any]]] = ContextVar("_tx_after_commit", default=None)
 
 
-def fetch_one(sql: str, params: Optional[Dict[str, Any]] = None) -> Optional[Dict[str, Any]]:
-    eng = get_master_engine()
-    with eng.connect() as conn:
-        res = conn.execute(text(sql), params or {})
-        row = res.mappings().first()
+@contextmanager
+def transaction() -> Iterator[Connection]:
+    """
+    Unit-of-work no MASTER: todas as chamadas de execute_sql/fetch_one/fetch_all
+    feitas dentro do bloco usam a mesma conexão e um único COMMIT no final
+    (ROLLBACK se sair por exceção). Aninhado, reaproveita a transação externa.
+
+    Uso:
+        with transaction():
+            execute_sql(...)
+            execute_sql(...)
+
+        @transaction()
+        def handler(): ...
+    """
+    outer = _current_tx.get()
+    if outer is not None:
+        yield outer
+        return
+
+    mark_primary_sticky()
+    callbacks: List[Any] = []
+    with _master_connect() as conn:
+        with conn.begin():
+            token = _current_tx.set(conn)
+            cb_token = _tx_after_commit.set(callbacks)
+            try:
+                yield conn
+            finally:
+                _tx_after_commit.reset(cb_token)
+                _current_tx.reset(token)
+
+    for fn in callbacks:
+        try:
+            fn()
+        except Exception:
+            logger.exception("Falha em callback after_commit")
+
+
+def in_transaction() -> bool:
+    return _current_tx.get() is not None
+
+
+def after_commit(fn) -> None:
+    """
+    Executa fn após o COMMIT da transação corrente (descartado em ROLLBACK).
+    Fora de transaction(), executa na hora. Uso típico: invalidar caches
+    só depois que o dado novo é visível para outras conexões.
+    """
+    callbacks = _tx_after_commit.get()
+    if callbacks is None:
+        fn()
+    else:
+        callbacks.append(fn)
+
+
+def execute_sql(
+    sql: SqlLike,
+    params: Optional[Dict[str, Any]] = None,
+    invalidates: Sequence[str] = (),
+) -> None:
+    """
+    Escrita no MASTER. invalidates: tags (tabelas) do cache de
+    cached_fetch_one/cached_fetch_all descartadas após o COMMIT, só neste
+    worker (os outros expiram pelo TTL).
+    """
+    mark_primary_sticky()
+    stmt, nq = _statement(sql)
+    with _observe(nq):
+        tx_conn = _current_tx.get()
+        if tx_conn is not None:
+            tx_conn.execute(stmt, params or {})
+        else:
+            with _master_connect() as conn:
+                with conn.begin():
+                    conn.execute(stmt, params or {})
+    if invalidates:
+        invalidate_query_cache(*invalidates)
+
+
+def execute_insert(sql: SqlLike, params: Optional[Dict[str, Any]] = None) -> int:
+    """INSERT de uma linha; retorna o id gerado (lastrowid), sem SELECT de volta."""
+    mark_primary_sticky()
+    stmt, nq = _statement(sql)
+    with _observe(nq):
+        tx_conn = _current_tx.get()
+        if tx_conn is not None:
+            return int(tx_conn.execute(stmt, params or {}).lastrowid)
+        with _master_connect() as conn:
+            with conn.begin():
+                return int(conn.execute(stmt, params or {}).lastrowid)
+
+
+def execute_many(sql: SqlLike, params_seq: Sequence[Dict[str, Any]]) -> int:
+    """
+    Mesmo SQL para várias linhas num único round trip (executemany do driver;
+    o PyMySQL reescreve INSERT ... VALUES em um INSERT multi-row).
+    Retorna o rowcount total.
+    """
+    if not params_seq:
+        return 0
+    mark_primary_sticky()
+    stmt, nq = _statement(sql)
+    with _observe(nq):
+        tx_conn = _current_tx.get()
+        if tx_conn is not None:
+            return tx_conn.execute(stmt, list(params_seq)).rowcount
+        with _master_connect() as conn:
+            with conn.begin():
+                return conn.execute(stmt, list(params_seq)).rowcount
+
+
+_IDENT_RE = re.compile(r"^[A-Za-z_][A-Za-z0-9_]*$")
+BULK_CHUNK_SIZE = 500
+
+
+def bulk_upsert(
+    table: str,
+    rows: Sequence[Dict[str, Any]],
+    on_duplicate: Optional[Union[str, Sequence[str]]] = None,
+    ignore: bool = False,
+    chunk_size: int = BULK_CHUNK_SIZE,
+) -> int:
+    """
+    INSERT multi-row (um statement por lote de chunk_size linhas).
+
+    - on_duplicate: lista de colunas -> "col = VALUES(col)";
+                    str -> cláusula crua após ON DUPLICATE KEY UPDATE (SQL fixo do código).
+    - ignore=True: INSERT IGNORE (linhas duplicadas/FK inválida viram warning e são puladas).
+
+    Todas as linhas precisam ter as mesmas chaves. Retorna o rowcount total.
+    """
+    if not rows:
+        return 0
+    if not _IDENT_RE.match(table):
+        raise ValueError(f"Tabela inválida: {table}")
+    columns = list(rows[0].keys())
+    for col in columns:
+        if not _IDENT_RE.match(col):
+            raise ValueError(f"Coluna inválida: {col}")
+
+    suffix = ""
+    if isinstance(on_duplicate, str):
+        suffix = f" ON DUPLICATE KEY UPDATE {on_duplicate}"
+    elif on_duplicate:
+        for col in on_duplicate:
+            if not _IDENT_RE.match(col):
+                raise ValueError(f"Coluna inválida: {col}")
+        suffix = " ON DUPLICATE KEY UPDATE " + ", ".join(f"{c} = VALUES({c})" for c in on_duplicate)
+
+    head = f"INSERT {'IGNORE ' if ignore else ''}INTO {table} ({', '.join(columns)}) VALUES "
+    size = max(1, chunk_size)
+    total = 0
+    with transaction():
+        for start in range(0, len(rows), size):
+            chunk = rows[start:start + size]
+            params: Dict[str, Any] = {}
+            values = []
+            for i, row in enumerate(chunk):
+                values.append("(" + ", ".join(f":{c}_{i}" for c in columns) + ")")
+                for c in columns:
+                    params[f"{c}_{i}"] = row[c]
+            total += _current_tx.get().execute(text(head + ", ".join(values) + suffix), params).rowcount
+    return total
+
+
+def fetch_one(
+    sql: SqlLike, params: Optional[Dict[str, Any]] = None, primary: bool = False
+) -> Optional[Dict[str, Any]]:
+    """SELECT de uma linha. primary=True força o primário (ignora réplicas)."""
+    stmt, nq = _statement(sql)
+
+    def run(conn: Connection) -> Optional[Dict[str, Any]]:
+        row = conn.execute(stmt, params or {}).mappings().first()
         return dict(row) if row else None
 
+    with _observe(nq):
+        return _read(primary, run)
 
-def fetch_all(sql: str, params: Optional[Dict[str, Any]] = None) -> List[Dict[str, Any]]:
-    eng = get_master_engine()
-    with eng.connect() as conn:
-        res = conn.execute(text(sql), params or {})
-        rows = res.mappings().all()
-        return [dict(r) for r in rows]
+
+def fetch_all(
+    sql: SqlLike, params: Optional[Dict[str, Any]] = None, primary: bool = False
+) -> List[Dict[str, Any]]:
+    """SELECT de várias linhas. primary=True força o primário (ignora réplicas)."""
+    stmt, nq = _statement(sql)
+
+    def run(conn: Connection) -> List[Dict[str, Any]]:
+        return [dict(r) for r in conn.execute(stmt, params or {}).mappings().all()]
+
+    with _observe(nq):
+        return _read(primary, run)
+
+
+# ============================================================
+# Cache de resultados (leituras quentes que quase não mudam)
+# ============================================================
+# Chave = (SQL, params); tags = tabelas lidas pela query. Escritas nessas
+# tabelas passam invalidates=[...] para execute_sql (ou chamam
+# invalidate_query_cache) e as entradas da tag saem após o COMMIT.
+# A invalidação é por worker: os outros workers do gunicorn seguem com o valor
+# antigo até o TTL (QUERY_CACHE_TTL, curto de propósito). Só cachear leitura
+# que tolera esse atraso. Hits/misses/evictions em cache_stats().
+query_cache = TTLCache("db.query_cache", QUERY_CACHE_MAX, QUERY_CACHE_TTL)
+
+# Um load iniciado antes de uma invalidação não é guardado
+_query_cache_generation = 0
+_query_cache_lock = threading.Lock()
+
+
+def _query_cache_key(sql: SqlLike, params: Optional[Dict[str, Any]]) -> Optional[Tuple[Any, ...]]:
+    key_sql = sql.name if isinstance(sql, NamedQuery) else sql
+    try:
+        key = (key_sql, tuple(sorted((params or {}).items())))
+        hash(key)
+    except TypeError:
+        return None  # params não-hasheáveis: sem cache
+    return key
+
+
+def _cached_fetch(loader, sql: SqlLike, params: Optional[Dict[str, Any]], tags: Sequence[str], ttl: Optional[float]):
+    # Dentro de transaction() a leitura precisa ver as escritas da própria transação
+    key = None if in_transaction() else _query_cache_key(sql, params)
+    if key is None:
+        return loader(sql, params)
+
+    cached = query_cache.get(key)
+    if cached is not None:
+        return cached[0]
+
+    generation = _query_cache_generation
+    # Primário: um miss costuma vir logo após a invalidação de uma escrita
+    value = loader(sql, params, primary=True)
+    with _query_cache_lock:
+        if generation == _query_cache_generation:
+            query_cache.set(key, (value,), ttl=ttl, tags=tags)
+    return value
+
+
+def cached_fetch_one(
+    sql: SqlLike,
+    params: Optional[Dict[str, Any]] = None,
+    tags: Sequence[str] = (),
+    ttl: Optional[float] = None,
+) -> Optional[Dict[str, Any]]:
+    """
+    fetch_one com cache (TTL + LRU) por worker. tags: tabelas que a query lê.
+    Após uma escrita, outros workers podem devolver o valor antigo por até
+    ttl (padrão QUERY_CACHE_TTL). O resultado é compartilhado entre
+    requisições: não alterar.
+    """
+    return _cached_fetch(fetch_one, sql, params, tags, ttl)
+
+
+def cached_fetch_all(
+    sql: SqlLike,
+    params: Optional[Dict[str, Any]] = None,
+    tags: Sequence[str] = (),
+    ttl: Optional[float] = None,
+) -> List[Dict[str, Any]]:
+    """fetch_all com cache (ver cached_fetch_one)."""
+    return _cached_fetch(fetch_all, sql, params, tags, ttl)
+
+
+def _drop_query_cache_tags(tags: Tuple[str, ...]) -> None:
+    global _query_cache_generation
+    with _query_cache_lock:
+        _query_cache_generation += 1
+    for tag in tags:
+        query_cache.invalidate_tag(tag)
+
+
+def invalidate_query_cache(*tags: str) -> None:
+    """
+    Descarta as entradas das tags (após o COMMIT, se em transaction()).
+    Só no cache deste worker: nos outros a entrada vive até o TTL.
+    """
+    if tags:
+        after_commit(lambda: _drop_query_cache_tags(tags))
+
+
+def fetch_rows(
+    sql: SqlLike,
+    params: Optional[Dict[str, Any]] = None,
+    primary: bool = False,
+    record: Optional[type] = None,
+) -> List[Any]:
+    """
+    SELECT enxuto: tuplas cruas do driver, sem dict por linha.
+    Com record=<tipo de record_type()>, cada tupla vira um record com __slots__
+    (a ordem das colunas do SELECT deve seguir record._fields; use select_list).
+    """
+    stmt, nq = _statement(sql)
+    with _observe(nq):
+        rows = _read(primary, lambda conn: conn.execute(stmt, params or {}).fetchall())
+    if record is None:
+        return [tuple(r) for r in rows]
+    return [record(*r) for r in rows]
+
+
+def fetch_iter(
+    sql: SqlLike,
+    params: Optional[Dict[str, Any]] = None,
+    primary: bool = False,
+    batch_size: Optional[int] = None,
+    record: Optional[type] = None,
+) -> Iterator[Any]:
+    """
+    SELECT em streaming: cursor server-side (stream_results) lendo em lotes
+    de batch_size, uma linha por vez como dict (ou record, ver fetch_rows).
+    Memória constante.
+
+    A conexão fica presa até o gerador terminar ou ser fechado; não executar
+    outras queries na mesma transação enquanto itera (MySQL não permite).
+    """
+    stmt, nq = _statement(sql)
+    size = batch_size or FETCH_ITER_BATCH_SIZE
+    with _observe(nq), _read_connection(primary) as conn:
+        res = conn.execution_options(stream_results=True, yield_per=size).execute(stmt, params or {})
+        try:
+            if record is None:
+                for row in res.mappings():
+                    yield dict(row)
+            else:
+                for row in res:
+                    yield record(*row)
+        finally:
+            res.close()
+
+
+def query_one(name: str, params: Optional[Dict[str, Any]] = None, primary: bool = False) -> Optional[Dict[str, Any]]:
+    """fetch_one de uma query registrada, pelo nome."""
+    return fetch_one(get_query(name), params, primary)
+
+
+def query_all(name: str, params: Optional[Dict[str, Any]] = None, primary: bool = False) -> List[Dict[str, Any]]:
+    """fetch_all de uma query registrada, pelo nome."""
+    return fetch_all(get_query(name), params, primary)
+
+
+def query_execute(name: str, params: Optional[Dict[str, Any]] = None) -> None:
+    """execute_sql de uma query registrada, pelo nome."""
+    execute_sql(get_query(name), params)
 
 
 def safe_db_error(err: Exception) -> str:
@@ -292,6 +1458,7 @@ def drop_physical_database(target_host: Optional[str], db_name: str) -> None:
     Remove o database físico no MySQL do Varzea.
     """
     host = (target_host or "").strip() or TENANT_DB_HOST
+    tenant_engines.discard(host, db_name)
     eng = get_target_admin_engine(host)
     with eng.connect() as conn:
         conn.execute(text(f"DROP DATABASE IF EXISTS `{db_name}`"))
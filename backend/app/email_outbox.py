@@ -0,0 +1,514 @@
+"""
+Outbox de emails (tabela email_outbox no MASTER, migration 013).
+
+As rotas só enfileiram (enqueue_email / enqueue_verification_email): um
+INSERT, dentro da transação do request quando houver uma. Uma thread por
+worker drena a fila em lotes de EMAIL_OUTBOX_BATCH_SIZE:
+
+- claim: o lote é marcado com claim_token + locked_until (lease de
+  EMAIL_OUTBOX_LEASE_SECONDS); outros workers/nós não pegam as mesmas
+  linhas, e o lote de um worker que morreu volta para a fila quando o
+  lease expira.
+- envio: o lote é dividido entre até EMAIL_SMTP_POOL_SIZE sessões SMTP
+  (autenticadas se SMTP_USER estiver definido), reaproveitadas entre lotes
+  (fechadas após EMAIL_SMTP_MAX_IDLE_SECONDS sem uso).
+- falha temporária (conexão, 4xx): nova tentativa com backoff exponencial
+  (EMAIL_OUTBOX_RETRY_BASE_SECONDS, limitado a EMAIL_OUTBOX_MAX_BACKOFF_SECONDS);
+  erro permanente (5xx) ou EMAIL_OUTBOX_MAX_ATTEMPTS esgotado -> failed.
+
+Os horários da tabela são UTC gerados pela aplicação (utcnow).
+
+O sender sobe só com SMTP_HOST definido. Teste local com um SMTP de mentira
+(sem TLS nem AUTH), ex.: aiosmtpd:
+
+    python -m aiosmtpd -n -l localhost:8025
+    SMTP_HOST=localhost SMTP_PORT=8025 SMTP_STARTTLS=0  (SMTP_USER/SMTP_PASS vazios)
+"""
+from __future__ import annotations
+
+import atexit
+import datetime
+import logging
+import os
+import random
+import secrets
+import smtplib
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+from app.db import after_commit, execute_many, execute_sql, fetch_all
+from app.email_service import (
+    SMTP_HOST, SMTP_PASS, SMTP_PORT, SMTP_STARTTLS, SMTP_TIMEOUT, SMTP_USER,
+    build_message, is_smtp_configured, verification_email,
+)
+
+logger = logging.getLogger(__name__)
+
+EMAIL_OUTBOX_SENDER = os.getenv("EMAIL_OUTBOX_SENDER", "1") == "1"
+EMAIL_OUTBOX_POLL_SECONDS = float(os.getenv("EMAIL_OUTBOX_POLL_SECONDS", "5"))
+EMAIL_OUTBOX_BATCH_SIZE = int(os.getenv("EMAIL_OUTBOX_BATCH_SIZE", "50"))
+EMAIL_OUTBOX_LEASE_SECONDS = float(os.getenv("EMAIL_OUTBOX_LEASE_SECONDS", "120"))
+EMAIL_OUTBOX_MAX_ATTEMPTS = int(os.getenv("EMAIL_OUTBOX_MAX_ATTEMPTS", "8"))
+EMAIL_OUTBOX_RETRY_BASE_SECONDS = float(os.getenv("EMAIL_OUTBOX_RETRY_BASE_SECONDS", "30"))
+EMAIL_OUTBOX_MAX_BACKOFF_SECONDS = float(os.getenv("EMAIL_OUTBOX_MAX_BACKOFF_SECONDS", "3600"))
+EMAIL_OUTBOX_RETENTION_DAYS = int(os.getenv("EMAIL_OUTBOX_RETENTION_DAYS", "7"))
+EMAIL_SMTP_POOL_SIZE = int(os.getenv("EMAIL_SMTP_POOL_SIZE", "2"))
+EMAIL_SMTP_MAX_IDLE_SECONDS = float(os.getenv("EMAIL_SMTP_MAX_IDLE_SECONDS", "60"))
+
+_CLEANUP_INTERVAL_SECONDS = 3600
+
+
+def _close_quietly(server: smtplib.SMTP) -> None:
+    try:
+        server.quit()
+    except Exception:
+        try:
+            server.close()
+        except Exception:
+            pass
+
+
+def _is_permanent(err: Exception) -> bool:
+    """5xx do servidor: reenviar não adianta."""
+    if isinstance(err, smtplib.SMTPRecipientsRefused):
+        codes = [code for code, _msg in err.recipients.values()]
+        return bool(codes) and all(code >= 500 for code in codes)
+    if isinstance(err, smtplib.SMTPResponseException):
+        return err.smtp_code >= 500 and not isinstance(err, smtplib.SMTPAuthenticationError)
+    return False
+
+
+# Mensagem recusada com a sessão ainda utilizável (o smtplib já fez RSET)
+_MESSAGE_ERRORS = (smtplib.SMTPRecipientsRefused, smtplib.SMTPSenderRefused, smtplib.SMTPDataError)
+
+
+# ============================================================
+# Pool de sessões SMTP
+# ============================================================
+class SmtpPool:
+    """
+    Sessões SMTP já conectadas (STARTTLS + login) guardadas para reuso.
+
+    Até size sessões ficam ociosas no pool; sessões ociosas há mais de
+    max_idle segundos são fechadas (o servidor costuma derrubá-las antes).
+    """
+
+    def __init__(
+        self,
+        host: str,
+        port: int,
+        user: Optional[str] = None,
+        password: Optional[str] = None,
+        starttls: bool = True,
+        timeout: float = 15.0,
+        size: int = 2,
+        max_idle: float = 60.0,
+    ) -> None:
+        self.host = host
+        self.port = port
+        self.user = user
+        self.password = password
+        self.starttls = starttls
+        self.timeout = timeout
+        self.size = max(1, size)
+        self.max_idle = max_idle
+        self._idle: List[Tuple[smtplib.SMTP, float]] = []
+        self._lock = threading.Lock()
+        self.opened = 0
+        self.reused = 0
+        self.discarded = 0
+
+    def _connect(self) -> smtplib.SMTP:
+        server = smtplib.SMTP(self.host, self.port, timeout=self.timeout)
+        try:
+            if self.starttls:
+                server.starttls()
+            if self.user:
+                server.login(self.user, self.password or "")
+        except Exception:
+            _close_quietly(server)
+            raise
+        with self._lock:
+            self.opened += 1
+        return server
+
+    def acquire(self) -> Tuple[smtplib.SMTP, bool]:
+        """(sessão, reaproveitada?). Sessões ociosas expiradas são descartadas."""
+        while True:
+            with self._lock:
+                if not self._idle:
+                    break
+                server, last_used = self._idle.pop()
+                fresh = time.monotonic() - last_used < self.max_idle
+                if fresh:
+                    self.reused += 1
+                else:
+                    self.discarded += 1
+            if fresh:
+                return server, True
+            _close_quietly(server)
+        return self._connect(), False
+
+    def release(self, server: smtplib.SMTP) -> None:
+        with self._lock:
+            if len(self._idle) < self.size:
+                self._idle.append((server, time.monotonic()))
+                return
+        _close_quietly(server)
+
+    def discard(self, server: smtplib.SMTP) -> None:
+        with self._lock:
+            self.discarded += 1
+        _close_quietly(server)
+
+    def prune(self) -> None:
+        """Fecha as sessões ociosas há mais de max_idle."""
+        now = time.monotonic()
+        with self._lock:
+            expired = [s for s, used in self._idle if now - used >= self.max_idle]
+            self._idle = [(s, used) for s, used in self._idle if now - used < self.max_idle]
+            self.discarded += len(expired)
+        for server in expired:
+            _close_quietly(server)
+
+    def close_all(self) -> None:
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for server, _used in idle:
+            _close_quietly(server)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "size": self.size,
+                "idle": len(self._idle),
+                "opened": self.opened,
+                "reused": self.reused,
+                "discarded": self.discarded,
+            }
+
+
+# ============================================================
+# Outbox
+# ============================================================
+class EmailOutbox:
+    """
+    Fila durável de emails com uma thread de envio por processo.
+
+    - enqueue(): INSERT em email_outbox; acorda o sender após o COMMIT.
+    - drain(): envia um lote (claim -> SMTP -> marca sent/retry/failed).
+    """
+
+    def __init__(
+        self,
+        pool: SmtpPool,
+        batch_size: int,
+        poll_seconds: float,
+        lease_seconds: float,
+        max_attempts: int,
+        retry_base: float,
+        max_backoff: float,
+    ) -> None:
+        self.pool = pool
+        self.batch_size = max(1, batch_size)
+        self.poll_seconds = poll_seconds
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max(1, max_attempts)
+        self.retry_base = retry_base
+        self.max_backoff = max_backoff
+        self._lock = threading.Lock()
+        self._drain_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._pid = 0
+        self._last_cleanup = 0.0
+        self.enqueued = 0
+        self.sent = 0
+        self.retried = 0
+        self.failed = 0
+        self.batches = 0
+        self.errors = 0
+        self.last_batch_ms = 0.0
+
+    # ---------- produtor ----------
+    def enqueue(self, to: str, subject: str, html_body: str, text_body: str = "") -> None:
+        """Enfileira o email (participa da transaction() corrente, se houver)."""
+        execute_sql(
+            """
+            INSERT INTO email_outbox (to_address, subject, html_body, text_body, next_attempt_at, created_at)
+            VALUES (:to, :subject, :html, :text, :now, :now)
+            """,
+            {
+                "to": to,
+                "subject": subject,
+                "html": html_body,
+                "text": text_body or None,
+                "now": datetime.datetime.utcnow(),
+            },
+        )
+        after_commit(self._enqueued)
+
+    def _enqueued(self) -> None:
+        with self._lock:
+            self.enqueued += 1
+        self.wake()
+
+    def wake(self) -> None:
+        if not EMAIL_OUTBOX_SENDER:
+            return
+        self.start()
+        self._wakeup.set()
+
+    # ---------- sender ----------
+    def start(self) -> None:
+        """Sobe a thread de envio deste processo (recria após fork do gunicorn)."""
+        if self._thread is not None and self._pid == os.getpid() and self._thread.is_alive():
+            return
+        with self._lock:
+            if self._thread is not None and self._pid == os.getpid() and self._thread.is_alive():
+                return
+            self._pid = os.getpid()
+            self._executor = ThreadPoolExecutor(max_workers=self.pool.size, thread_name_prefix="email-smtp")
+            self._thread = threading.Thread(target=self._run, name="email-outbox", daemon=True)
+            self._thread.start()
+
+    def _run(self) -> None:
+        while True:
+            self._wakeup.wait(self.poll_seconds)
+            self._wakeup.clear()
+            try:
+                while self.drain() >= self.batch_size:
+                    pass
+                self._maybe_cleanup()
+            except Exception:
+                with self._lock:
+                    self.errors += 1
+                logger.exception("Falha ao drenar email_outbox")
+            self.pool.prune()
+
+    def _claim(self) -> List[Any]:
+        now = datetime.datetime.utcnow()
+        candidates = fetch_all(
+            """
+            SELECT id FROM email_outbox
+            WHERE status = 'pending' AND next_attempt_at <= :now
+              AND (locked_until IS NULL OR locked_until < :now)
+            ORDER BY id
+            LIMIT :limit
+            """,
+            {"now": now, "limit": self.batch_size},
+            primary=True,
+        )
+        if not candidates:
+            return []
+
+        params: Dict[str, Any] = {f"id{i}": r["id"] for i, r in enumerate(candidates)}
+        token = secrets.token_hex(16)
+        # A condição é reavaliada linha a linha: quem chegou antes fica com a linha
+        execute_sql(
+            f"""
+            UPDATE email_outbox
+            SET claim_token = :token, locked_until = :lease
+            WHERE id IN ({', '.join(f':{k}' for k in params)})
+              AND status = 'pending'
+              AND (locked_until IS NULL OR locked_until < :now)
+            """,
+            {
+                **params,
+                "token": token,
+                "now": now,
+                "lease": now + datetime.timedelta(seconds=self.lease_seconds),
+            },
+        )
+        return fetch_all(
+            """
+            SELECT id, to_address, subject, html_body, text_body, attempts
+            FROM email_outbox
+            WHERE claim_token = :token AND status = 'pending'
+            ORDER BY id
+            """,
+            {"token": token},
+            primary=True,
+        )
+
+    def _send_chunk(self, rows: Sequence[Any]) -> List[Tuple[Any, Optional[Exception]]]:
+        """
+        Envia as linhas numa mesma sessão SMTP; retorna (linha, erro) por linha.
+        Se a conexão com o SMTP falha, o resto da fatia sai com o mesmo erro sem
+        tentar: cada linha esperaria SMTP_TIMEOUT e o lote estouraria o lease.
+        """
+        results: List[Tuple[Any, Optional[Exception]]] = []
+        server: Optional[smtplib.SMTP] = None
+        reused = False
+        connect_error: Optional[Exception] = None
+        try:
+            for row in rows:
+                if connect_error is not None:
+                    results.append((row, connect_error))
+                    continue
+                error: Optional[Exception] = None
+                msg = build_message(row["to_address"], row["subject"], row["html_body"], row.get("text_body") or "")
+                for _attempt in range(2):
+                    if server is None:
+                        try:
+                            server, reused = self.pool.acquire()
+                        except Exception as e:
+                            error = connect_error = e
+                            break
+                    try:
+                        server.send_message(msg)
+                        error = None
+                        break
+                    except _MESSAGE_ERRORS as e:
+                        error = e
+                        break
+                    except Exception as e:
+                        error = e
+                        self.pool.discard(server)
+                        server = None
+                        # Sessão reaproveitada pode ter sido derrubada pelo servidor: tenta numa nova
+                        if not reused:
+                            break
+                results.append((row, error))
+        finally:
+            if server is not None:
+                self.pool.release(server)
+        return results
+
+    def _backoff(self, attempts: int) -> float:
+        delay = min(self.max_backoff, self.retry_base * (2 ** max(0, attempts - 1)))
+        return delay * random.uniform(0.8, 1.2)
+
+    def _record(self, results: Sequence[Tuple[Any, Optional[Exception]]]) -> None:
+        now = datetime.datetime.utcnow()
+        sent_ids = [row["id"] for row, error in results if error is None]
+        if sent_ids:
+            params: Dict[str, Any] = {f"id{i}": sid for i, sid in enumerate(sent_ids)}
+            execute_sql(
+                f"""
+                UPDATE email_outbox
+                SET status = 'sent', sent_at = :now, attempts = attempts + 1,
+                    claim_token = NULL, locked_until = NULL, last_error = NULL
+                WHERE id IN ({', '.join(f':{k}' for k in params)})
+                """,
+                {**params, "now": now},
+            )
+
+        failures: List[Dict[str, Any]] = []
+        retried = failed = 0
+        for row, error in results:
+            if error is None:
+                continue
+            attempts = int(row["attempts"] or 0) + 1
+            give_up = attempts >= self.max_attempts or _is_permanent(error)
+            if give_up:
+                failed += 1
+                logger.warning("Email %s para %s descartado: %s", row["id"], row["to_address"], error)
+            else:
+                retried += 1
+            failures.append({
+                "id": row["id"],
+                "attempts": attempts,
+                "status": "failed" if give_up else "pending",
+                "next_attempt_at": now + datetime.timedelta(seconds=self._backoff(attempts)),
+                "last_error": str(error)[:500],
+            })
+        execute_many(
+            """
+            UPDATE email_outbox
+            SET status = :status, attempts = :attempts, next_attempt_at = :next_attempt_at,
+                last_error = :last_error, claim_token = NULL, locked_until = NULL
+            WHERE id = :id
+            """,
+            failures,
+        )
+
+        with self._lock:
+            self.sent += len(sent_ids)
+            self.retried += retried
+            self.failed += failed
+
+    def drain(self) -> int:
+        """Envia um lote. Retorna quantos emails foram processados (enviados ou não)."""
+        with self._drain_lock:
+            rows = self._claim()
+            if not rows:
+                return 0
+
+            started = time.perf_counter()
+            lanes = min(self.pool.size, len(rows))
+            chunks = [rows[i::lanes] for i in range(lanes)]
+            if self._executor is None or lanes == 1:
+                chunk_results = [self._send_chunk(chunk) for chunk in chunks]
+            else:
+                chunk_results = list(self._executor.map(self._send_chunk, chunks))
+
+            self._record([item for chunk in chunk_results for item in chunk])
+            with self._lock:
+                self.batches += 1
+                self.last_batch_ms = (time.perf_counter() - started) * 1000
+            return len(rows)
+
+    def _maybe_cleanup(self) -> None:
+        if EMAIL_OUTBOX_RETENTION_DAYS <= 0:
+            return
+        if time.monotonic() - self._last_cleanup < _CLEANUP_INTERVAL_SECONDS:
+            return
+        self._last_cleanup = time.monotonic()
+        execute_sql(
+            "DELETE FROM email_outbox WHERE status = 'sent' AND sent_at < :cutoff",
+            {"cutoff": datetime.datetime.utcnow() - datetime.timedelta(days=EMAIL_OUTBOX_RETENTION_DAYS)},
+        )
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            stats = {
+                "senderRunning": self._thread is not None and self._pid == os.getpid() and self._thread.is_alive(),
+                "batchSize": self.batch_size,
+                "enqueued": self.enqueued,
+                "sent": self.sent,
+                "retried": self.retried,
+                "failed": self.failed,
+                "batches": self.batches,
+                "errors": self.errors,
+                "lastBatchMs": round(self.last_batch_ms, 2),
+            }
+        stats["smtp"] = self.pool.stats()
+        return stats
+
+
+email_outbox = EmailOutbox(
+    SmtpPool(
+        SMTP_HOST, SMTP_PORT, SMTP_USER, SMTP_PASS,
+        starttls=SMTP_STARTTLS, timeout=SMTP_TIMEOUT,
+        size=EMAIL_SMTP_POOL_SIZE, max_idle=EMAIL_SMTP_MAX_IDLE_SECONDS,
+    ),
+    batch_size=EMAIL_OUTBOX_BATCH_SIZE,
+    poll_seconds=EMAIL_OUTBOX_POLL_SECONDS,
+    lease_seconds=EMAIL_OUTBOX_LEASE_SECONDS,
+    max_attempts=EMAIL_OUTBOX_MAX_ATTEMPTS,
+    retry_base=EMAIL_OUTBOX_RETRY_BASE_SECONDS,
+    max_backoff=EMAIL_OUTBOX_MAX_BACKOFF_SECONDS,
+)
+
+
+def enqueue_email(to: str, subject: str, html_body: str, text_body: str = "") -> None:
+    email_outbox.enqueue(to, subject, html_body, text_body)
+
+
+def enqueue_verification_email(to: str, name: str, token: str) -> None:
+    email_outbox.enqueue(to, *verification_email(name, token))
+
+
+def start_email_sender() -> None:
+    """Sobe o sender no boot (drena o que ficou pendente de execuções anteriores)."""
+    if EMAIL_OUTBOX_SENDER and is_smtp_configured():
+        email_outbox.start()
+
+
+@atexit.register
+def _close_smtp_sessions() -> None:
+    email_outbox.pool.close_all()
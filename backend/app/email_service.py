@@ -5,6 +5,7 @@ import os
 import smtplib
 from email.mime.multipart import MIMEMultipart
 from email.mime.text import MIMEText
+from typing import Tuple
 
 logger = logging.getLogger(__name__)
 
@@ -14,32 +15,43 @@ SMTP_USER = os.getenv("SMTP_USER", "")
 SMTP_PASS = os.getenv("SMTP_PASS", "")
 SMTP_FROM = os.getenv("SMTP_FROM", "noreply@varzeaprime.com.br")
 SMTP_FROM_NAME = os.getenv("SMTP_FROM_NAME", "Varzea Prime")
+SMTP_STARTTLS = os.getenv("SMTP_STARTTLS", "1") == "1"
+SMTP_TIMEOUT = float(os.getenv("SMTP_TIMEOUT", "15"))
 APP_BASE_URL = os.getenv("APP_BASE_URL", "https://varzeaprime.com.br")
 
 
 def is_smtp_configured() -> bool:
-    return bool(SMTP_HOST and SMTP_USER and SMTP_PASS)
+    """SMTP_HOST is enough: SMTP_USER/SMTP_PASS are only needed if the server requires AUTH."""
+    return bool(SMTP_HOST)
+
+
+def build_message(to: str, subject: str, html_body: str, text_body: str = "") -> MIMEMultipart:
+    """Build the multipart (text + html) message."""
+    msg = MIMEMultipart("alternative")
+    msg["From"] = f"{SMTP_FROM_NAME} <{SMTP_FROM}>"
+    msg["To"] = to
+    msg["Subject"] = subject
+
+    if text_body:
+        msg.attach(MIMEText(text_body, "plain", "utf-8"))
+    msg.attach(MIMEText(html_body, "html", "utf-8"))
+    return msg
 
 
 def send_email(to: str, subject: str, html_body: str, text_body: str = "") -> bool:
-    """Send email via SMTP. Returns True on success, False on failure."""
+    """Send email via SMTP right away (blocking). Routes use app.email_outbox instead."""
     if not is_smtp_configured():
         logger.warning("SMTP not configured, skipping email to %s", to)
         return False
 
     try:
-        msg = MIMEMultipart("alternative")
-        msg["From"] = f"{SMTP_FROM_NAME} <{SMTP_FROM}>"
-        msg["To"] = to
-        msg["Subject"] = subject
-
-        if text_body:
-            msg.attach(MIMEText(text_body, "plain", "utf-8"))
-        msg.attach(MIMEText(html_body, "html", "utf-8"))
-
-        with smtplib.SMTP(SMTP_HOST, SMTP_PORT) as server:
-            server.starttls()
-            server.login(SMTP_USER, SMTP_PASS)
+        msg = build_message(to, subject, html_body, text_body)
+
+        with smtplib.SMTP(SMTP_HOST, SMTP_PORT, timeout=SMTP_TIMEOUT) as server:
+            if SMTP_STARTTLS:
+                server.starttls()
+            if SMTP_USER:
+                server.login(SMTP_USER, SMTP_PASS)
             server.send_message(msg)
 
         logger.info("Email sent to %s: %s", to, subject)
@@ -49,8 +61,8 @@ def send_email(to: str, subject: str, html_body: str, text_body: str = "") -> bo
         return False
 
 
-def send_verification_email(to: str, name: str, token: str) -> bool:
-    """Send the email verification link."""
+def verification_email(name: str, token: str) -> Tuple[str, str, str]:
+    """Subject, html and text of the email verification message."""
     verify_url = f"{APP_BASE_URL}/auth?verify={token}"
     subject = "Verifique seu email - Varzea Prime"
     html = f"""
@@ -79,4 +91,9 @@ def send_verification_email(to: str, name: str, token: str) -> bool:
     </div>
     """
     text = f"Ola {name}, verifique seu email acessando: {verify_url}"
-    return send_email(to, subject, html, text)
+    return subject, html, text
+
+
+def send_verification_email(to: str, name: str, token: str) -> bool:
+    """Send the email verification link (blocking)."""
+    return send_email(to, *verification_email(name, token))
@@ -11,25 +11,51 @@ from typing import Any, Dict, Optional
 from dotenv import load_dotenv
 from flask import Flask, jsonify, request, send_from_directory
 from flask_cors import CORS
-from werkzeug.security import generate_password_hash, check_password_hash
-from sqlalchemy import create_engine, text
+from sqlalchemy import text
 from app.security import hash_password
 
 from app.db import (
     init_db,
+    init_db_instrumentation,
+    master_pool_stats,
+    replica_router,
+    tenant_pool_stats,
     execute_sql,
+    cached_fetch_all,
+    cached_fetch_one,
     fetch_one,
     fetch_all,
+    fetch_iter,
+    named_query_stats,
+    transaction,
     safe_db_error,
     validate_slug,
     build_db_name_from_slug,
     create_physical_database,
     drop_physical_database,
-    build_tenant_database_url,
+    tenant_connection,
     apply_sql_template,
     TEMPLATES_DIR,
     TENANT_DB_HOST,
 )
+from app import queries as _queries  # noqa: F401 (registra as queries nomeadas)
+from app.queries import MemberRow
+from app.cache import cache_stats
+from app.catalog import catalog, catalog_response, catalog_view, invalidate_catalog
+from app.email_outbox import email_outbox, start_email_sender
+from app.member_counts import apply_membership_change, lock_membership, member_count_reconciler
+from app.membership import invalidate_all_memberships, invalidate_membership
+from app.password_hashing import PasswordHashBusy, busy_response, password_hasher
+from app.push_dispatcher import invalidate_admin_push_tokens, push_dispatcher
+from app.rate_limit import (
+    client_ip, json_email, rate_limit_stats, rate_limited,
+    super_admin_login_email_limiter, super_admin_login_ip_limiter,
+)
+from app.session_activity import session_activity
+from app.streaming import stream_json_list
+from app.super_admins import super_admin_index
+from app.tenant_routing import init_tenant_routing, tenant_routing_stats
+from app.tenants import invalidate_all_tenants, invalidate_tenant, resolve_tenant
 
 # ------------------------------------------------------------
 # Config
@@ -50,6 +76,14 @@ if not os.path.isdir(DOWNLOADS_DIR):
     print(f"⚠️ DOWNLOADS_DIR não encontrado: {DOWNLOADS_DIR}", flush=True)
 
 CORS(app, resources={r"/api/*": {"origins": "*"}}, supports_credentials=False)
+init_db_instrumentation(app)
+init_tenant_routing(app)
+
+
+@app.errorhandler(PasswordHashBusy)
+def _password_hash_busy(e: PasswordHashBusy):
+    return busy_response(e)
+
 
 # ------------------------------------------------------------
 # STARTUP (MASTER DB do Seletor)
@@ -61,6 +95,15 @@ try:
 except Exception as e:
     print(f"🚨 ERRO AO INICIAR BANCO MASTER: {e}", flush=True)
 
+try:
+    super_admin_index.refresh()
+except Exception as e:
+    # Recarrega sob demanda na primeira consulta
+    print(f"⚠️ super_admins não carregado no boot: {e}", flush=True)
+
+start_email_sender()
+member_count_reconciler.start()
+
 
 # ------------------------------------------------------------
 # Decorators
@@ -118,6 +161,18 @@ def _tenant_row_to_dto(row: Dict[str, Any]) -> Dict[str, Any]:
     }
 
 
+def _member_row_to_dto(row: Dict[str, Any]) -> Dict[str, Any]:
+    return {
+        "id": row["id"],
+        "name": row["name"],
+        "email": row["email"],
+        "phone": row.get("phone"),
+        "role": row["role"],
+        "isActive": bool(row.get("is_active", True)),
+        "joinedAt": row["joined_at"].isoformat() if row.get("joined_at") else None,
+    }
+
+
 # ------------------------------------------------------------
 # Public routes
 # ------------------------------------------------------------
@@ -170,18 +225,31 @@ def list_downloads():
     return response
 
 
+@catalog_view("systems")
+def _systems_view(data, _key):
+    return 200, [_system_row_to_dto(r) for r in data.systems]
+
+
+@catalog_view("system_tenants")
+def _system_tenants_view(data, system_slug):
+    sys_row = next((r for r in data.systems if r["slug"] == system_slug), None)
+    if not sys_row:
+        return 404, {"error": "Sistema não encontrado"}
+
+    tenants = sorted(
+        (t for t in data.tenants if t["system_slug"] == system_slug),
+        key=lambda t: t["id"],
+    )
+    return 200, {
+        "systemName": sys_row.get("display_name") or system_slug,
+        "tenants": [_tenant_row_to_dto(t) for t in tenants],
+    }
+
+
 @app.get("/api/systems")
 def list_systems():
     try:
-        rows = fetch_all(
-            """
-            SELECT id, slug, display_name, description, icon, color, base_route, is_active
-            FROM systems
-            WHERE is_active = 1
-            ORDER BY display_order ASC, id ASC
-            """
-        )
-        return jsonify([_system_row_to_dto(r) for r in rows])
+        return catalog_response("systems")
     except Exception as e:
         if ENV == "dev":
             traceback.print_exc()
@@ -191,29 +259,7 @@ def list_systems():
 @app.get("/api/systems/<system_slug>/tenants")
 def list_tenants_by_system(system_slug: str):
     try:
-        sys_row = fetch_one(
-            "SELECT id, display_name FROM systems WHERE slug = :slug AND is_active = 1",
-            {"slug": system_slug},
-        )
-        if not sys_row:
-            return jsonify({"error": "Sistema não encontrado"}), 404
-
-        tenants = fetch_all(
-            """
-            SELECT id, slug, display_name, logo_url, primary_color, welcome_message, maintenance_mode
-            FROM tenants
-            WHERE system_id = :sid AND is_active = 1
-            ORDER BY id ASC
-            """,
-            {"sid": sys_row["id"]},
-        )
-
-        return jsonify(
-            {
-                "systemName": sys_row.get("display_name") or system_slug,
-                "tenants": [_tenant_row_to_dto(t) for t in tenants],
-            }
-        )
+        return catalog_response("system_tenants", system_slug)
     except Exception as e:
         if ENV == "dev":
             traceback.print_exc()
@@ -234,18 +280,7 @@ def select_tenant():
 
         header_system_slug = (request.headers.get("X-System-Slug") or "").strip()
 
-        row = fetch_one(
-            """
-            SELECT 
-              t.id, t.slug, t.display_name, t.database_name, t.database_host,
-              t.primary_color, t.maintenance_mode, t.is_active,
-              s.slug as system_slug, s.display_name as system_name
-            FROM tenants t
-            INNER JOIN systems s ON s.id = t.system_id
-            WHERE t.slug = :tenant_slug
-            """,
-            {"tenant_slug": tenant_slug},
-        )
+        row = resolve_tenant(tenant_slug, include_inactive=True)
 
         if not row:
             return jsonify({"error": "Tenant não encontrado"}), 404
@@ -283,6 +318,7 @@ def select_tenant():
 # Super Admin routes
 # ------------------------------------------------------------
 @app.post("/api/super-admin/login")
+@rate_limited((super_admin_login_ip_limiter, client_ip), (super_admin_login_email_limiter, json_email))
 def super_admin_login():
     data = request.get_json(silent=True) or {}
     if not data.get("email") or not data.get("password"):
@@ -292,7 +328,7 @@ def super_admin_login():
     if not admin:
         return jsonify({"error": "Credenciais inválidas"}), 401
 
-    if check_password_hash(admin["password_hash"], data["password"]):
+    if password_hasher.check(admin["password_hash"], data["password"]):
         token = jwt.encode(
             {
                 "user_id": admin["id"],
@@ -337,12 +373,12 @@ def create_tenant():
         system_slug = (data["systemSlug"] or "").strip().lower()
 
         # Valida system
-        system = fetch_one("SELECT id FROM systems WHERE slug = :slug", {"slug": system_slug})
+        system = cached_fetch_one("SELECT id FROM systems WHERE slug = :slug", {"slug": system_slug}, tags=["systems"])
         if not system:
             return jsonify({"error": "Sistema inválido"}), 400
 
         # Evita duplicidade de slug
-        exists = fetch_one("SELECT id FROM tenants WHERE slug = :slug", {"slug": slug})
+        exists = resolve_tenant(slug, include_inactive=True)
         if exists:
             return jsonify({"error": "Este slug já está em uso."}), 409
 
@@ -373,6 +409,8 @@ def create_tenant():
             },
         )
         inserted_master = True
+        invalidate_catalog()
+        invalidate_tenant(slug=slug)
 
         # 2) cria DB físico no Varzea MySQL
         print(f"--> Criando DB `{db_name}` em {target_host}...", flush=True)
@@ -380,12 +418,9 @@ def create_tenant():
         created_db = True
 
         # 3) conecta no DB do tenant e aplica template
-        tenant_url = build_tenant_database_url(target_host, db_name)
-        tenant_engine = create_engine(tenant_url, pool_pre_ping=True, future=True)
-
         template_path = TEMPLATES_DIR / f"model_{system_slug}.sql"
 
-        with tenant_engine.begin() as conn:
+        with tenant_connection(target_host, db_name, begin=True) as conn:
             if template_path.exists():
                 print(f"--> Aplicando template: {template_path}", flush=True)
                 apply_sql_template(conn, template_path)
@@ -444,52 +479,60 @@ def create_tenant():
                     (admin_name, admin_email, pass_hash),
                 )
         # 5) Cria/encontra user no HUB e vincula membership com role='admin'
-        hub_user = fetch_one(
-            "SELECT id FROM users WHERE email = :email",
-            {"email": admin_email},
-        )
-
-        if hub_user:
-            hub_user_id = hub_user["id"]
-        else:
-            execute_sql(
-                """
-                INSERT INTO users (name, nickname, email, password_hash, is_active)
-                VALUES (:name, :nickname, :email, :pass_hash, TRUE)
-                """,
-                {
-                    "name": admin_name,
-                    "nickname": admin_nickname,
-                    "email": admin_email,
-                    "pass_hash": pass_hash,
-                },
-            )
+        #    (numa transação só no MASTER: um COMMIT em vez de um por passo)
+        with transaction():
             hub_user = fetch_one(
                 "SELECT id FROM users WHERE email = :email",
                 {"email": admin_email},
             )
-            hub_user_id = hub_user["id"]
 
-        # Busca o tenant_id recém-criado no master
-        tenant_row = fetch_one(
-            "SELECT id FROM tenants WHERE slug = :slug",
-            {"slug": slug},
-        )
-        tenant_id = tenant_row["id"]
+            if hub_user:
+                hub_user_id = hub_user["id"]
+            else:
+                execute_sql(
+                    """
+                    INSERT INTO users (name, nickname, email, password_hash, is_active)
+                    VALUES (:name, :nickname, :email, :pass_hash, TRUE)
+                    """,
+                    {
+                        "name": admin_name,
+                        "nickname": admin_nickname,
+                        "email": admin_email,
+                        "pass_hash": pass_hash,
+                    },
+                )
+                hub_user = fetch_one(
+                    "SELECT id FROM users WHERE email = :email",
+                    {"email": admin_email},
+                )
+                hub_user_id = hub_user["id"]
 
-        # Cria membership: admin deste tenant
-        execute_sql(
-            """
-            INSERT INTO user_tenants (user_id, tenant_id, role, is_active)
-            VALUES (:user_id, :tenant_id, 'admin', TRUE)
-            ON DUPLICATE KEY UPDATE role = 'admin', is_active = TRUE
-            """,
-            {"user_id": hub_user_id, "tenant_id": tenant_id},
-        )
+            # Busca o tenant_id recém-criado no master
+            tenant_row = fetch_one(
+                "SELECT id FROM tenants WHERE slug = :slug",
+                {"slug": slug},
+            )
+            tenant_id = tenant_row["id"]
+            invalidate_tenant(tenant_id, slug)
+
+            # Cria membership: admin deste tenant
+            was_active = lock_membership(tenant_id, hub_user_id)
+            execute_sql(
+                """
+                INSERT INTO user_tenants (user_id, tenant_id, role, is_active)
+                VALUES (:user_id, :tenant_id, 'admin', TRUE)
+                ON DUPLICATE KEY UPDATE role = 'admin', is_active = TRUE
+                """,
+                {"user_id": hub_user_id, "tenant_id": tenant_id},
+                invalidates=["user_tenants"],
+            )
+            apply_membership_change(tenant_id, was_active, True)
+            invalidate_membership(hub_user_id)
+            invalidate_admin_push_tokens(tenant_id)
 
         # 6) Atualiza fk_id_user_hub no user local do tenant
         try:
-            with tenant_engine.begin() as conn2:
+            with tenant_connection(target_host, db_name, begin=True) as conn2:
                 conn2.exec_driver_sql(
                     "UPDATE users SET fk_id_user_hub = %s WHERE email = %s",
                     (hub_user_id, admin_email),
@@ -524,7 +567,12 @@ def create_tenant():
         if inserted_master and slug:
             try:
                 print(f"!! ROLLBACK: removendo tenant `{slug}` do MASTER", flush=True)
-                execute_sql("DELETE FROM tenants WHERE slug = :slug", {"slug": slug})
+                execute_sql(
+                    "DELETE FROM tenants WHERE slug = :slug", {"slug": slug},
+                    invalidates=["user_tenants", "tenant_features"],
+                )
+                invalidate_catalog()
+                invalidate_tenant(slug=slug)
             except Exception as del_err:
                 print(f"!! ROLLBACK falhou ao deletar tenant `{slug}` do MASTER: {del_err}", flush=True)
 
@@ -580,10 +628,7 @@ def delete_tenant(tenant_id: int):
     2) registro do tenant no MASTER DB do Seletor
     """
     try:
-        tenant = fetch_one(
-            "SELECT id, database_name, database_host, display_name FROM tenants WHERE id = :id",
-            {"id": tenant_id},
-        )
+        tenant = resolve_tenant(tenant_id=tenant_id, include_inactive=True)
         if not tenant:
             return jsonify({"error": "Tenant não encontrado"}), 404
 
@@ -594,8 +639,15 @@ def delete_tenant(tenant_id: int):
         print(f"--> Drop database `{db_name}` em {db_host}...", flush=True)
         drop_physical_database(db_host, db_name)
 
-        # 2) remove registro
-        execute_sql("DELETE FROM tenants WHERE id = :id", {"id": tenant_id})
+        # 2) remove registro (ON DELETE CASCADE leva user_tenants e tenant_features)
+        execute_sql(
+            "DELETE FROM tenants WHERE id = :id", {"id": tenant_id},
+            invalidates=["user_tenants", "tenant_features"],
+        )
+        invalidate_all_memberships()
+        invalidate_catalog()
+        invalidate_tenant(tenant_id, tenant["slug"])
+        invalidate_admin_push_tokens(tenant_id)
 
         return jsonify({"message": f"Sistema '{tenant.get('display_name')}' e banco foram excluídos."})
     except Exception as e:
@@ -610,7 +662,7 @@ def delete_tenant(tenant_id: int):
 def update_tenant(tenant_id: int):
     """Edita campos do tenant: display_name, primary_color, allow_registration, is_active."""
     try:
-        tenant = fetch_one("SELECT id FROM tenants WHERE id = :id", {"id": tenant_id})
+        tenant = resolve_tenant(tenant_id=tenant_id, include_inactive=True)
         if not tenant:
             return jsonify({"error": "Tenant não encontrado"}), 404
 
@@ -633,6 +685,9 @@ def update_tenant(tenant_id: int):
             f"UPDATE tenants SET {', '.join(sets)} WHERE id = :id",
             params,
         )
+        invalidate_all_memberships()
+        invalidate_catalog()
+        invalidate_tenant(tenant_id)
         return jsonify({"message": "Tenant atualizado"})
 
     except Exception as e:
@@ -646,14 +701,13 @@ def update_tenant(tenant_id: int):
 def list_tenant_admins(tenant_id: int):
     """Lista usuários admin de um tenant (via user_tenants com role=admin)."""
     try:
-        tenant = fetch_one(
-            "SELECT id, slug, display_name FROM tenants WHERE id = :id",
-            {"id": tenant_id},
-        )
+        tenant = resolve_tenant(tenant_id=tenant_id, include_inactive=True)
         if not tenant:
             return jsonify({"error": "Tenant não encontrado"}), 404
 
-        admins = fetch_all(
+        # Lista curta e muito relida pelo painel: cache invalidado pelas
+        # escritas em user_tenants/users
+        admins = cached_fetch_all(
             """
             SELECT u.id, u.name, u.email, u.phone, ut.role, ut.is_active,
                    ut.joined_at
@@ -663,20 +717,10 @@ def list_tenant_admins(tenant_id: int):
             ORDER BY u.name
             """,
             {"tenant_id": tenant_id},
+            tags=["user_tenants", "users"],
         )
 
-        return jsonify([
-            {
-                "id": a["id"],
-                "name": a["name"],
-                "email": a["email"],
-                "phone": a.get("phone"),
-                "role": a["role"],
-                "isActive": bool(a.get("is_active", True)),
-                "joinedAt": a["joined_at"].isoformat() if a.get("joined_at") else None,
-            }
-            for a in admins
-        ])
+        return jsonify([_member_row_to_dto(a) for a in admins])
 
     except Exception as e:
         if ENV == "dev":
@@ -704,7 +748,10 @@ def update_tenant_user_role(tenant_id: int, user_id: int):
         execute_sql(
             "UPDATE user_tenants SET role = :role WHERE tenant_id = :tid AND user_id = :uid",
             {"role": new_role, "tid": tenant_id, "uid": user_id},
+            invalidates=["user_tenants"],
         )
+        invalidate_membership(user_id)
+        invalidate_admin_push_tokens(tenant_id)
         return jsonify({"message": f"Role atualizado para '{new_role}'"})
 
     except Exception as e:
@@ -718,11 +765,11 @@ def update_tenant_user_role(tenant_id: int, user_id: int):
 def list_tenant_members(tenant_id: int):
     """Lista todos os membros de um tenant."""
     try:
-        tenant = fetch_one("SELECT id FROM tenants WHERE id = :id", {"id": tenant_id})
+        tenant = resolve_tenant(tenant_id=tenant_id, include_inactive=True)
         if not tenant:
             return jsonify({"error": "Tenant não encontrado"}), 404
 
-        members = fetch_all(
+        members = fetch_iter(
             """
             SELECT u.id, u.name, u.email, u.phone, ut.role, ut.is_active,
                    ut.joined_at
@@ -732,21 +779,43 @@ def list_tenant_members(tenant_id: int):
             ORDER BY FIELD(ut.role, 'admin', 'manager', 'staff', 'player'), u.name
             """,
             {"tenant_id": tenant_id},
+            record=MemberRow,
         )
 
-        return jsonify([
-            {
-                "id": m["id"],
-                "name": m["name"],
-                "email": m["email"],
-                "phone": m.get("phone"),
-                "role": m["role"],
-                "isActive": bool(m.get("is_active", True)),
-                "joinedAt": m["joined_at"].isoformat() if m.get("joined_at") else None,
-            }
-            for m in members
-        ])
+        return stream_json_list(members, _member_row_to_dto)
+
+    except Exception as e:
+        if ENV == "dev":
+            traceback.print_exc()
+        return jsonify({"error": safe_db_error(e)}), 500
+
 
+# ------------------------------------------------------------
+# Super-Admin: métricas internas (pools de conexão)
+# ------------------------------------------------------------
+@app.get("/api/internal/metrics")
+@token_required
+def internal_metrics():
+    """Estatísticas do processo (por worker): pools, réplicas, queries nomeadas e caches."""
+    try:
+        response = jsonify({
+            "masterPool": master_pool_stats(),
+            "replicas": replica_router.stats(),
+            "tenantPools": tenant_pool_stats(),
+            "namedQueries": named_query_stats(),
+            "caches": cache_stats(),
+            "sessionActivity": session_activity.stats(),
+            "passwordHashing": password_hasher.stats(),
+            "rateLimits": rate_limit_stats(),
+            "superAdmins": super_admin_index.stats(),
+            "emailOutbox": email_outbox.stats(),
+            "push": push_dispatcher.stats(),
+            "catalog": catalog.stats(),
+            "memberCounts": member_count_reconciler.stats(),
+            "tenantRouting": tenant_routing_stats(),
+        })
+        response.headers["Cache-Control"] = "no-store"
+        return response
     except Exception as e:
         if ENV == "dev":
             traceback.print_exc()
@@ -811,7 +880,9 @@ def create_system():
                 "is_active": data.get("isActive", True),
                 "display_order": data.get("displayOrder", 0),
             },
+            invalidates=["systems"],
         )
+        invalidate_catalog()
         return jsonify({"message": f"Sistema '{data['displayName']}' criado"})
 
     except Exception as e:
@@ -853,7 +924,11 @@ def update_system(system_id: int):
         execute_sql(
             f"UPDATE systems SET {', '.join(sets)} WHERE id = :id",
             params,
+            invalidates=["systems"],
         )
+        invalidate_all_memberships()
+        invalidate_catalog()
+        invalidate_all_tenants()
         return jsonify({"message": "Sistema atualizado"})
 
     except Exception as e:
@@ -878,7 +953,10 @@ def delete_system(system_id: int):
         if tenant_count and int(tenant_count["cnt"]) > 0:
             return jsonify({"error": f"Sistema tem {tenant_count['cnt']} tenant(s) ativo(s). Desative-os primeiro."}), 409
 
-        execute_sql("UPDATE systems SET is_active = 0 WHERE id = :id", {"id": system_id})
+        execute_sql("UPDATE systems SET is_active = 0 WHERE id = :id", {"id": system_id}, invalidates=["systems"])
+        invalidate_all_memberships()
+        invalidate_catalog()
+        invalidate_all_tenants()
         return jsonify({"message": f"Sistema '{sys_row['display_name']}' desativado"})
 
     except Exception as e:
@@ -947,24 +1025,30 @@ def approve_request_admin(tenant_id: int, request_id: int):
         if not req:
             return jsonify({"error": "Solicitação não encontrada ou já processada"}), 404
 
-        execute_sql(
-            """
-            UPDATE user_tenant_requests
-            SET status = 'approved', responded_at = NOW()
-            WHERE id = :id
-            """,
-            {"id": request_id},
-        )
+        with transaction():
+            was_active = lock_membership(tenant_id, req["user_id"])
+            execute_sql(
+                """
+                UPDATE user_tenant_requests
+                SET status = 'approved', responded_at = NOW()
+                WHERE id = :id
+                """,
+                {"id": request_id},
+            )
 
-        execute_sql(
-            """
-            INSERT INTO user_tenants (user_id, tenant_id, role, approved_at)
-            VALUES (:user_id, :tenant_id, 'player', NOW())
-            ON DUPLICATE KEY UPDATE
-                is_active = TRUE, left_at = NULL, approved_at = NOW()
-            """,
-            {"user_id": req["user_id"], "tenant_id": tenant_id},
-        )
+            execute_sql(
+                """
+                INSERT INTO user_tenants (user_id, tenant_id, role, approved_at)
+                VALUES (:user_id, :tenant_id, 'player', NOW())
+                ON DUPLICATE KEY UPDATE
+                    is_active = TRUE, left_at = NULL, approved_at = NOW()
+                """,
+                {"user_id": req["user_id"], "tenant_id": tenant_id},
+                invalidates=["user_tenants"],
+            )
+            apply_membership_change(tenant_id, was_active, True)
+            invalidate_membership(req["user_id"])
+            invalidate_admin_push_tokens(tenant_id)
 
         return jsonify({"message": f"{req['user_name']} foi aprovado!"})
 
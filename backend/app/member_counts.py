@@ -0,0 +1,131 @@
+"""
+Contador de membros ativos por tenant (tenants.member_count, migration 014).
+
+Substitui o COUNT(*) correlacionado de user_tenants nas listagens públicas.
+Todo caminho que muda user_tenants.is_active roda, na mesma transaction():
+
+    was_active = lock_membership(tenant_id, user_id)   # trava o tenant primeiro
+    ... INSERT/UPDATE em user_tenants ...
+    apply_membership_change(tenant_id, was_active, True/False)
+
+A trava na linha do tenant serializa as mudanças de contagem do mesmo
+tenant, então o delta calculado é exato. reconcile_member_counts() recalcula
+tudo e corrige divergências (escritas fora da API, ex.: SQL manual); uma
+thread por worker roda a cada MEMBER_COUNT_RECONCILE_SECONDS.
+"""
+from __future__ import annotations
+
+import logging
+import os
+import random
+import threading
+import time
+from typing import Any, Dict, Optional
+
+from app.db import execute_sql, fetch_one, transaction
+from app.tenants import invalidate_all_tenants, invalidate_tenant
+
+logger = logging.getLogger(__name__)
+
+MEMBER_COUNT_RECONCILE_SECONDS = float(os.getenv("MEMBER_COUNT_RECONCILE_SECONDS", "3600"))
+
+
+def lock_membership(tenant_id: int, user_id: int) -> bool:
+    """Trava o tenant (FOR UPDATE) e diz se o vínculo do usuário está ativo."""
+    fetch_one("SELECT id FROM tenants WHERE id = :tenant_id FOR UPDATE", {"tenant_id": tenant_id}, primary=True)
+    row = fetch_one(
+        "SELECT is_active FROM user_tenants WHERE user_id = :user_id AND tenant_id = :tenant_id",
+        {"user_id": user_id, "tenant_id": tenant_id},
+        primary=True,
+    )
+    return bool(row and row["is_active"])
+
+
+def apply_membership_change(tenant_id: int, was_active: bool, is_active: bool) -> None:
+    """Ajusta member_count pelo delta do vínculo (0, +1 ou -1)."""
+    delta = int(bool(is_active)) - int(bool(was_active))
+    if delta == 0:
+        return
+    execute_sql(
+        "UPDATE tenants SET member_count = GREATEST(member_count + :delta, 0) WHERE id = :tenant_id",
+        {"delta": delta, "tenant_id": tenant_id},
+    )
+    # resolve_tenant guarda member_count (detalhes do tenant)
+    invalidate_tenant(tenant_id)
+
+
+class MemberCountReconciler:
+    """Recontagem periódica de tenants.member_count."""
+
+    def __init__(self, interval: float) -> None:
+        self.interval = interval
+        self._thread: Optional[threading.Thread] = None
+        self._pid = 0
+        self._lock = threading.Lock()
+        self.runs = 0
+        self.fixed = 0
+        self.errors = 0
+        self.last_run_ms = 0.0
+
+    def reconcile(self) -> int:
+        """Recalcula member_count de todos os tenants. Retorna quantos estavam errados."""
+        started = time.perf_counter()
+        with transaction() as conn:
+            result = conn.exec_driver_sql(
+                """
+                UPDATE tenants t
+                LEFT JOIN (
+                    SELECT tenant_id, COUNT(*) AS cnt
+                    FROM user_tenants
+                    WHERE is_active = TRUE
+                    GROUP BY tenant_id
+                ) m ON m.tenant_id = t.id
+                SET t.member_count = COALESCE(m.cnt, 0)
+                WHERE t.member_count <> COALESCE(m.cnt, 0)
+                """
+            )
+            fixed = max(0, result.rowcount or 0)
+        if fixed:
+            invalidate_all_tenants()
+        with self._lock:
+            self.runs += 1
+            self.fixed += fixed
+            self.last_run_ms = (time.perf_counter() - started) * 1000
+        if fixed:
+            logger.warning("member_count divergente corrigido em %d tenant(s)", fixed)
+        return fixed
+
+    def start(self) -> None:
+        """Sobe a thread de reconciliação deste processo (uma por worker)."""
+        if self.interval <= 0:
+            return
+        with self._lock:
+            if self._thread is not None and self._pid == os.getpid() and self._thread.is_alive():
+                return
+            self._pid = os.getpid()
+            self._thread = threading.Thread(target=self._run, name="member-count-reconcile", daemon=True)
+            self._thread.start()
+
+    def _run(self) -> None:
+        while True:
+            # Jitter: os workers não recontam todos ao mesmo tempo
+            time.sleep(self.interval * random.uniform(0.9, 1.1))
+            try:
+                self.reconcile()
+            except Exception:
+                with self._lock:
+                    self.errors += 1
+                logger.exception("Falha na reconciliação de member_count")
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "intervalSeconds": self.interval,
+                "runs": self.runs,
+                "fixed": self.fixed,
+                "errors": self.errors,
+                "lastRunMs": round(self.last_run_ms, 2),
+            }
+
+
+member_count_reconciler = MemberCountReconciler(MEMBER_COUNT_RECONCILE_SECONDS)
@@ -0,0 +1,195 @@
+"""
+Snapshot de vínculos por usuário (user_tenants ⋈ tenants ⋈ systems).
+
+login, /api/auth/me e /api/user/tenants leem daqui em vez de refazer o join
+a cada chamada. O snapshot é versionado por usuário e só é reconstruído
+depois de invalidate_membership(user_id) (join, leave, aprovação,
+link/unlink, troca de role) ou invalidate_all_memberships() (tenant ou
+system alterado).
+
+Armazenamento (MEMBERSHIP_SNAPSHOT_STORE):
+- memory (padrão): TTLCache por worker; o TTL limita a desatualização
+  entre workers.
+- db: além do cache, o snapshot fica em user_membership_snapshots
+  (migration 012); um miss no worker vira uma leitura por PK em vez do join.
+
+A flag de super admin não faz parte do snapshot: vem de app.super_admins.
+"""
+from __future__ import annotations
+
+import itertools
+import json
+import os
+import threading
+from typing import Any, Dict, List, Optional, Tuple
+
+from app.cache import TTLCache
+from app.db import after_commit, execute_sql, fetch_one, query_all
+
+MEMBERSHIP_SNAPSHOT_TTL = float(os.getenv("MEMBERSHIP_SNAPSHOT_TTL", "60"))
+MEMBERSHIP_SNAPSHOT_MAX = int(os.getenv("MEMBERSHIP_SNAPSHOT_MAX", "20000"))
+MEMBERSHIP_SNAPSHOT_STORE = os.getenv("MEMBERSHIP_SNAPSHOT_STORE", "memory").strip().lower()
+
+_snapshots = TTLCache("membership.snapshots", MEMBERSHIP_SNAPSHOT_MAX, MEMBERSHIP_SNAPSHOT_TTL)
+
+# Versões locais: um build iniciado antes de uma invalidação não é guardado.
+# Só precisam viver mais que um build, então ficam num TTLCache limitado; o
+# valor vem de um contador que só cresce, então uma versão expirada (lida
+# como 0) nunca coincide com a de uma invalidação posterior.
+MEMBERSHIP_VERSION_TTL = float(os.getenv("MEMBERSHIP_VERSION_TTL", "300"))
+_versions = TTLCache("membership.versions", MEMBERSHIP_SNAPSHOT_MAX, MEMBERSHIP_VERSION_TTL)
+_version_counter = itertools.count(1)
+_global_version = 0
+_versions_lock = threading.Lock()
+
+
+class MembershipSnapshot:
+    """
+    Vínculos ativos de um usuário, já no formato dos DTOs.
+
+    - tenants: lista usada por login e /me (tenant + role + system).
+    - systems: agrupamento por sistema usado por /api/user/tenants.
+    """
+
+    __slots__ = ("user_id", "tenants", "systems")
+
+    def __init__(self, user_id: int, tenants: List[Dict[str, Any]], systems: List[Dict[str, Any]]) -> None:
+        self.user_id = user_id
+        self.tenants = tenants
+        self.systems = systems
+
+    def to_json(self) -> str:
+        return json.dumps({"tenants": self.tenants, "systems": self.systems})
+
+    @classmethod
+    def from_json(cls, user_id: int, payload: str) -> "MembershipSnapshot":
+        data = json.loads(payload)
+        return cls(user_id, data["tenants"], data["systems"])
+
+
+def _build(user_id: int) -> MembershipSnapshot:
+    # Primário: o build acontece logo após uma escrita (réplica pode estar atrás)
+    rows = query_all("membership.my_tenants", {"user_id": user_id}, primary=True)
+
+    tenants: List[Dict[str, Any]] = []
+    by_system: Dict[str, Dict[str, Any]] = {}
+    for t in rows:
+        system = {
+            "slug": t["system_slug"],
+            "displayName": t["system_name"],
+            "icon": t["system_icon"],
+            "color": t["system_color"],
+        }
+        item = {
+            "id": t["id"],
+            "slug": t["slug"],
+            "displayName": t["display_name"],
+            "logoUrl": t.get("logo_url"),
+            "primaryColor": t.get("primary_color"),
+            "role": t["role"],
+        }
+        tenants.append({**item, "system": system})
+
+        group = by_system.get(t["system_slug"])
+        if group is None:
+            group = by_system[t["system_slug"]] = {**system, "tenants": []}
+        group["tenants"].append({
+            **item,
+            "joinedAt": t["joined_at"].isoformat() if t.get("joined_at") else None,
+        })
+
+    return MembershipSnapshot(user_id, tenants, list(by_system.values()))
+
+
+def _load_from_store(user_id: int) -> MembershipSnapshot:
+    sql = "SELECT version, payload FROM user_membership_snapshots WHERE user_id = :user_id"
+    row = fetch_one(sql, {"user_id": user_id}, primary=True)
+    if row and row.get("payload"):
+        return MembershipSnapshot.from_json(user_id, row["payload"])
+
+    if not row:
+        # Cria a linha vazia antes do build: assim um _drop concorrente tem o
+        # que incrementar e o payload só entra pelo UPDATE condicional abaixo
+        execute_sql(
+            """
+            INSERT IGNORE INTO user_membership_snapshots (user_id, version, payload)
+            VALUES (:user_id, 0, NULL)
+            """,
+            {"user_id": user_id},
+        )
+        row = fetch_one(sql, {"user_id": user_id}, primary=True)
+
+    snapshot = _build(user_id)
+    if row:
+        # Só grava se ninguém invalidou durante o build
+        execute_sql(
+            """
+            UPDATE user_membership_snapshots
+            SET payload = :payload, built_at = NOW()
+            WHERE user_id = :user_id AND version = :version
+            """,
+            {"payload": snapshot.to_json(), "user_id": user_id, "version": row["version"]},
+        )
+    return snapshot
+
+
+def _version_of(user_id: int) -> Tuple[int, int]:
+    with _versions_lock:
+        return _global_version, _versions.get(user_id, 0)
+
+
+def get_membership(user_id: int) -> MembershipSnapshot:
+    """Snapshot do usuário: cache -> tabela (store=db) -> join."""
+    snapshot = _snapshots.get(user_id)
+    if snapshot is not None:
+        return snapshot
+
+    version = _version_of(user_id)
+    if MEMBERSHIP_SNAPSHOT_STORE == "db":
+        snapshot = _load_from_store(user_id)
+    else:
+        snapshot = _build(user_id)
+
+    if _version_of(user_id) == version:
+        _snapshots.set(user_id, snapshot)
+    return snapshot
+
+
+def _drop(user_id: int) -> None:
+    with _versions_lock:
+        _versions.set(user_id, next(_version_counter))
+    _snapshots.pop(user_id)
+    if MEMBERSHIP_SNAPSHOT_STORE == "db":
+        # Upsert: sem linha ainda (build em andamento), cria já com versão nova
+        execute_sql(
+            """
+            INSERT INTO user_membership_snapshots (user_id, version, payload)
+            VALUES (:user_id, 1, NULL)
+            ON DUPLICATE KEY UPDATE version = version + 1, payload = NULL
+            """,
+            {"user_id": user_id},
+        )
+
+
+def _drop_all() -> None:
+    global _global_version
+    with _versions_lock:
+        _global_version += 1
+        _versions.clear()
+    _snapshots.clear()
+    if MEMBERSHIP_SNAPSHOT_STORE == "db":
+        # Todas as linhas, inclusive payload NULL: pode haver build em andamento nelas
+        execute_sql("UPDATE user_membership_snapshots SET version = version + 1, payload = NULL")
+
+
+def invalidate_membership(user_id: Optional[int]) -> None:
+    """Descarta o snapshot do usuário (após o COMMIT, se dentro de transaction())."""
+    if user_id is None:
+        return
+    uid = int(user_id)
+    after_commit(lambda: _drop(uid))
+
+
+def invalidate_all_memberships() -> None:
+    """Descarta todos os snapshots (tenant/system alterado ou removido)."""
+    after_commit(_drop_all)
@@ -0,0 +1,158 @@
+"""
+Hash de senha (werkzeug scrypt) fora das threads de request.
+
+O scrypt é CPU puro e segura o GIL: no gthread uma rajada de logins trava
+as outras threads do worker. Aqui ele roda num pool de processos
+(PASSWORD_HASH_WORKERS, padrão = núcleos) com fila limitada
+(PASSWORD_HASH_MAX_PENDING). Com a fila cheia, password_hasher.generate/check
+levantam PasswordHashBusy na hora; as rotas respondem 503 + Retry-After.
+
+PASSWORD_HASH_WORKERS=0 executa inline (dev/testes), ainda respeitando o limite.
+"""
+from __future__ import annotations
+
+import logging
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from concurrent.futures.process import BrokenProcessPool
+from typing import Any, Callable, Dict, Optional
+
+from flask import jsonify
+from werkzeug.security import check_password_hash, generate_password_hash
+
+logger = logging.getLogger(__name__)
+
+PASSWORD_HASH_WORKERS = int(os.getenv("PASSWORD_HASH_WORKERS", str(os.cpu_count() or 1)))
+PASSWORD_HASH_MAX_PENDING = int(os.getenv("PASSWORD_HASH_MAX_PENDING", str(max(1, PASSWORD_HASH_WORKERS) * 4)))
+PASSWORD_HASH_TIMEOUT = float(os.getenv("PASSWORD_HASH_TIMEOUT", "10"))
+PASSWORD_HASH_RETRY_AFTER = int(os.getenv("PASSWORD_HASH_RETRY_AFTER", "2"))
+
+
+class PasswordHashBusy(Exception):
+    """Executor de hash saturado (fila cheia ou timeout)."""
+
+    def __init__(self, retry_after: int = PASSWORD_HASH_RETRY_AFTER) -> None:
+        super().__init__("Executor de hash de senha saturado")
+        self.retry_after = retry_after
+
+
+class PasswordHasher:
+    """
+    Pool de processos para scrypt com fila limitada e métricas.
+
+    - pending: jobs aceitos e ainda não terminados (na fila + executando).
+    - rejected: jobs recusados por fila cheia ou timeout.
+    """
+
+    def __init__(self, workers: int, max_pending: int, timeout: float) -> None:
+        self.workers = max(0, workers)
+        self.max_pending = max(1, max_pending)
+        self.timeout = timeout
+        self._slots = threading.BoundedSemaphore(self.max_pending)
+        self._pool: Optional[ProcessPoolExecutor] = None
+        self._pool_pid = 0
+        self._lock = threading.Lock()
+        self.pending = 0
+        self.completed = 0
+        self.rejected = 0
+        self.total_ms = 0.0
+        self.max_ms = 0.0
+
+    def _executor(self) -> ProcessPoolExecutor:
+        # Pool por processo: após fork do gunicorn o pool herdado não serve
+        with self._lock:
+            if self._pool is None or self._pool_pid != os.getpid():
+                self._pool = ProcessPoolExecutor(
+                    max_workers=self.workers,
+                    mp_context=multiprocessing.get_context("spawn"),
+                )
+                self._pool_pid = os.getpid()
+            return self._pool
+
+    def _reset_pool(self) -> None:
+        with self._lock:
+            pool, self._pool = self._pool, None
+        if pool is not None:
+            pool.shutdown(wait=False, cancel_futures=True)
+
+    def _acquire(self) -> float:
+        if not self._slots.acquire(blocking=False):
+            with self._lock:
+                self.rejected += 1
+            raise PasswordHashBusy()
+        with self._lock:
+            self.pending += 1
+        return time.perf_counter()
+
+    def _release(self, started: float) -> None:
+        elapsed_ms = (time.perf_counter() - started) * 1000
+        with self._lock:
+            self.pending -= 1
+            self.completed += 1
+            self.total_ms += elapsed_ms
+            self.max_ms = max(self.max_ms, elapsed_ms)
+        self._slots.release()
+
+    def _run(self, fn: Callable[..., Any], *args: Any) -> Any:
+        started = self._acquire()
+        if self.workers == 0:
+            try:
+                return fn(*args)
+            finally:
+                self._release(started)
+
+        try:
+            future = self._executor().submit(fn, *args)
+        except BrokenProcessPool:
+            self._release(started)
+            logger.warning("Pool de hash quebrado; recriando")
+            self._reset_pool()
+            raise
+        # O slot só volta quando o job termina (mesmo após timeout do request)
+        future.add_done_callback(lambda _f: self._release(started))
+        try:
+            return future.result(timeout=self.timeout)
+        except FutureTimeoutError:
+            with self._lock:
+                self.rejected += 1
+            raise PasswordHashBusy() from None
+        except BrokenProcessPool:
+            logger.warning("Pool de hash quebrado; recriando")
+            self._reset_pool()
+            raise
+
+    def generate(self, password: str) -> str:
+        return self._run(generate_password_hash, password)
+
+    def check(self, pwhash: str, password: str) -> bool:
+        return self._run(check_password_hash, pwhash, password)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "workers": self.workers,
+                "maxPending": self.max_pending,
+                "pending": self.pending,
+                "completed": self.completed,
+                "rejected": self.rejected,
+                "avgMs": round(self.total_ms / self.completed, 2) if self.completed else None,
+                "maxMs": round(self.max_ms, 2),
+            }
+
+    def shutdown(self) -> None:
+        self._reset_pool()
+
+
+password_hasher = PasswordHasher(PASSWORD_HASH_WORKERS, PASSWORD_HASH_MAX_PENDING, PASSWORD_HASH_TIMEOUT)
+
+
+def busy_response(err: PasswordHashBusy):
+    """Resposta 503 com Retry-After para PasswordHashBusy."""
+    response = jsonify({"error": "Servidor ocupado, tente novamente em instantes"})
+    response.status_code = 503
+    response.headers["Retry-After"] = str(err.retry_after)
+    return response
@@ -0,0 +1,517 @@
+"""
+Push notifications (Expo) fora do request.
+
+As rotas só enfileiram (notify_tenant_admins / push_dispatcher.submit).
+Por worker, PUSH_WORKERS threads consomem a fila:
+
+1. resolvem os tokens do item (ex.: admins do tenant, no banco do tenant);
+2. juntam itens da fila até EXPO_BATCH_SIZE mensagens (limite da Expo: 100);
+3. enviam com ExpoClient: conexão HTTP keep-alive por thread, reaberta se o
+   servidor derrubar a conexão ociosa; 429/5xx são repetidos com backoff.
+
+Tickets "ok" entram numa fila de recibos consultada após
+PUSH_RECEIPT_DELAY_SECONDS (getReceipts, até 1000 ids por chamada).
+DeviceNotRegistered (no ticket ou no recibo) chama on_invalid_tokens.
+
+Os tokens dos admins de cada tenant ficam em cache (PUSH_ADMIN_TOKENS_TTL),
+invalidado quando user_tenants do tenant muda e podado quando a
+Expo reporta tokens inválidos; o caso comum não consulta o banco do tenant.
+Tokens novos gravados pelo app do tenant entram após o TTL.
+
+Fila cheia (PUSH_QUEUE_MAX) descarta o item: push é best-effort.
+EXPO_PUSH_URL / EXPO_RECEIPTS_URL permitem apontar para um servidor local.
+"""
+from __future__ import annotations
+
+import http.client
+import json
+import logging
+import os
+import queue
+import random
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, List, Optional, Tuple
+from urllib.parse import urlsplit
+
+from sqlalchemy import text
+
+from app.cache import TTLCache
+from app.db import TENANT_DB_HOST, after_commit, fetch_all, tenant_connection
+
+logger = logging.getLogger(__name__)
+
+EXPO_PUSH_URL = os.getenv("EXPO_PUSH_URL", "https://exp.host/--/api/v2/push/send")
+EXPO_RECEIPTS_URL = os.getenv("EXPO_RECEIPTS_URL", "https://exp.host/--/api/v2/push/getReceipts")
+EXPO_ACCESS_TOKEN = os.getenv("EXPO_ACCESS_TOKEN", "")
+EXPO_TIMEOUT = float(os.getenv("EXPO_TIMEOUT", "10"))
+EXPO_BATCH_SIZE = min(100, int(os.getenv("EXPO_BATCH_SIZE", "100")))
+EXPO_RECEIPTS_BATCH_SIZE = 1000
+
+PUSH_WORKERS = int(os.getenv("PUSH_WORKERS", "2"))
+PUSH_QUEUE_MAX = int(os.getenv("PUSH_QUEUE_MAX", "1000"))
+PUSH_SEND_ATTEMPTS = int(os.getenv("PUSH_SEND_ATTEMPTS", "3"))
+PUSH_RETRY_BASE_SECONDS = float(os.getenv("PUSH_RETRY_BASE_SECONDS", "1"))
+PUSH_RECEIPT_DELAY_SECONDS = float(os.getenv("PUSH_RECEIPT_DELAY_SECONDS", "900"))
+PUSH_RECEIPT_POLL_SECONDS = float(os.getenv("PUSH_RECEIPT_POLL_SECONDS", "60"))
+PUSH_RECEIPTS_MAX_PENDING = int(os.getenv("PUSH_RECEIPTS_MAX_PENDING", "10000"))
+PUSH_ADMIN_TOKENS_TTL = float(os.getenv("PUSH_ADMIN_TOKENS_TTL", "300"))
+PUSH_ADMIN_TOKENS_MAX = int(os.getenv("PUSH_ADMIN_TOKENS_MAX", "5000"))
+PUSH_INVALID_TOKENS_TTL = float(os.getenv("PUSH_INVALID_TOKENS_TTL", "86400"))
+
+
+def is_expo_token(token: str) -> bool:
+    return "ExponentPushToken" in (token or "")
+
+
+class ExpoHttpError(Exception):
+    def __init__(self, status: int, body: Any) -> None:
+        super().__init__(f"Expo HTTP {status}: {body}")
+        self.status = status
+        self.body = body
+
+    @property
+    def retryable(self) -> bool:
+        return self.status == 429 or self.status >= 500
+
+
+# ============================================================
+# Cliente HTTP (keep-alive)
+# ============================================================
+class ExpoClient:
+    """POST JSON para a Expo reaproveitando uma conexão HTTP/1.1 por thread."""
+
+    def __init__(self, push_url: str, receipts_url: str, timeout: float, access_token: str = "") -> None:
+        self.push_url = urlsplit(push_url)
+        self.receipts_url = urlsplit(receipts_url)
+        self.timeout = timeout
+        self.access_token = access_token
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.connections_opened = 0
+        self.reconnects = 0
+
+    def _connection(self, url) -> Tuple[http.client.HTTPConnection, bool]:
+        conns = self._local.__dict__.setdefault("conns", {})
+        key = (url.scheme, url.netloc)
+        conn = conns.get(key)
+        if conn is not None:
+            return conn, True
+        cls = http.client.HTTPSConnection if url.scheme == "https" else http.client.HTTPConnection
+        conn = conns[key] = cls(url.netloc, timeout=self.timeout)
+        with self._lock:
+            self.connections_opened += 1
+        return conn, False
+
+    def _drop(self, url) -> None:
+        conn = self._local.__dict__.get("conns", {}).pop((url.scheme, url.netloc), None)
+        if conn is not None:
+            conn.close()
+
+    def post_json(self, url, payload: Any) -> Any:
+        body = json.dumps(payload).encode("utf-8")
+        headers = {"Content-Type": "application/json", "Accept": "application/json"}
+        if self.access_token:
+            headers["Authorization"] = f"Bearer {self.access_token}"
+
+        for attempt in range(2):
+            conn, reused = self._connection(url)
+            try:
+                conn.request("POST", url.path or "/", body=body, headers=headers)
+                response = conn.getresponse()
+                raw = response.read()
+            except (ConnectionError, http.client.HTTPException):
+                self._drop(url)
+                # Conexão reaproveitada fechada pelo servidor: uma nova tentativa
+                if reused and attempt == 0:
+                    with self._lock:
+                        self.reconnects += 1
+                    continue
+                raise
+            except Exception:
+                self._drop(url)
+                raise
+            if response.will_close:
+                self._drop(url)
+            with self._lock:
+                self.requests += 1
+
+            data = json.loads(raw.decode("utf-8")) if raw else None
+            if response.status != 200:
+                raise ExpoHttpError(response.status, data)
+            return data
+        raise RuntimeError("unreachable")
+
+    def send(self, messages: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """Tickets na mesma ordem das mensagens."""
+        return (self.post_json(self.push_url, messages) or {}).get("data") or []
+
+    def receipts(self, ids: List[str]) -> Dict[str, Dict[str, Any]]:
+        return (self.post_json(self.receipts_url, {"ids": ids}) or {}).get("data") or {}
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "requests": self.requests,
+                "connectionsOpened": self.connections_opened,
+                "reconnects": self.reconnects,
+            }
+
+
+# ============================================================
+# Dispatcher
+# ============================================================
+class PushItem:
+    """Uma notificação: tokens resolvidos no worker + conteúdo da mensagem."""
+
+    __slots__ = ("tokens", "message", "context")
+
+    def __init__(self, tokens: Callable[[], List[str]], message: Dict[str, Any], context: Any = None) -> None:
+        self.tokens = tokens
+        self.message = message
+        self.context = context
+
+
+class PushDispatcher:
+    """
+    Fila + pool de threads de envio + verificação de recibos.
+
+    on_invalid_tokens(context, tokens) é chamado para tokens que a Expo
+    reporta como DeviceNotRegistered (context = o do item enviado).
+    """
+
+    def __init__(
+        self,
+        client: ExpoClient,
+        workers: int,
+        max_queue: int,
+        batch_size: int = EXPO_BATCH_SIZE,
+        send_attempts: int = PUSH_SEND_ATTEMPTS,
+        retry_base: float = PUSH_RETRY_BASE_SECONDS,
+        receipt_delay: float = PUSH_RECEIPT_DELAY_SECONDS,
+        receipt_poll: float = PUSH_RECEIPT_POLL_SECONDS,
+    ) -> None:
+        self.client = client
+        self.workers = max(1, workers)
+        self.max_queue = max(1, max_queue)
+        self.batch_size = max(1, min(100, batch_size))
+        self.send_attempts = max(1, send_attempts)
+        self.retry_base = retry_base
+        self.receipt_delay = receipt_delay
+        self.receipt_poll = receipt_poll
+        self.on_invalid_tokens: Optional[Callable[[Any, List[str]], None]] = None
+        self._queue: "queue.Queue[PushItem]" = queue.Queue(self.max_queue)
+        # ticket id -> (token, context, horário a partir do qual consultar)
+        self._receipts: "OrderedDict[str, Tuple[str, Any, float]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._threads: List[threading.Thread] = []
+        self._pid = 0
+        self.enqueued = 0
+        self.dropped = 0
+        self.messages_sent = 0
+        self.tickets_ok = 0
+        self.tickets_error = 0
+        self.receipts_checked = 0
+        self.receipts_error = 0
+        self.invalid_tokens = 0
+        self.errors = 0
+
+    # ---------- produtor ----------
+    def submit(self, tokens: Callable[[], List[str]], message: Dict[str, Any], context: Any = None) -> bool:
+        """Enfileira sem bloquear. False = fila cheia (item descartado)."""
+        self._ensure_threads()
+        try:
+            self._queue.put_nowait(PushItem(tokens, message, context))
+        except queue.Full:
+            with self._lock:
+                self.dropped += 1
+            logger.warning("Fila de push cheia; notificação descartada")
+            return False
+        with self._lock:
+            self.enqueued += 1
+        return True
+
+    def _ensure_threads(self) -> None:
+        # Threads por processo (recriadas após fork do gunicorn)
+        if self._pid == os.getpid() and all(t.is_alive() for t in self._threads):
+            return
+        with self._lock:
+            if self._pid == os.getpid() and all(t.is_alive() for t in self._threads):
+                return
+            if self._pid != os.getpid():
+                self._queue = queue.Queue(self.max_queue)
+                self._receipts.clear()
+            self._pid = os.getpid()
+            self._threads = [t for t in self._threads if t.is_alive()]
+            names = {t.name for t in self._threads}
+            for i in range(self.workers):
+                if f"push-worker-{i}" not in names:
+                    self._start(self._run_worker, f"push-worker-{i}")
+            if "push-receipts" not in names:
+                self._start(self._run_receipts, "push-receipts")
+
+    def _start(self, target: Callable[[], None], name: str) -> None:
+        thread = threading.Thread(target=target, name=name, daemon=True)
+        thread.start()
+        self._threads.append(thread)
+
+    # ---------- envio ----------
+    def _messages_for(self, item: PushItem) -> List[Tuple[Dict[str, Any], str, Any]]:
+        try:
+            tokens = item.tokens()
+        except Exception:
+            with self._lock:
+                self.errors += 1
+            logger.exception("Falha ao resolver tokens de push")
+            return []
+        return [({**item.message, "to": token}, token, item.context) for token in tokens if is_expo_token(token)]
+
+    def _run_worker(self) -> None:
+        while True:
+            item = self._queue.get()
+            pending = self._messages_for(item)
+            # Junta itens já enfileirados até completar um lote da Expo
+            while len(pending) < self.batch_size:
+                try:
+                    item = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                pending.extend(self._messages_for(item))
+
+            for start in range(0, len(pending), self.batch_size):
+                try:
+                    self._send_batch(pending[start:start + self.batch_size])
+                except Exception:
+                    with self._lock:
+                        self.errors += 1
+                    logger.exception("Falha ao enviar lote de push para a Expo")
+
+    def _send_batch(self, batch: List[Tuple[Dict[str, Any], str, Any]]) -> None:
+        messages = [m for m, _token, _ctx in batch]
+        for attempt in range(1, self.send_attempts + 1):
+            try:
+                tickets = self.client.send(messages)
+                break
+            except (ExpoHttpError, ConnectionError, OSError, http.client.HTTPException) as e:
+                retryable = not isinstance(e, ExpoHttpError) or e.retryable
+                if not retryable or attempt == self.send_attempts:
+                    raise
+                time.sleep(self.retry_base * (2 ** (attempt - 1)) * random.uniform(0.8, 1.2))
+
+        invalid: List[Tuple[str, Any]] = []
+        ok = error = 0
+        due = time.monotonic() + self.receipt_delay
+        with self._lock:
+            for (_msg, token, context), ticket in zip(batch, tickets):
+                if ticket.get("status") == "ok" and ticket.get("id"):
+                    ok += 1
+                    self._receipts[ticket["id"]] = (token, context, due)
+                    while len(self._receipts) > PUSH_RECEIPTS_MAX_PENDING:
+                        self._receipts.popitem(last=False)
+                else:
+                    error += 1
+                    if (ticket.get("details") or {}).get("error") == "DeviceNotRegistered":
+                        invalid.append((token, context))
+            self.messages_sent += len(messages)
+            self.tickets_ok += ok
+            self.tickets_error += error
+        self._report_invalid(invalid)
+
+    # ---------- recibos ----------
+    def _run_receipts(self) -> None:
+        while True:
+            time.sleep(self.receipt_poll)
+            try:
+                self.check_receipts()
+            except Exception:
+                with self._lock:
+                    self.errors += 1
+                logger.exception("Falha ao consultar recibos de push")
+
+    def check_receipts(self, force: bool = False) -> int:
+        """Consulta os recibos vencidos (todos, se force). Retorna quantos foram consultados."""
+        now = time.monotonic()
+        with self._lock:
+            due = [(tid, entry) for tid, entry in self._receipts.items() if force or entry[2] <= now]
+
+        checked = 0
+        for start in range(0, len(due), EXPO_RECEIPTS_BATCH_SIZE):
+            chunk = dict(due[start:start + EXPO_RECEIPTS_BATCH_SIZE])
+            receipts = self.client.receipts(list(chunk))
+            invalid: List[Tuple[str, Any]] = []
+            errors = 0
+            for ticket_id, receipt in receipts.items():
+                if receipt.get("status") == "error":
+                    errors += 1
+                    if (receipt.get("details") or {}).get("error") == "DeviceNotRegistered" and ticket_id in chunk:
+                        token, context, _due = chunk[ticket_id]
+                        invalid.append((token, context))
+            with self._lock:
+                # Ids sem recibo ainda não foram processados pela Expo: ficam para a próxima
+                for ticket_id in receipts:
+                    self._receipts.pop(ticket_id, None)
+                self.receipts_checked += len(receipts)
+                self.receipts_error += errors
+            checked += len(receipts)
+            self._report_invalid(invalid)
+        return checked
+
+    def _report_invalid(self, invalid: List[Tuple[str, Any]]) -> None:
+        if not invalid:
+            return
+        with self._lock:
+            self.invalid_tokens += len(invalid)
+        by_context: Dict[Any, List[str]] = {}
+        for token, context in invalid:
+            by_context.setdefault(context, []).append(token)
+        for context, tokens in by_context.items():
+            logger.info("Expo: %d token(s) inválidos (contexto %s)", len(tokens), context)
+            if self.on_invalid_tokens is not None:
+                try:
+                    self.on_invalid_tokens(context, tokens)
+                except Exception:
+                    logger.exception("Falha no tratamento de tokens inválidos")
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            stats = {
+                "workers": self.workers,
+                "queued": self._queue.qsize(),
+                "maxQueue": self.max_queue,
+                "enqueued": self.enqueued,
+                "dropped": self.dropped,
+                "messagesSent": self.messages_sent,
+                "ticketsOk": self.tickets_ok,
+                "ticketsError": self.tickets_error,
+                "receiptsPending": len(self._receipts),
+                "receiptsChecked": self.receipts_checked,
+                "receiptsError": self.receipts_error,
+                "invalidTokens": self.invalid_tokens,
+                "errors": self.errors,
+            }
+        stats["http"] = self.client.stats()
+        return stats
+
+
+push_dispatcher = PushDispatcher(
+    ExpoClient(EXPO_PUSH_URL, EXPO_RECEIPTS_URL, EXPO_TIMEOUT, EXPO_ACCESS_TOKEN),
+    workers=PUSH_WORKERS,
+    max_queue=PUSH_QUEUE_MAX,
+)
+
+
+# ============================================================
+# Admins do tenant
+# ============================================================
+# tenant_id -> tokens dos admins
+admin_tokens_cache = TTLCache("push.admin_tokens", PUSH_ADMIN_TOKENS_MAX, PUSH_ADMIN_TOKENS_TTL)
+# Tokens que a Expo reportou como DeviceNotRegistered (continuam no banco do tenant)
+invalid_tokens_cache = TTLCache("push.invalid_tokens", PUSH_ADMIN_TOKENS_MAX * 4, PUSH_INVALID_TOKENS_TTL)
+
+
+def _load_admin_push_tokens(tenant: Dict[str, Any]) -> List[str]:
+    """user_tenants (hub) -> users.fk_id_user_hub (banco do tenant) -> push_tokens."""
+    tenant_id = tenant["id"]
+    db_name = tenant.get("database_name")
+    db_host = tenant.get("database_host") or TENANT_DB_HOST
+    if not db_name:
+        logger.info("[push-join] Tenant %s sem database_name, skip", tenant_id)
+        return []
+
+    admins = fetch_all(
+        """
+        SELECT user_id FROM user_tenants
+        WHERE tenant_id = :tenant_id AND role = 'admin' AND is_active = TRUE
+        """,
+        {"tenant_id": tenant_id},
+    )
+    if not admins:
+        logger.info("[push-join] Nenhum admin ativo no tenant %s", tenant_id)
+        return []
+    admin_hub_ids = [int(a["user_id"]) for a in admins]
+
+    with tenant_connection(db_host, db_name) as conn:
+        tables = [r[0] for r in conn.execute(text(
+            "SELECT TABLE_NAME FROM INFORMATION_SCHEMA.TABLES "
+            "WHERE TABLE_SCHEMA = :db AND TABLE_NAME IN ('users', 'push_tokens')"
+        ), {"db": db_name}).fetchall()]
+        if "push_tokens" not in tables or "users" not in tables:
+            logger.info("[push-join] Tabelas users/push_tokens não existem em %s", db_name)
+            return []
+
+        # Admins locais via fk_id_user_hub (fallback: is_admin = 1)
+        placeholders = ",".join(str(uid) for uid in admin_hub_ids)
+        local_admins = conn.execute(text(
+            f"SELECT id FROM users WHERE fk_id_user_hub IN ({placeholders})"
+        )).fetchall()
+        if not local_admins:
+            local_admins = conn.execute(text("SELECT id FROM users WHERE is_admin = 1")).fetchall()
+
+        local_admin_ids = [int(r[0]) for r in local_admins]
+        if not local_admin_ids:
+            logger.info("[push-join] Nenhum admin local encontrado em %s", db_name)
+            return []
+
+        id_list = ",".join(str(uid) for uid in local_admin_ids)
+        rows = conn.execute(text(
+            f"SELECT token FROM push_tokens WHERE user_id IN ({id_list})"
+        )).fetchall()
+
+    tokens = [r[0] for r in rows if r[0]]
+    non_expo = [t for t in tokens if not is_expo_token(t)]
+    if non_expo:
+        logger.info("[push-join] %d token(s) FCM ignorados (sem Firebase Admin no seletor)", len(non_expo))
+    return tokens
+
+
+def tenant_admin_push_tokens(tenant: Dict[str, Any]) -> List[str]:
+    """Push tokens dos admins do tenant (cache -> hub + banco do tenant)."""
+    tenant_id = int(tenant["id"])
+    tokens = admin_tokens_cache.get(tenant_id)
+    if tokens is None:
+        loaded = _load_admin_push_tokens(tenant)
+        tokens = tuple(t for t in loaded if invalid_tokens_cache.get(t) is None)
+        admin_tokens_cache.set(tenant_id, tokens)
+    return list(tokens)
+
+
+def _forget_invalid_tokens(tenant_id: Any, tokens: List[str]) -> None:
+    """Tokens DeviceNotRegistered saem do cache do tenant e não voltam no reload."""
+    for token in tokens:
+        invalid_tokens_cache.set(token, True)
+    if tenant_id is None:
+        return
+    cached = admin_tokens_cache.get(tenant_id)
+    if cached is not None:
+        admin_tokens_cache.set(tenant_id, tuple(t for t in cached if t not in tokens))
+
+
+push_dispatcher.on_invalid_tokens = _forget_invalid_tokens
+
+
+def invalidate_admin_push_tokens(tenant_id: Optional[int]) -> None:
+    """Descarta os tokens em cache do tenant (após o COMMIT, se em transaction())."""
+    if tenant_id is None:
+        return
+    tid = int(tenant_id)
+    after_commit(lambda: admin_tokens_cache.pop(tid))
+
+
+def notify_tenant_admins(tenant: Dict[str, Any], title: str, body: str, data: Optional[Dict[str, Any]] = None) -> bool:
+    """Enfileira um push para os admins do tenant (tokens resolvidos no worker)."""
+    target = {
+        "id": tenant["id"],
+        "database_name": tenant.get("database_name"),
+        "database_host": tenant.get("database_host"),
+    }
+    message = {
+        "title": title,
+        "body": body,
+        "sound": "default",
+        "data": data or {},
+        "channelId": "default",
+        "priority": "high",
+    }
+    return push_dispatcher.submit(lambda: tenant_admin_push_tokens(target), message, context=target["id"])
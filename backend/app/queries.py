@@ -0,0 +1,162 @@
+"""
+Queries nomeadas do hub (inventário das queries quentes).
+
+Cada query é declarada uma vez aqui e chamada pelo nome nas rotas
+(query_one / query_all / query_execute em app.db). Contagem e tempo
+por query aparecem em /api/internal/metrics.
+
+Também ficam aqui os records de projeção usados pelas listagens quentes
+(fetch_rows / fetch_iter com record=): só as colunas que os DTOs devolvem.
+"""
+from __future__ import annotations
+
+from app.db import record_type, register_query, select_list
+
+# ------------------------------------------------------------
+# Records de projeção
+# ------------------------------------------------------------
+# Colunas de users lidas por _user_profile_dto (user_routes)
+USER_PROFILE_FIELDS = (
+    "id", "name", "nickname", "email", "phone", "cpf", "cnpj",
+    "avatar_url", "bio", "cep", "logradouro", "numero", "bairro",
+    "complemento", "city", "state", "timezone", "is_active", "created_at",
+)
+UserProfileRow = record_type("UserProfileRow", USER_PROFILE_FIELDS)
+TenantUserProfileRow = record_type("TenantUserProfileRow", USER_PROFILE_FIELDS + ("role", "joined_at"))
+
+# Membro de tenant nas listagens do super-admin (_member_row_to_dto)
+MemberRow = record_type("MemberRow", ("id", "name", "email", "phone", "role", "is_active", "joined_at"))
+
+# Tenant resolvido por slug/id (app.tenants.resolve_tenant): o que as rotas
+# leem do tenant, sem created_at/updated_at/cnpj etc.
+TenantRecord = record_type("TenantRecord", (
+    "id", "slug", "display_name", "system_id", "database_name", "database_host",
+    "logo_url", "primary_color", "welcome_message", "address", "city", "state",
+    "phone", "email", "allow_registration", "is_active", "maintenance_mode",
+    "member_count", "system_slug", "system_name", "system_icon", "system_color",
+    "system_is_active",
+))
+
+# ------------------------------------------------------------
+# Auth (login_required / login / me)
+# ------------------------------------------------------------
+register_query(
+    "auth.session_by_token",
+    """
+    SELECT id, user_id, current_tenant_id
+    FROM user_sessions
+    WHERE token_hash = :token_hash
+      AND revoked_at IS NULL
+      AND expires_at > NOW()
+    """,
+)
+
+# Projeção do usuário autenticado (g.current_user, cache de sessão).
+# Sem password_hash / tokens: quem precisa deles lê direto do banco.
+AUTH_USER_COLUMNS = (
+    "id, name, nickname, email, phone, cpf, cnpj, avatar_url, bio, cep, "
+    "logradouro, numero, bairro, complemento, city, state, timezone, "
+    "is_active, is_blocked, blocked_reason, created_at, last_login_at, "
+    "onboarding_completed_at, email_verified_at, email_verification_sent_at"
+)
+
+register_query(
+    "auth.user_active_by_id",
+    f"SELECT {AUTH_USER_COLUMNS} FROM users WHERE id = :id AND is_active = TRUE",
+)
+
+register_query(
+    "auth.user_by_email",
+    "SELECT * FROM users WHERE email = :email",
+)
+
+# Carga do índice em memória (app.super_admins)
+register_query(
+    "auth.active_super_admins",
+    "SELECT email FROM super_admins WHERE is_active = TRUE",
+)
+
+# ------------------------------------------------------------
+# Catálogo público
+# ------------------------------------------------------------
+register_query(
+    "catalog.active_systems",
+    """
+    SELECT id, slug, display_name, description, icon, color, base_route, is_active
+    FROM systems
+    WHERE is_active = 1
+    ORDER BY display_order ASC, id ASC
+    """,
+)
+
+# Tenants ativos para o snapshot do catálogo (app.catalog): sistemas
+# inativos e tenants em manutenção entram e são filtrados por view
+register_query(
+    "catalog.active_tenants",
+    """
+    SELECT
+        t.id, t.slug, t.display_name, t.logo_url, t.primary_color,
+        t.welcome_message, t.allow_registration, t.maintenance_mode,
+        s.slug AS system_slug, s.display_name AS system_name,
+        s.icon AS system_icon, s.color AS system_color,
+        s.is_active AS system_is_active, t.member_count
+    FROM tenants t
+    INNER JOIN systems s ON t.system_id = s.id
+    WHERE t.is_active = TRUE
+    ORDER BY s.display_order, t.display_name
+    """,
+)
+
+# ------------------------------------------------------------
+# Tenants (app.tenants)
+# ------------------------------------------------------------
+_TENANT_RECORD_COLUMNS = select_list(
+    TenantRecord, "t",
+    system_slug="s.slug AS system_slug",
+    system_name="s.display_name AS system_name",
+    system_icon="s.icon AS system_icon",
+    system_color="s.color AS system_color",
+    system_is_active="s.is_active AS system_is_active",
+)
+
+register_query(
+    "tenants.by_slug",
+    f"""
+    SELECT {_TENANT_RECORD_COLUMNS}
+    FROM tenants t
+    INNER JOIN systems s ON s.id = t.system_id
+    WHERE t.slug = :slug
+    """,
+)
+
+register_query(
+    "tenants.by_id",
+    f"""
+    SELECT {_TENANT_RECORD_COLUMNS}
+    FROM tenants t
+    INNER JOIN systems s ON s.id = t.system_id
+    WHERE t.id = :id
+    """,
+)
+
+# ------------------------------------------------------------
+# Membership
+# ------------------------------------------------------------
+register_query(
+    "membership.my_tenants",
+    """
+    SELECT
+        t.id, t.slug, t.display_name, t.logo_url, t.primary_color,
+        t.welcome_message,
+        s.slug AS system_slug, s.display_name AS system_name,
+        s.icon AS system_icon, s.color AS system_color,
+        ut.role, ut.joined_at
+    FROM user_tenants ut
+    INNER JOIN tenants t ON ut.tenant_id = t.id
+    INNER JOIN systems s ON t.system_id = s.id
+    WHERE ut.user_id = :user_id
+      AND ut.is_active = TRUE
+      AND t.is_active = TRUE
+    ORDER BY s.display_order, t.display_name
+    """,
+)
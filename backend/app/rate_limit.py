@@ -0,0 +1,265 @@
+"""
+Rate limiting das rotas sensíveis (login).
+
+RateLimiter aplica um limite "N tentativas por janela" a uma chave (IP,
+email...). O armazenamento é plugável:
+
+- memory (padrão): token bucket em memória, por worker.
+- db: janela fixa na tabela rate_limit_hits do MASTER (migration 011),
+  compartilhada entre workers e nós.
+- set_backend(obj): qualquer objeto com hit(key, limit, window) -> (allowed, retry_after)
+  (ex.: um backend Redis).
+
+O decorator rate_limited roda antes do handler, portanto antes de
+qualquer query ou hash de senha.
+"""
+from __future__ import annotations
+
+import hashlib
+import ipaddress
+import logging
+import math
+import os
+import random
+import threading
+import time
+from collections import OrderedDict
+from functools import wraps
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from flask import jsonify, request
+
+from app.db import execute_sql, fetch_one, transaction
+
+logger = logging.getLogger(__name__)
+
+RATE_LIMIT_ENABLED = os.getenv("RATE_LIMIT_ENABLED", "1") == "1"
+RATE_LIMIT_BACKEND = os.getenv("RATE_LIMIT_BACKEND", "memory").strip().lower()
+RATE_LIMIT_MEMORY_MAX_KEYS = int(os.getenv("RATE_LIMIT_MEMORY_MAX_KEYS", "100000"))
+# X-Real-IP é definido pelo nginx ($remote_addr, blocos 80 e 443) e só vale
+# quando a conexão vem de um desses CIDRs (o nginx na rede do compose). De
+# qualquer outro endereço o header é ignorado, senão o cliente forja um
+# bucket novo por request. Vazio = nunca confia (usa remote_addr).
+RATE_LIMIT_TRUSTED_PROXIES = os.getenv("RATE_LIMIT_TRUSTED_PROXIES", "")
+
+
+def _parse_networks(value: str) -> Tuple[Any, ...]:
+    networks = []
+    for item in (value or "").split(","):
+        item = item.strip()
+        if not item:
+            continue
+        try:
+            networks.append(ipaddress.ip_network(item, strict=False))
+        except ValueError:
+            logger.warning("RATE_LIMIT_TRUSTED_PROXIES: CIDR inválido ignorado: %s", item)
+    return tuple(networks)
+
+
+_trusted_proxies = _parse_networks(RATE_LIMIT_TRUSTED_PROXIES)
+
+
+def parse_rate(value: str) -> Tuple[int, float]:
+    """'10/60' -> (10, 60.0): 10 tentativas a cada 60 segundos."""
+    limit, _, window = (value or "").partition("/")
+    return max(1, int(limit)), max(1.0, float(window or 60))
+
+
+# ============================================================
+# Backends
+# ============================================================
+class MemoryBackend:
+    """Token bucket por chave; LRU limitado a max_keys chaves."""
+
+    def __init__(self, max_keys: int) -> None:
+        self.max_keys = max(1, max_keys)
+        self._buckets: "OrderedDict[str, Tuple[float, float]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def hit(self, key: str, limit: int, window: float) -> Tuple[bool, float]:
+        rate = limit / window
+        now = time.monotonic()
+        with self._lock:
+            tokens, updated = self._buckets.get(key, (float(limit), now))
+            tokens = min(float(limit), tokens + (now - updated) * rate)
+            allowed = tokens >= 1.0
+            if allowed:
+                tokens -= 1.0
+            self._buckets[key] = (tokens, now)
+            self._buckets.move_to_end(key)
+            while len(self._buckets) > self.max_keys:
+                self._buckets.popitem(last=False)
+        retry_after = 0.0 if allowed else (1.0 - tokens) / rate
+        return allowed, retry_after
+
+
+class DbBackend:
+    """Janela fixa em rate_limit_hits (MASTER DB), compartilhada entre processos."""
+
+    CLEANUP_PROBABILITY = 0.01
+
+    def hit(self, key: str, limit: int, window: float) -> Tuple[bool, float]:
+        now = time.time()
+        window_start = int(now // window * window)
+        bucket = hashlib.sha256(key.encode("utf-8")).hexdigest()
+        with transaction():
+            execute_sql(
+                """
+                INSERT INTO rate_limit_hits (bucket, window_start, hits)
+                VALUES (:bucket, :ws, 1)
+                ON DUPLICATE KEY UPDATE hits = hits + 1
+                """,
+                {"bucket": bucket, "ws": window_start},
+            )
+            row = fetch_one(
+                "SELECT hits FROM rate_limit_hits WHERE bucket = :bucket AND window_start = :ws",
+                {"bucket": bucket, "ws": window_start},
+            )
+        if random.random() < self.CLEANUP_PROBABILITY:
+            execute_sql(
+                "DELETE FROM rate_limit_hits WHERE window_start < :cutoff",
+                {"cutoff": int(now - 86400)},
+            )
+        hits = row["hits"] if row else 1
+        if hits <= limit:
+            return True, 0.0
+        return False, window_start + window - now
+
+
+def _default_backend() -> Any:
+    if RATE_LIMIT_BACKEND == "db":
+        return DbBackend()
+    return MemoryBackend(RATE_LIMIT_MEMORY_MAX_KEYS)
+
+
+_backend: Any = _default_backend()
+
+
+def set_backend(backend: Any) -> None:
+    """Troca o backend de todos os limiters (ex.: Redis compartilhado)."""
+    global _backend
+    _backend = backend
+
+
+# ============================================================
+# Limiters
+# ============================================================
+class RateLimiter:
+    """limit tentativas por window segundos, por chave."""
+
+    def __init__(self, name: str, limit: int, window: float) -> None:
+        self.name = name
+        self.limit = limit
+        self.window = window
+        self.allowed = 0
+        self.blocked = 0
+        self.errors = 0
+        self._lock = threading.Lock()
+        _limiters.append(self)
+
+    @classmethod
+    def from_env(cls, name: str, env_var: str, default: str) -> "RateLimiter":
+        limit, window = parse_rate(os.getenv(env_var, default))
+        return cls(name, limit, window)
+
+    def hit(self, key: str) -> Tuple[bool, float]:
+        """Conta uma tentativa. Falha do backend libera (fail-open)."""
+        try:
+            allowed, retry_after = _backend.hit(f"{self.name}:{key}", self.limit, self.window)
+        except Exception:
+            with self._lock:
+                self.errors += 1
+            logger.exception("Rate limit '%s' indisponível; liberando", self.name)
+            return True, 0.0
+        with self._lock:
+            if allowed:
+                self.allowed += 1
+            else:
+                self.blocked += 1
+        return allowed, retry_after
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "limit": self.limit,
+            "windowSeconds": self.window,
+            "allowed": self.allowed,
+            "blocked": self.blocked,
+            "errors": self.errors,
+        }
+
+
+_limiters: List[RateLimiter] = []
+
+
+def rate_limit_stats() -> Dict[str, Any]:
+    return {
+        "backend": type(_backend).__name__,
+        "limiters": {lim.name: lim.stats() for lim in _limiters},
+    }
+
+
+# ============================================================
+# Chaves e decorator
+# ============================================================
+def _is_trusted_proxy(addr: Optional[str]) -> bool:
+    if not addr or not _trusted_proxies:
+        return False
+    try:
+        ip = ipaddress.ip_address(addr)
+    except ValueError:
+        return False
+    return any(ip in net for net in _trusted_proxies)
+
+
+def client_ip() -> Optional[str]:
+    """IP do cliente: X-Real-IP se a conexão veio de um proxy confiável, senão remote_addr."""
+    remote = request.remote_addr
+    if _is_trusted_proxy(remote):
+        real_ip = request.headers.get("X-Real-IP", "").strip()
+        try:
+            return str(ipaddress.ip_address(real_ip))
+        except ValueError:
+            pass
+    return remote
+
+
+def json_email() -> Optional[str]:
+    data = request.get_json(silent=True)
+    if not isinstance(data, dict):
+        return None
+    email = str(data.get("email") or "").strip().lower()
+    return email or None
+
+
+def rate_limited(*rules: Tuple[RateLimiter, Callable[[], Optional[str]]]):
+    """
+    Decorator: cada regra é (limiter, função que extrai a chave do request).
+    Chave None pula a regra. Bloqueio responde 429 + Retry-After.
+    """
+    def decorator(f):
+        @wraps(f)
+        def decorated(*args, **kwargs):
+            if RATE_LIMIT_ENABLED:
+                for limiter, key_fn in rules:
+                    key = key_fn()
+                    if not key:
+                        continue
+                    allowed, retry_after = limiter.hit(key)
+                    if not allowed:
+                        wait = max(1, math.ceil(retry_after))
+                        response = jsonify({"error": f"Muitas tentativas. Tente novamente em {wait}s."})
+                        response.status_code = 429
+                        response.headers["Retry-After"] = str(wait)
+                        return response
+            return f(*args, **kwargs)
+        return decorated
+    return decorator
+
+
+# Limites do login (hub e super-admin)
+login_ip_limiter = RateLimiter.from_env("login.ip", "LOGIN_RATE_LIMIT_IP", "30/60")
+login_email_limiter = RateLimiter.from_env("login.email", "LOGIN_RATE_LIMIT_EMAIL", "10/300")
+super_admin_login_ip_limiter = RateLimiter.from_env("super_admin_login.ip", "SUPER_ADMIN_LOGIN_RATE_LIMIT_IP", "10/60")
+super_admin_login_email_limiter = RateLimiter.from_env(
+    "super_admin_login.email", "SUPER_ADMIN_LOGIN_RATE_LIMIT_EMAIL", "5/300",
+)
@@ -21,8 +21,14 @@ from functools import wraps
 
 from flask import Blueprint, g, jsonify, request
 
-from app.db import execute_sql, fetch_all, fetch_one, safe_db_error, ENV
-from app.routes.auth_routes import login_required
+from app.db import execute_sql, fetch_all, fetch_one, safe_db_error, transaction, ENV
+from app.catalog import catalog_response, catalog_view
+from app.member_counts import apply_membership_change, lock_membership
+from app.membership import invalidate_membership
+from app.push_dispatcher import invalidate_admin_push_tokens
+from app.routes.auth_routes import invalidate_user_sessions, login_required
+from app.super_admins import is_super_admin
+from app.tenants import resolve_tenant
 
 admin_user_bp = Blueprint("admin_users", __name__, url_prefix="/api/admin")
 
@@ -32,11 +38,7 @@ def _super_admin_required(f):
     @wraps(f)
     @login_required
     def decorated(*args, **kwargs):
-        sa = fetch_one(
-            "SELECT 1 FROM super_admins WHERE email = :email AND is_active = TRUE",
-            {"email": g.current_user["email"]},
-        )
-        if not sa:
+        if not is_super_admin(g.current_user["email"]):
             return jsonify({"error": "Acesso restrito a super administradores"}), 403
         return f(*args, **kwargs)
     return decorated
@@ -217,7 +219,9 @@ def update_user(user_id: int):
         execute_sql(
             f"UPDATE users SET {', '.join(sets)} WHERE id = :id",
             params,
+            invalidates=["users"],
         )
+        invalidate_user_sessions(user_id)
         updated = fetch_one("SELECT * FROM users WHERE id = :id", {"id": user_id})
         return jsonify(_user_to_item(updated))
 
@@ -236,6 +240,7 @@ def activate_user(user_id: int):
             "UPDATE users SET is_active = TRUE, is_blocked = FALSE WHERE id = :id",
             {"id": user_id},
         )
+        invalidate_user_sessions(user_id)
         return jsonify({"message": "Usuário ativado", "id": user_id})
     except Exception as e:
         if ENV == "dev":
@@ -252,6 +257,7 @@ def deactivate_user(user_id: int):
             "UPDATE users SET is_active = FALSE WHERE id = :id",
             {"id": user_id},
         )
+        invalidate_user_sessions(user_id)
         return jsonify({"message": "Usuário desativado", "id": user_id})
     except Exception as e:
         if ENV == "dev":
@@ -268,6 +274,7 @@ def delete_user(user_id: int):
             "UPDATE users SET is_active = FALSE, is_blocked = TRUE, blocked_reason = 'deleted_by_admin' WHERE id = :id",
             {"id": user_id},
         )
+        invalidate_user_sessions(user_id)
         return jsonify({"message": "Usuário removido", "id": user_id})
     except Exception as e:
         if ENV == "dev":
@@ -326,10 +333,7 @@ def add_user_to_tenant(user_id: int, tenant_id: int):
         if not user:
             return jsonify({"error": "Usuário não encontrado"}), 404
 
-        tenant = fetch_one(
-            "SELECT id, display_name FROM tenants WHERE id = :id AND is_active = TRUE",
-            {"id": tenant_id},
-        )
+        tenant = resolve_tenant(tenant_id=tenant_id)
         if not tenant:
             return jsonify({"error": "Tenant não encontrado"}), 404
 
@@ -339,21 +343,27 @@ def add_user_to_tenant(user_id: int, tenant_id: int):
         if role not in valid_roles:
             role = "player"
 
-        execute_sql(
-            """
-            INSERT INTO user_tenants (user_id, tenant_id, role, approved_by, approved_at)
-            VALUES (:user_id, :tenant_id, :role, :admin_id, NOW())
-            ON DUPLICATE KEY UPDATE
-                is_active = TRUE, left_at = NULL, role = :role,
-                approved_by = :admin_id, approved_at = NOW()
-            """,
-            {
-                "user_id": user_id,
-                "tenant_id": tenant_id,
-                "role": role,
-                "admin_id": g.current_user_id,
-            },
-        )
+        with transaction():
+            was_active = lock_membership(tenant_id, user_id)
+            execute_sql(
+                """
+                INSERT INTO user_tenants (user_id, tenant_id, role, approved_by, approved_at)
+                VALUES (:user_id, :tenant_id, :role, :admin_id, NOW())
+                ON DUPLICATE KEY UPDATE
+                    is_active = TRUE, left_at = NULL, role = :role,
+                    approved_by = :admin_id, approved_at = NOW()
+                """,
+                {
+                    "user_id": user_id,
+                    "tenant_id": tenant_id,
+                    "role": role,
+                    "admin_id": g.current_user_id,
+                },
+                invalidates=["user_tenants"],
+            )
+            apply_membership_change(tenant_id, was_active, True)
+            invalidate_membership(user_id)
+            invalidate_admin_push_tokens(tenant_id)
 
         return jsonify({
             "message": f"Usuário adicionado ao {tenant['display_name']}",
@@ -370,14 +380,20 @@ def add_user_to_tenant(user_id: int, tenant_id: int):
 def remove_user_from_tenant(user_id: int, tenant_id: int):
     """Remover user de um tenant (super admin)."""
     try:
-        execute_sql(
-            """
-            UPDATE user_tenants
-            SET is_active = FALSE, left_at = NOW()
-            WHERE user_id = :user_id AND tenant_id = :tenant_id
-            """,
-            {"user_id": user_id, "tenant_id": tenant_id},
-        )
+        with transaction():
+            was_active = lock_membership(tenant_id, user_id)
+            execute_sql(
+                """
+                UPDATE user_tenants
+                SET is_active = FALSE, left_at = NOW()
+                WHERE user_id = :user_id AND tenant_id = :tenant_id
+                """,
+                {"user_id": user_id, "tenant_id": tenant_id},
+                invalidates=["user_tenants"],
+            )
+            apply_membership_change(tenant_id, was_active, False)
+            invalidate_membership(user_id)
+            invalidate_admin_push_tokens(tenant_id)
         return jsonify({"message": "Usuário removido do tenant"})
     except Exception as e:
         if ENV == "dev":
@@ -385,37 +401,31 @@ def remove_user_from_tenant(user_id: int, tenant_id: int):
         return jsonify({"error": safe_db_error(e)}), 500
 
 
+@catalog_view("admin_tenants")
+def _admin_tenants_view(data, _key):
+    return 200, {
+        "tenants": [
+            {
+                "id": t["id"],
+                "slug": t["slug"],
+                "displayName": t["display_name"],
+                "primaryColor": t.get("primary_color"),
+                "systemSlug": t["system_slug"],
+                "systemName": t["system_name"],
+                "systemIcon": t.get("system_icon"),
+                "systemColor": t.get("system_color"),
+            }
+            for t in data.tenants
+        ],
+    }
+
+
 @admin_user_bp.get("/tenants")
 @_super_admin_required
 def list_all_tenants():
     """Lista todos os tenants ativos (para dropdown de seleção)."""
     try:
-        tenants = fetch_all(
-            """
-            SELECT t.id, t.slug, t.display_name, t.primary_color,
-                   s.slug AS system_slug, s.display_name AS system_name,
-                   s.icon AS system_icon, s.color AS system_color
-            FROM tenants t
-            INNER JOIN systems s ON t.system_id = s.id
-            WHERE t.is_active = TRUE
-            ORDER BY s.display_order, t.display_name
-            """
-        )
-        return jsonify({
-            "tenants": [
-                {
-                    "id": t["id"],
-                    "slug": t["slug"],
-                    "displayName": t["display_name"],
-                    "primaryColor": t.get("primary_color"),
-                    "systemSlug": t["system_slug"],
-                    "systemName": t["system_name"],
-                    "systemIcon": t.get("system_icon"),
-                    "systemColor": t.get("system_color"),
-                }
-                for t in tenants
-            ],
-        })
+        return catalog_response("admin_tenants", public=False)
     except Exception as e:
         if ENV == "dev":
             traceback.print_exc()
@@ -13,19 +13,34 @@ from __future__ import annotations
 
 import datetime
 import hashlib
+import logging
 import os
 import re
 import secrets
+import time
 import traceback
 from functools import wraps
-from typing import Any, Dict, Optional
+from typing import Any, Dict, List, Optional
 
 import jwt
 from flask import Blueprint, current_app, g, jsonify, request
-from werkzeug.security import check_password_hash, generate_password_hash
 
-from app.db import execute_sql, fetch_all, fetch_one, safe_db_error
-from app.email_service import is_smtp_configured, send_verification_email
+from app.db import (
+    bulk_upsert, execute_insert, execute_sql, fetch_all, fetch_one, query_one,
+    safe_db_error, transaction,
+)
+from app import queries as _queries  # noqa: F401 (registra as queries nomeadas)
+from app.cache import TTLCache
+from app.membership import get_membership
+from app.password_hashing import PasswordHashBusy, busy_response, password_hasher
+from app.rate_limit import client_ip, json_email, login_email_limiter, login_ip_limiter, rate_limited
+from app.session_activity import session_activity
+from app.super_admins import is_super_admin
+from app.tenants import resolve_tenant
+from app.email_outbox import enqueue_verification_email
+from app.email_service import is_smtp_configured
+
+logger = logging.getLogger(__name__)
 
 _SHA256_RE = re.compile(r"^[a-f0-9]{64}$")
 
@@ -34,12 +49,15 @@ def _verify_stored_password(stored_hash: str, password: str) -> bool:
     """Verifica senha contra hash armazenado (suporta werkzeug e SHA256 legado)."""
     if _SHA256_RE.match(stored_hash):
         return hashlib.sha256(password.encode("utf-8")).hexdigest() == stored_hash
-    return check_password_hash(stored_hash, password)
+    return password_hasher.check(stored_hash, password)
 
 
 def _upgrade_password_hash(user_id: int, password: str) -> None:
-    """Atualiza hash SHA256 legado para werkzeug scrypt."""
-    new_hash = generate_password_hash(password)
+    """Atualiza hash SHA256 legado para werkzeug scrypt (adiado se o pool estiver cheio)."""
+    try:
+        new_hash = password_hasher.generate(password)
+    except PasswordHashBusy:
+        return
     execute_sql(
         "UPDATE users SET password_hash = :hash WHERE id = :id",
         {"hash": new_hash, "id": user_id},
@@ -51,6 +69,16 @@ ENV = os.getenv("ENV", "dev")
 JWT_SECRET = os.getenv("JWT_SECRET", "")
 JWT_EXPIRY_HOURS = int(os.getenv("JWT_EXPIRY_HOURS", "24"))
 
+# Cache de sessões validadas (token_hash -> sessão + usuário projetado).
+# Por worker: revogação em outro processo só vale após o TTL.
+AUTH_SESSION_CACHE_TTL = float(os.getenv("AUTH_SESSION_CACHE_TTL", "30"))
+AUTH_SESSION_CACHE_MAX = int(os.getenv("AUTH_SESSION_CACHE_MAX", "10000"))
+
+session_cache = TTLCache("auth.sessions", AUTH_SESSION_CACHE_MAX, AUTH_SESSION_CACHE_TTL)
+
+# Sistemas que auto-aprovam (join e cadastro entram direto, sem aprovação do admin)
+AUTO_APPROVE_SYSTEMS = {"quadra"}
+
 
 # ------------------------------------------------------------
 # Helpers
@@ -134,6 +162,42 @@ def _revoke_session(token_hash: str, reason: str = None) -> None:
         """,
         {"token_hash": token_hash, "reason": reason},
     )
+    session_cache.pop(token_hash)
+
+
+def invalidate_user_sessions(user_id: int) -> None:
+    """
+    Descarta do cache todas as sessões do usuário. Chamar após alterar
+    users (perfil, status, senha) ou user_sessions do usuário.
+    """
+    session_cache.invalidate_tag(("user", int(user_id)))
+
+
+def _load_session(token_hash: str, user_id: int) -> Optional[tuple]:
+    """(session, user) do banco, com fallback no primário para linhas recém-criadas."""
+    session = query_one("auth.session_by_token", {"token_hash": token_hash})
+    if not session:
+        session = query_one("auth.session_by_token", {"token_hash": token_hash}, primary=True)
+    if not session:
+        return None
+
+    user = query_one("auth.user_active_by_id", {"id": user_id})
+    if not user:
+        user = query_one("auth.user_active_by_id", {"id": user_id}, primary=True)
+    return session, user
+
+
+def _parse_int_ids(values) -> List[int]:
+    """Converte lista vinda do JSON em ids inteiros únicos (ignora inválidos)."""
+    ids: List[int] = []
+    for v in values or []:
+        try:
+            i = int(v)
+        except (TypeError, ValueError):
+            continue
+        if i not in ids:
+            ids.append(i)
+    return ids
 
 
 def _user_to_dto(row: Dict[str, Any]) -> Dict[str, Any]:
@@ -187,39 +251,29 @@ def login_required(f):
         except jwt.InvalidTokenError:
             return jsonify({"error": "Token inválido"}), 401
 
-        # Verificar se sessão ainda é válida
+        # Verificar se sessão ainda é válida (cache -> banco)
         token_hash = _hash_token(token)
-        session = fetch_one(
-            """
-            SELECT id, user_id, current_tenant_id
-            FROM user_sessions
-            WHERE token_hash = :token_hash
-              AND revoked_at IS NULL
-              AND expires_at > NOW()
-            """,
-            {"token_hash": token_hash},
-        )
-
-        if not session:
-            return jsonify({"error": "Sessão inválida ou expirada"}), 401
-
-        # Buscar usuário
-        user = fetch_one(
-            "SELECT * FROM users WHERE id = :id AND is_active = TRUE",
-            {"id": payload["user_id"]},
-        )
-
-        if not user:
-            return jsonify({"error": "Usuário não encontrado ou inativo"}), 401
+        cached = session_cache.get(token_hash)
+        if cached is None:
+            loaded = _load_session(token_hash, payload["user_id"])
+            if not loaded:
+                return jsonify({"error": "Sessão inválida ou expirada"}), 401
+            session, user = loaded
+            if not user:
+                return jsonify({"error": "Usuário não encontrado ou inativo"}), 401
+
+            if not user.get("is_blocked"):
+                # Não passa do exp do JWT
+                ttl = min(AUTH_SESSION_CACHE_TTL, payload["exp"] - time.time())
+                session_cache.set(token_hash, (session, user), ttl=ttl, tags=[("user", int(user["id"]))])
+        else:
+            session, user = cached
 
         if user.get("is_blocked"):
             return jsonify({"error": "Conta bloqueada", "reason": user.get("blocked_reason")}), 403
 
-        # Atualizar última atividade
-        execute_sql(
-            "UPDATE user_sessions SET last_activity_at = NOW() WHERE id = :id",
-            {"id": session["id"]},
-        )
+        # Atualizar última atividade (write-behind, gravado em lote)
+        session_activity.touch(session["id"])
 
         # Disponibilizar no contexto
         g.current_user = user
@@ -289,98 +343,104 @@ def register():
                 return jsonify({"error": "Este CPF já está cadastrado"}), 409
 
         # Criar usuário
-        password_hash = generate_password_hash(password)
+        password_hash = password_hasher.generate(password)
 
-        execute_sql(
-            """
-            INSERT INTO users (
-                name, nickname, email, phone, cpf, cnpj,
-                cep, logradouro, numero, bairro, complemento,
-                city, state, timezone, password_hash
-            ) VALUES (
-                :name, :nickname, :email, :phone, :cpf, :cnpj,
-                :cep, :logradouro, :numero, :bairro, :complemento,
-                :city, :state, :timezone, :password_hash
+        verification_token = secrets.token_urlsafe(32)
+        user = {
+            "name": name,
+            "nickname": nickname,
+            "email": email,
+            "phone": phone,
+            "cpf": cpf,
+            "cnpj": cnpj,
+            "cep": cep,
+            "logradouro": logradouro,
+            "numero": numero,
+            "bairro": bairro,
+            "complemento": complemento,
+            "city": city,
+            "state": state,
+            "timezone": tz,
+        }
+        interest_ids = _parse_int_ids(interests)
+
+        # Usuário (já com token de verificação), interesses e auto-join:
+        # até 3 statements numa transação, sem loop por interesse
+        with transaction() as conn:
+            user["id"] = execute_insert(
+                """
+                INSERT INTO users (
+                    name, nickname, email, phone, cpf, cnpj,
+                    cep, logradouro, numero, bairro, complemento,
+                    city, state, timezone, password_hash,
+                    email_verification_token, email_verification_sent_at
+                ) VALUES (
+                    :name, :nickname, :email, :phone, :cpf, :cnpj,
+                    :cep, :logradouro, :numero, :bairro, :complemento,
+                    :city, :state, :timezone, :password_hash,
+                    :verification_token, NOW()
+                )
+                """,
+                {**user, "password_hash": password_hash, "verification_token": verification_token},
             )
-            """,
-            {
-                "name": name,
-                "nickname": nickname,
-                "email": email,
-                "phone": phone,
-                "cpf": cpf,
-                "cnpj": cnpj,
-                "cep": cep,
-                "logradouro": logradouro,
-                "numero": numero,
-                "bairro": bairro,
-                "complemento": complemento,
-                "city": city,
-                "state": state,
-                "timezone": tz,
-                "password_hash": password_hash,
-            },
-        )
 
-        # Buscar usuário criado
-        user = fetch_one("SELECT * FROM users WHERE email = :email", {"email": email})
+            if interest_ids:
+                ids_params = {f"sid{i}": sid for i, sid in enumerate(interest_ids)}
+                ids_sql = ", ".join(f":{k}" for k in ids_params)
 
-        # Gerar token de verificação de email e enviar
-        verification_token = secrets.token_urlsafe(32)
-        execute_sql(
-            """UPDATE users
-               SET email_verification_token = :token, email_verification_sent_at = NOW()
-               WHERE id = :id""",
-            {"token": verification_token, "id": user["id"]},
-        )
-        if is_smtp_configured():
-            try:
-                send_verification_email(email, name, verification_token)
-            except Exception:
-                pass  # Não falha o registro se o email não for enviado
-
-        # Salvar interesses (lead capture)
-        if interests:
-            for sys_id in interests:
-                try:
-                    execute_sql(
-                        """
-                        INSERT INTO user_interests (user_id, system_id)
-                        VALUES (:user_id, :system_id)
-                        ON DUPLICATE KEY UPDATE created_at = created_at
-                        """,
-                        {"user_id": user["id"], "system_id": int(sys_id)},
-                    )
-                except Exception:
-                    pass  # ignora system_id inválido
+                # Interesses (lead capture) - o SELECT descarta system_id inexistente
+                execute_sql(
+                    f"""
+                    INSERT IGNORE INTO user_interests (user_id, system_id)
+                    SELECT :user_id, s.id FROM systems s WHERE s.id IN ({ids_sql})
+                    """,
+                    {"user_id": user["id"], **ids_params},
+                )
 
-        # Auto-join: sistemas auto-approve (ex: quadra) adicionam user direto
-        _AUTO_APPROVE_SYSTEMS = {"quadra"}
-        if interests:
-            for sys_id in interests:
+                # Auto-join: tenants ativos dos sistemas auto-approve (ex: quadra).
+                # Vínculos e member_count num SAVEPOINT: entram juntos ou nenhum
+                # entra, sem derrubar o registro.
                 try:
-                    system = fetch_one(
-                        "SELECT slug FROM systems WHERE id = :id",
-                        {"id": int(sys_id)},
-                    )
-                    if not system or system["slug"] not in _AUTO_APPROVE_SYSTEMS:
-                        continue
-
-                    auto_tenants = fetch_all(
-                        "SELECT id FROM tenants WHERE system_id = :sys_id AND is_active = TRUE",
-                        {"sys_id": int(sys_id)},
-                    )
-                    for t in auto_tenants:
+                    with conn.begin_nested():
+                        slug_params = {f"slug{i}": slug for i, slug in enumerate(sorted(AUTO_APPROVE_SYSTEMS))}
                         execute_sql(
-                            """
+                            f"""
                             INSERT INTO user_tenants (user_id, tenant_id, role)
-                            VALUES (:user_id, :tenant_id, 'client')
+                            SELECT :user_id, t.id, 'client'
+                            FROM tenants t
+                            JOIN systems s ON s.id = t.system_id
+                            WHERE s.id IN ({ids_sql})
+                              AND s.slug IN ({", ".join(f":{k}" for k in slug_params)})
+                              AND t.is_active = TRUE
                             ON DUPLICATE KEY UPDATE is_active = TRUE, left_at = NULL
                             """,
-                            {"user_id": user["id"], "tenant_id": t["id"]},
+                            {"user_id": user["id"], **ids_params, **slug_params},
+                            invalidates=["user_tenants"],
+                        )
+                        # Usuário novo: todo vínculo acima é membro novo do tenant
+                        execute_sql(
+                            """
+                            UPDATE tenants t
+                            JOIN user_tenants ut ON ut.tenant_id = t.id
+                            SET t.member_count = t.member_count + 1
+                            WHERE ut.user_id = :user_id AND ut.is_active = TRUE
+                            """,
+                            {"user_id": user["id"]},
                         )
                 except Exception:
-                    pass  # ignora erro silenciosamente
+                    # best-effort: o registro segue sem os vínculos automáticos
+                    logger.exception("Falha no auto-join do usuário %s", user["id"])
+
+            # Email de verificação vai para o outbox (enviado só após o COMMIT)
+            if is_smtp_configured():
+                try:
+                    enqueue_verification_email(email, name, verification_token)
+                except Exception:
+                    pass  # Não falha o registro se o email não for enfileirado
+
+        # Resposta montada com o que foi inserido (sem SELECT de volta)
+        user["is_active"] = True
+        user["created_at"] = datetime.datetime.utcnow()
 
         # Gerar token
         token = _create_token(user["id"], email)
@@ -394,6 +454,8 @@ def register():
             "user": _user_to_dto(user),
         }), 201
 
+    except PasswordHashBusy as e:
+        return busy_response(e)
     except Exception as e:
         if ENV == "dev":
             traceback.print_exc()
@@ -401,6 +463,7 @@ def register():
 
 
 @auth_bp.post("/login")
+@rate_limited((login_ip_limiter, client_ip), (login_email_limiter, json_email))
 def login():
     """Fazer login."""
     try:
@@ -412,8 +475,9 @@ def login():
         if not email or not password:
             return jsonify({"error": "Email e senha são obrigatórios"}), 400
 
-        # Buscar usuário
-        user = fetch_one("SELECT * FROM users WHERE email = :email", {"email": email})
+        # Buscar usuário (primário: conta recém-criada/senha recém-trocada não pode
+        # depender do lag da réplica)
+        user = query_one("auth.user_by_email", {"email": email}, primary=True)
 
         if not user:
             return jsonify({"error": "Credenciais inválidas"}), 401
@@ -439,6 +503,7 @@ def login():
             "UPDATE users SET last_login_at = NOW() WHERE id = :id",
             {"id": user["id"]},
         )
+        invalidate_user_sessions(user["id"])
 
         # Gerar token
         token = _create_token(user["id"], email)
@@ -446,56 +511,19 @@ def login():
         # Criar sessão
         _create_session(user["id"], token)
 
-        # Buscar tenants do usuário
-        tenants = fetch_all(
-            """
-            SELECT
-                t.id, t.slug, t.display_name, t.logo_url, t.primary_color,
-                s.slug AS system_slug, s.display_name AS system_name,
-                s.icon AS system_icon, s.color AS system_color,
-                ut.role
-            FROM user_tenants ut
-            INNER JOIN tenants t ON ut.tenant_id = t.id
-            INNER JOIN systems s ON t.system_id = s.id
-            WHERE ut.user_id = :user_id
-              AND ut.is_active = TRUE
-              AND t.is_active = TRUE
-            ORDER BY s.display_order, t.display_name
-            """,
-            {"user_id": user["id"]},
-        )
-
-        # Verificar se é super admin
-        sa_row = fetch_one(
-            "SELECT 1 FROM super_admins WHERE email = :email AND is_active = TRUE",
-            {"email": email},
-        )
-        is_super_admin = bool(sa_row)
+        # Tenants do usuário (snapshot)
+        membership = get_membership(user["id"])
 
         return jsonify({
             "message": "Login realizado com sucesso!",
             "token": token,
             "user": _user_to_dto(user),
-            "isSuperAdmin": is_super_admin,
-            "tenants": [
-                {
-                    "id": t["id"],
-                    "slug": t["slug"],
-                    "displayName": t["display_name"],
-                    "logoUrl": t.get("logo_url"),
-                    "primaryColor": t.get("primary_color"),
-                    "role": t["role"],
-                    "system": {
-                        "slug": t["system_slug"],
-                        "displayName": t["system_name"],
-                        "icon": t["system_icon"],
-                        "color": t["system_color"],
-                    },
-                }
-                for t in tenants
-            ],
+            "isSuperAdmin": is_super_admin(user["email"]),
+            "tenants": membership.tenants,
         })
 
+    except PasswordHashBusy as e:
+        return busy_response(e)
     except Exception as e:
         if ENV == "dev":
             traceback.print_exc()
@@ -531,6 +559,7 @@ def logout_all():
             """,
             {"user_id": g.current_user_id},
         )
+        invalidate_user_sessions(g.current_user_id)
         return jsonify({"message": "Todas as sessões foram encerradas"})
     except Exception as e:
         if ENV == "dev":
@@ -543,53 +572,14 @@ def logout_all():
 def get_me():
     """Retorna dados do usuário logado."""
     try:
-        # Buscar tenants
-        tenants = fetch_all(
-            """
-            SELECT
-                t.id, t.slug, t.display_name, t.logo_url, t.primary_color,
-                s.slug AS system_slug, s.display_name AS system_name,
-                s.icon AS system_icon, s.color AS system_color,
-                ut.role
-            FROM user_tenants ut
-            INNER JOIN tenants t ON ut.tenant_id = t.id
-            INNER JOIN systems s ON t.system_id = s.id
-            WHERE ut.user_id = :user_id
-              AND ut.is_active = TRUE
-              AND t.is_active = TRUE
-            ORDER BY s.display_order, t.display_name
-            """,
-            {"user_id": g.current_user_id},
-        )
-
-        # Verificar se é super admin
-        sa_row = fetch_one(
-            "SELECT 1 FROM super_admins WHERE email = :email AND is_active = TRUE",
-            {"email": g.current_user["email"]},
-        )
-        is_super_admin = bool(sa_row)
+        # Tenants (snapshot)
+        membership = get_membership(g.current_user_id)
 
         return jsonify({
             "user": _user_to_dto(g.current_user),
-            "isSuperAdmin": is_super_admin,
+            "isSuperAdmin": is_super_admin(g.current_user["email"]),
             "currentTenantId": g.current_tenant_id,
-            "tenants": [
-                {
-                    "id": t["id"],
-                    "slug": t["slug"],
-                    "displayName": t["display_name"],
-                    "logoUrl": t.get("logo_url"),
-                    "primaryColor": t.get("primary_color"),
-                    "role": t["role"],
-                    "system": {
-                        "slug": t["system_slug"],
-                        "displayName": t["system_name"],
-                        "icon": t["system_icon"],
-                        "color": t["system_color"],
-                    },
-                }
-                for t in tenants
-            ],
+            "tenants": membership.tenants,
         })
 
     except Exception as e:
@@ -689,7 +679,9 @@ def update_me():
         execute_sql(
             f"UPDATE users SET {', '.join(updates)} WHERE id = :id",
             params,
+            invalidates=["users"],
         )
+        invalidate_user_sessions(g.current_user_id)
 
         # Retornar usuário atualizado
         user = fetch_one("SELECT * FROM users WHERE id = :id", {"id": g.current_user_id})
@@ -723,30 +715,36 @@ def change_password():
             return jsonify({"error": "Nova senha deve ter no mínimo 6 caracteres"}), 400
 
         # Verificar senha atual (suporta SHA256 legado e werkzeug)
-        if not _verify_stored_password(g.current_user["password_hash"], current_password):
+        # password_hash não fica em g.current_user (projeção do cache de sessão)
+        row = fetch_one("SELECT password_hash FROM users WHERE id = :id", {"id": g.current_user_id}, primary=True)
+        if not row or not _verify_stored_password(row["password_hash"], current_password):
             return jsonify({"error": "Senha atual incorreta"}), 401
 
         # Atualizar senha
-        new_hash = generate_password_hash(new_password)
-        execute_sql(
-            "UPDATE users SET password_hash = :hash WHERE id = :id",
-            {"hash": new_hash, "id": g.current_user_id},
-        )
+        new_hash = password_hasher.generate(new_password)
+        with transaction():
+            execute_sql(
+                "UPDATE users SET password_hash = :hash WHERE id = :id",
+                {"hash": new_hash, "id": g.current_user_id},
+            )
 
-        # Revogar outras sessões (opcional, por segurança)
-        execute_sql(
-            """
-            UPDATE user_sessions
-            SET revoked_at = NOW(), revoked_reason = 'password_change'
-            WHERE user_id = :user_id
-              AND id != :current_session
-              AND revoked_at IS NULL
-            """,
-            {"user_id": g.current_user_id, "current_session": g.current_session_id},
-        )
+            # Revogar outras sessões (opcional, por segurança)
+            execute_sql(
+                """
+                UPDATE user_sessions
+                SET revoked_at = NOW(), revoked_reason = 'password_change'
+                WHERE user_id = :user_id
+                  AND id != :current_session
+                  AND revoked_at IS NULL
+                """,
+                {"user_id": g.current_user_id, "current_session": g.current_session_id},
+            )
+        invalidate_user_sessions(g.current_user_id)
 
         return jsonify({"message": "Senha alterada com sucesso"})
 
+    except PasswordHashBusy as e:
+        return busy_response(e)
     except Exception as e:
         if ENV == "dev":
             traceback.print_exc()
@@ -792,24 +790,19 @@ def update_my_interests():
         data = request.get_json(silent=True) or {}
         system_ids = data.get("systemIds") or []
 
-        # Limpar interesses antigos
-        execute_sql(
-            "DELETE FROM user_interests WHERE user_id = :user_id",
-            {"user_id": g.current_user_id},
-        )
+        with transaction():
+            # Limpar interesses antigos
+            execute_sql(
+                "DELETE FROM user_interests WHERE user_id = :user_id",
+                {"user_id": g.current_user_id},
+            )
 
-        # Inserir novos
-        for sys_id in system_ids:
-            try:
-                execute_sql(
-                    """
-                    INSERT INTO user_interests (user_id, system_id)
-                    VALUES (:user_id, :system_id)
-                    """,
-                    {"user_id": g.current_user_id, "system_id": int(sys_id)},
-                )
-            except Exception:
-                pass  # ignora system_id inválido
+            # Inserir novos (um INSERT multi-row; IGNORE pula system_id inválido)
+            bulk_upsert(
+                "user_interests",
+                [{"user_id": g.current_user_id, "system_id": sid} for sid in _parse_int_ids(system_ids)],
+                ignore=True,
+            )
 
         return jsonify({"message": "Interesses atualizados com sucesso"})
     except Exception as e:
@@ -827,6 +820,7 @@ def complete_onboarding():
             "UPDATE users SET onboarding_completed_at = NOW() WHERE id = :id",
             {"id": g.current_user_id},
         )
+        invalidate_user_sessions(g.current_user_id)
         return jsonify({"message": "Onboarding concluído"})
     except Exception as e:
         if ENV == "dev":
@@ -866,6 +860,7 @@ def verify_email():
                WHERE id = :id""",
             {"id": user["id"]},
         )
+        invalidate_user_sessions(user["id"])
         return jsonify({"message": "Email verificado com sucesso!"})
 
     except Exception as e:
@@ -888,21 +883,21 @@ def resend_verification():
         if last_sent and (datetime.datetime.utcnow() - last_sent).total_seconds() < 120:
             return jsonify({"error": "Aguarde 2 minutos para reenviar"}), 429
 
-        token = secrets.token_urlsafe(32)
-        execute_sql(
-            """UPDATE users
-               SET email_verification_token = :token, email_verification_sent_at = NOW()
-               WHERE id = :id""",
-            {"token": token, "id": user["id"]},
-        )
-
         if not is_smtp_configured():
             return jsonify({"error": "Serviço de email não configurado"}), 503
 
-        success = send_verification_email(user["email"], user["name"], token)
-        if success:
-            return jsonify({"message": "Email de verificação reenviado"})
-        return jsonify({"error": "Erro ao enviar email"}), 500
+        token = secrets.token_urlsafe(32)
+        with transaction():
+            execute_sql(
+                """UPDATE users
+                   SET email_verification_token = :token, email_verification_sent_at = NOW()
+                   WHERE id = :id""",
+                {"token": token, "id": user["id"]},
+            )
+            enqueue_verification_email(user["email"], user["name"], token)
+        invalidate_user_sessions(user["id"])
+
+        return jsonify({"message": "Email de verificação reenviado"})
 
     except Exception as e:
         if ENV == "dev":
@@ -924,15 +919,9 @@ def switch_tenant():
 
         # Buscar tenant
         if tenant_id:
-            tenant = fetch_one(
-                "SELECT id, slug, display_name FROM tenants WHERE id = :id AND is_active = TRUE",
-                {"id": tenant_id},
-            )
+            tenant = resolve_tenant(tenant_id=tenant_id)
         else:
-            tenant = fetch_one(
-                "SELECT id, slug, display_name FROM tenants WHERE slug = :slug AND is_active = TRUE",
-                {"slug": tenant_slug},
-            )
+            tenant = resolve_tenant(tenant_slug)
 
         if not tenant:
             return jsonify({"error": "Sistema não encontrado"}), 404
@@ -954,6 +943,7 @@ def switch_tenant():
             "UPDATE user_sessions SET current_tenant_id = :tenant_id WHERE id = :session_id",
             {"tenant_id": tenant["id"], "session_id": g.current_session_id},
         )
+        session_cache.pop(g.token_hash)
 
         return jsonify({
             "message": f"Contexto alterado para {tenant['display_name']}",
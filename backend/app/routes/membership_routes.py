@@ -7,151 +7,45 @@ Endpoints:
 - DELETE /api/user/tenants/:id - Sair de um sistema
 - GET  /api/tenants/available - Sistemas disponíveis para inscrição
 - GET  /api/tenants/:slug - Detalhes de um sistema
+- GET  /api/tenant/status - Tenant da requisição (X-Tenant-Slug) e DB no ar
 """
 from __future__ import annotations
 
-import json
 import os
 import traceback
 from typing import Any, Dict
-from urllib.request import Request, urlopen
 
 from flask import Blueprint, g, jsonify, request
-from sqlalchemy import create_engine, text
+from sqlalchemy import text
 
 from app.db import (
-    execute_sql, fetch_all, fetch_one, safe_db_error,
-    build_tenant_database_url, TENANT_DB_HOST,
+    cached_fetch_all, execute_sql, fetch_all, fetch_iter, fetch_one, safe_db_error, transaction,
 )
-from app.routes.auth_routes import login_required
+from app.catalog import catalog_response, catalog_view
+from app.member_counts import apply_membership_change, lock_membership
+from app.membership import get_membership, invalidate_membership
+from app.push_dispatcher import invalidate_admin_push_tokens, notify_tenant_admins
+from app.routes.auth_routes import AUTO_APPROVE_SYSTEMS, invalidate_user_sessions, login_required
+from app.streaming import stream_json_list
+from app.tenant_routing import current_tenant, tenant_db, tenant_required
+from app.tenants import resolve_tenant
 
 membership_bp = Blueprint("membership", __name__)
 
 ENV = os.getenv("ENV", "dev")
 
-# Sistemas que auto-aprovam (não precisam de aprovação do admin)
-AUTO_APPROVE_SYSTEMS = {"quadra"}
-
 
 def _notify_tenant_admins_push(tenant, user_name: str, message: str):
     """
-    Envia push notification para os admins do tenant quando alguém solicita acesso.
-    Busca push_tokens direto do banco do tenant.
+    Enfileira push notification para os admins do tenant quando alguém
+    solicita acesso (tokens e envio à Expo ficam com o push_dispatcher).
     """
+    title = "Nova solicitação de acesso"
+    body = f"{user_name} quer entrar no {tenant.get('display_name', 'sistema')}. {message}".strip()
     try:
-        tenant_id = tenant["id"]
-        db_name = tenant.get("database_name")
-        db_host = tenant.get("database_host") or TENANT_DB_HOST
-
-        if not db_name:
-            print(f"[push-join] Tenant {tenant_id} sem database_name, skip")
-            return
-
-        # 1) Buscar user_ids dos admins deste tenant no hub
-        admins = fetch_all(
-            """
-            SELECT user_id FROM user_tenants
-            WHERE tenant_id = :tenant_id AND role = 'admin' AND is_active = TRUE
-            """,
-            {"tenant_id": tenant_id},
-        )
-        if not admins:
-            print(f"[push-join] Nenhum admin ativo no tenant {tenant_id}")
-            return
-
-        admin_hub_ids = [a["user_id"] for a in admins]
-        print(f"[push-join] Admins do hub para tenant {tenant_id}: {admin_hub_ids}")
-
-        # 2) Para cada admin do hub, buscar fk_id_user_hub no banco do tenant
-        #    e pegar push_tokens
-        url = build_tenant_database_url(db_host, db_name)
-        engine = create_engine(url, pool_pre_ping=True, future=True)
-
-        all_tokens = []
-        with engine.connect() as conn:
-            # Verifica se tabelas existem
-            tables = [r[0] for r in conn.execute(text(
-                "SELECT TABLE_NAME FROM INFORMATION_SCHEMA.TABLES "
-                "WHERE TABLE_SCHEMA = :db AND TABLE_NAME IN ('users', 'push_tokens')"
-            ), {"db": db_name}).fetchall()]
-
-            if "push_tokens" not in tables or "users" not in tables:
-                print(f"[push-join] Tabelas users/push_tokens não existem em {db_name}")
-                engine.dispose()
-                return
-
-            # Buscar user_ids locais dos admins via fk_id_user_hub
-            placeholders = ",".join(str(uid) for uid in admin_hub_ids)
-            local_admins = conn.execute(text(
-                f"SELECT id FROM users WHERE fk_id_user_hub IN ({placeholders})"
-            )).fetchall()
-
-            if not local_admins:
-                # Fallback: buscar por is_admin = 1
-                local_admins = conn.execute(text(
-                    "SELECT id FROM users WHERE is_admin = 1"
-                )).fetchall()
-
-            local_admin_ids = [r[0] for r in local_admins]
-            if not local_admin_ids:
-                print(f"[push-join] Nenhum admin local encontrado em {db_name}")
-                engine.dispose()
-                return
-
-            # Buscar push tokens
-            id_list = ",".join(str(uid) for uid in local_admin_ids)
-            tokens = conn.execute(text(
-                f"SELECT token FROM push_tokens WHERE user_id IN ({id_list})"
-            )).fetchall()
-            all_tokens = [r[0] for r in tokens if r[0]]
-
-        engine.dispose()
-
-        if not all_tokens:
-            print(f"[push-join] Nenhum push token encontrado para admins de {db_name}")
-            return
-
-        # 3) Enviar via Expo Push API
-        expo_tokens = [t for t in all_tokens if "ExponentPushToken" in t]
-        title = "Nova solicitação de acesso"
-        body = f"{user_name} quer entrar no {tenant.get('display_name', 'sistema')}. {message}".strip()
-
-        if expo_tokens:
-            payload = [
-                {
-                    "to": token,
-                    "title": title,
-                    "body": body,
-                    "sound": "default",
-                    "data": {"type": "join_request", "tenant_id": tenant_id},
-                    "channelId": "default",
-                    "priority": "high",
-                }
-                for token in expo_tokens
-            ]
-            req = Request(
-                "https://exp.host/--/api/v2/push/send",
-                data=json.dumps(payload).encode("utf-8"),
-                headers={
-                    "Content-Type": "application/json",
-                    "Accept": "application/json",
-                },
-                method="POST",
-            )
-            try:
-                with urlopen(req, timeout=10) as response:
-                    resp_body = json.loads(response.read().decode("utf-8"))
-                    print(f"[push-join] Expo OK: {len(expo_tokens)} token(s), resp={resp_body}")
-            except Exception as exc:
-                print(f"[push-join] Expo ERRO: {exc}")
-
-        # FCM tokens (não-Expo) - skip por agora, Expo API é suficiente
-        non_expo = [t for t in all_tokens if "ExponentPushToken" not in t]
-        if non_expo:
-            print(f"[push-join] {len(non_expo)} token(s) FCM ignorados (sem Firebase Admin no seletor)")
-
+        notify_tenant_admins(tenant, title, body, {"type": "join_request", "tenant_id": tenant["id"]})
     except Exception as e:
-        print(f"[push-join] Erro ao enviar push: {e}")
+        print(f"[push-join] Erro ao enfileirar push: {e}")
         if ENV == "dev":
             traceback.print_exc()
 
@@ -191,51 +85,11 @@ def _tenant_to_dto(row: Dict[str, Any], include_system: bool = True) -> Dict[str
 def list_my_tenants():
     """Lista todos os sistemas do usuário logado."""
     try:
-        tenants = fetch_all(
-            """
-            SELECT
-                t.id, t.slug, t.display_name, t.logo_url, t.primary_color,
-                t.welcome_message,
-                s.slug AS system_slug, s.display_name AS system_name,
-                s.icon AS system_icon, s.color AS system_color,
-                ut.role, ut.joined_at
-            FROM user_tenants ut
-            INNER JOIN tenants t ON ut.tenant_id = t.id
-            INNER JOIN systems s ON t.system_id = s.id
-            WHERE ut.user_id = :user_id
-              AND ut.is_active = TRUE
-              AND t.is_active = TRUE
-            ORDER BY s.display_order, t.display_name
-            """,
-            {"user_id": g.current_user_id},
-        )
-
-        # Agrupar por sistema
-        by_system = {}
-        for t in tenants:
-            system_slug = t["system_slug"]
-            if system_slug not in by_system:
-                by_system[system_slug] = {
-                    "slug": system_slug,
-                    "displayName": t["system_name"],
-                    "icon": t["system_icon"],
-                    "color": t["system_color"],
-                    "tenants": [],
-                }
-
-            by_system[system_slug]["tenants"].append({
-                "id": t["id"],
-                "slug": t["slug"],
-                "displayName": t["display_name"],
-                "logoUrl": t.get("logo_url"),
-                "primaryColor": t.get("primary_color"),
-                "role": t["role"],
-                "joinedAt": t["joined_at"].isoformat() if t.get("joined_at") else None,
-            })
+        membership = get_membership(g.current_user_id)
 
         return jsonify({
-            "systems": list(by_system.values()),
-            "total": len(tenants),
+            "systems": membership.systems,
+            "total": len(membership.tenants),
         })
 
     except Exception as e:
@@ -260,25 +114,9 @@ def join_tenant():
 
         # Buscar tenant
         if tenant_id:
-            tenant = fetch_one(
-                """
-                SELECT t.*, s.slug AS system_slug, s.display_name AS system_name
-                FROM tenants t
-                INNER JOIN systems s ON t.system_id = s.id
-                WHERE t.id = :id AND t.is_active = TRUE
-                """,
-                {"id": tenant_id},
-            )
+            tenant = resolve_tenant(tenant_id=tenant_id)
         else:
-            tenant = fetch_one(
-                """
-                SELECT t.*, s.slug AS system_slug, s.display_name AS system_name
-                FROM tenants t
-                INNER JOIN systems s ON t.system_id = s.id
-                WHERE t.slug = :slug AND t.is_active = TRUE
-                """,
-                {"slug": tenant_slug},
-            )
+            tenant = resolve_tenant(tenant_slug)
 
         if not tenant:
             return jsonify({"error": "Sistema não encontrado"}), 404
@@ -300,14 +138,20 @@ def join_tenant():
                 return jsonify({"error": "Você já está inscrito neste sistema"}), 409
 
             # Reativar membership
-            execute_sql(
-                """
-                UPDATE user_tenants
-                SET is_active = TRUE, left_at = NULL, joined_at = NOW()
-                WHERE id = :id
-                """,
-                {"id": existing["id"]},
-            )
+            with transaction():
+                was_active = lock_membership(tenant["id"], g.current_user_id)
+                execute_sql(
+                    """
+                    UPDATE user_tenants
+                    SET is_active = TRUE, left_at = NULL, joined_at = NOW()
+                    WHERE id = :id
+                    """,
+                    {"id": existing["id"]},
+                    invalidates=["user_tenants"],
+                )
+                apply_membership_change(tenant["id"], was_active, True)
+                invalidate_membership(g.current_user_id)
+                invalidate_admin_push_tokens(tenant["id"])
 
             return jsonify({
                 "message": f"Bem-vindo de volta ao {tenant['display_name']}!",
@@ -318,14 +162,19 @@ def join_tenant():
 
         # Sistemas que auto-aprovam (ex: quadra) - entrada direta como client
         if system_slug in AUTO_APPROVE_SYSTEMS:
-            execute_sql(
-                """
-                INSERT INTO user_tenants (user_id, tenant_id, role)
-                VALUES (:user_id, :tenant_id, 'client')
-                ON DUPLICATE KEY UPDATE is_active = TRUE, left_at = NULL
-                """,
-                {"user_id": g.current_user_id, "tenant_id": tenant["id"]},
-            )
+            with transaction():
+                was_active = lock_membership(tenant["id"], g.current_user_id)
+                execute_sql(
+                    """
+                    INSERT INTO user_tenants (user_id, tenant_id, role)
+                    VALUES (:user_id, :tenant_id, 'client')
+                    ON DUPLICATE KEY UPDATE is_active = TRUE, left_at = NULL
+                    """,
+                    {"user_id": g.current_user_id, "tenant_id": tenant["id"]},
+                    invalidates=["user_tenants"],
+                )
+                apply_membership_change(tenant["id"], was_active, True)
+                invalidate_membership(g.current_user_id)
 
             return jsonify({
                 "message": f"Você entrou no {tenant['display_name']}!",
@@ -366,13 +215,18 @@ def join_tenant():
             }), 202
 
         # Inscrição direta (allow_registration = true)
-        execute_sql(
-            """
-            INSERT INTO user_tenants (user_id, tenant_id, role)
-            VALUES (:user_id, :tenant_id, 'player')
-            """,
-            {"user_id": g.current_user_id, "tenant_id": tenant["id"]},
-        )
+        with transaction():
+            was_active = lock_membership(tenant["id"], g.current_user_id)
+            execute_sql(
+                """
+                INSERT INTO user_tenants (user_id, tenant_id, role)
+                VALUES (:user_id, :tenant_id, 'player')
+                """,
+                {"user_id": g.current_user_id, "tenant_id": tenant["id"]},
+                invalidates=["user_tenants"],
+            )
+            apply_membership_change(tenant["id"], was_active, True)
+            invalidate_membership(g.current_user_id)
 
         return jsonify({
             "message": f"Você entrou no {tenant['display_name']}!",
@@ -419,25 +273,32 @@ def leave_tenant(tenant_id: int):
                     "error": "Você é o único administrador. Promova outro usuário antes de sair."
                 }), 400
 
-        # Soft delete
-        execute_sql(
-            """
-            UPDATE user_tenants
-            SET is_active = FALSE, left_at = NOW()
-            WHERE id = :id
-            """,
-            {"id": membership["id"]},
-        )
+        with transaction():
+            was_active = lock_membership(tenant_id, g.current_user_id)
+            # Soft delete
+            execute_sql(
+                """
+                UPDATE user_tenants
+                SET is_active = FALSE, left_at = NOW()
+                WHERE id = :id
+                """,
+                {"id": membership["id"]},
+                invalidates=["user_tenants"],
+            )
+            apply_membership_change(tenant_id, was_active, False)
 
-        # Se estava com contexto neste tenant, limpar
-        execute_sql(
-            """
-            UPDATE user_sessions
-            SET current_tenant_id = NULL
-            WHERE user_id = :user_id AND current_tenant_id = :tenant_id
-            """,
-            {"user_id": g.current_user_id, "tenant_id": tenant_id},
-        )
+            # Se estava com contexto neste tenant, limpar
+            execute_sql(
+                """
+                UPDATE user_sessions
+                SET current_tenant_id = NULL
+                WHERE user_id = :user_id AND current_tenant_id = :tenant_id
+                """,
+                {"user_id": g.current_user_id, "tenant_id": tenant_id},
+            )
+            invalidate_membership(g.current_user_id)
+            invalidate_admin_push_tokens(tenant_id)
+        invalidate_user_sessions(g.current_user_id)
 
         return jsonify({
             "message": f"Você saiu do {membership['display_name']}",
@@ -452,55 +313,39 @@ def leave_tenant(tenant_id: int):
 # ------------------------------------------------------------
 # Rotas Públicas (/api/tenants/*)
 # ------------------------------------------------------------
-@membership_bp.get("/api/tenants/available")
-def list_available_tenants():
-    """Lista sistemas disponíveis para inscrição (público)."""
-    try:
-        system_slug = request.args.get("system")
-
-        params = {}
-        where_clause = "WHERE t.is_active = TRUE AND t.maintenance_mode = FALSE"
-
-        if system_slug:
-            where_clause += " AND s.slug = :system_slug"
-            params["system_slug"] = system_slug
+@catalog_view("available")
+def _available_view(data, system_slug):
+    tenants = [
+        t for t in data.tenants
+        if not t["maintenance_mode"] and (not system_slug or t["system_slug"] == system_slug)
+    ]
+
+    # Agrupar por sistema
+    by_system = {}
+    for t in tenants:
+        slug = t["system_slug"]
+        if slug not in by_system:
+            by_system[slug] = {
+                "slug": slug,
+                "displayName": t["system_name"],
+                "icon": t["system_icon"],
+                "color": t["system_color"],
+                "tenants": [],
+            }
 
-        tenants = fetch_all(
-            f"""
-            SELECT
-                t.id, t.slug, t.display_name, t.logo_url, t.primary_color,
-                t.welcome_message, t.allow_registration,
-                s.slug AS system_slug, s.display_name AS system_name,
-                s.icon AS system_icon, s.color AS system_color,
-                (SELECT COUNT(*) FROM user_tenants ut
-                 WHERE ut.tenant_id = t.id AND ut.is_active = TRUE) AS member_count
-            FROM tenants t
-            INNER JOIN systems s ON t.system_id = s.id
-            {where_clause}
-            ORDER BY s.display_order, t.display_name
-            """,
-            params,
-        )
+        by_system[slug]["tenants"].append(_tenant_to_dto(t, include_system=False))
 
-        # Agrupar por sistema
-        by_system = {}
-        for t in tenants:
-            system_slug = t["system_slug"]
-            if system_slug not in by_system:
-                by_system[system_slug] = {
-                    "slug": system_slug,
-                    "displayName": t["system_name"],
-                    "icon": t["system_icon"],
-                    "color": t["system_color"],
-                    "tenants": [],
-                }
+    return 200, {
+        "systems": list(by_system.values()),
+        "total": len(tenants),
+    }
 
-            by_system[system_slug]["tenants"].append(_tenant_to_dto(t, include_system=False))
 
-        return jsonify({
-            "systems": list(by_system.values()),
-            "total": len(tenants),
-        })
+@membership_bp.get("/api/tenants/available")
+def list_available_tenants():
+    """Lista sistemas disponíveis para inscrição (público, do snapshot do catálogo)."""
+    try:
+        return catalog_response("available", request.args.get("system") or None)
 
     except Exception as e:
         if ENV == "dev":
@@ -512,20 +357,7 @@ def list_available_tenants():
 def get_tenant_details(slug: str):
     """Detalhes de um tenant específico (público)."""
     try:
-        tenant = fetch_one(
-            """
-            SELECT
-                t.*,
-                s.slug AS system_slug, s.display_name AS system_name,
-                s.icon AS system_icon, s.color AS system_color,
-                (SELECT COUNT(*) FROM user_tenants ut
-                 WHERE ut.tenant_id = t.id AND ut.is_active = TRUE) AS member_count
-            FROM tenants t
-            INNER JOIN systems s ON t.system_id = s.id
-            WHERE t.slug = :slug AND t.is_active = TRUE
-            """,
-            {"slug": slug},
-        )
+        tenant = resolve_tenant(slug)
 
         if not tenant:
             return jsonify({"error": "Sistema não encontrado"}), 404
@@ -539,13 +371,14 @@ def get_tenant_details(slug: str):
         dto["email"] = tenant.get("email")
 
         # Buscar features
-        features = fetch_all(
+        features = cached_fetch_all(
             """
             SELECT feature_name, is_enabled, config
             FROM tenant_features
             WHERE tenant_id = :tenant_id
             """,
             {"tenant_id": tenant["id"]},
+            tags=["tenant_features"],
         )
 
         dto["features"] = {
@@ -564,6 +397,25 @@ def get_tenant_details(slug: str):
         return jsonify({"error": safe_db_error(e)}), 500
 
 
+@membership_bp.get("/api/tenant/status")
+@tenant_required
+def get_current_tenant_status():
+    """
+    Tenant da requisição (X-Tenant-Slug) e se o DB dele responde. O app do
+    tenant usa para saber se pode seguir (403/503 vêm do @tenant_required).
+    """
+    tenant = current_tenant()
+    try:
+        tenant_db().execute(text("SELECT 1"))
+    except Exception as e:
+        print(f"[tenant-status] DB do tenant {tenant['slug']} indisponível: {e}")
+        if ENV == "dev":
+            traceback.print_exc()
+        return jsonify({"tenant": _tenant_to_dto(tenant), "database": False}), 503
+
+    return jsonify({"tenant": _tenant_to_dto(tenant), "database": True})
+
+
 # ------------------------------------------------------------
 # Rotas de Admin (/api/tenants/:id/members/*)
 # ------------------------------------------------------------
@@ -584,7 +436,7 @@ def list_tenant_members(tenant_id: int):
         if not membership or membership["role"] not in ("admin", "manager"):
             return jsonify({"error": "Sem permissão para ver membros"}), 403
 
-        members = fetch_all(
+        members = fetch_iter(
             """
             SELECT
                 u.id, u.name, u.nickname, u.email, u.avatar_url,
@@ -597,21 +449,20 @@ def list_tenant_members(tenant_id: int):
             {"tenant_id": tenant_id},
         )
 
-        return jsonify({
-            "members": [
-                {
-                    "id": m["id"],
-                    "name": m["name"],
-                    "nickname": m.get("nickname"),
-                    "email": m["email"],
-                    "avatarUrl": m.get("avatar_url"),
-                    "role": m["role"],
-                    "joinedAt": m["joined_at"].isoformat() if m.get("joined_at") else None,
-                }
-                for m in members
-            ],
-            "total": len(members),
-        })
+        return stream_json_list(
+            members,
+            lambda m: {
+                "id": m["id"],
+                "name": m["name"],
+                "nickname": m.get("nickname"),
+                "email": m["email"],
+                "avatarUrl": m.get("avatar_url"),
+                "role": m["role"],
+                "joinedAt": m["joined_at"].isoformat() if m.get("joined_at") else None,
+            },
+            key="members",
+            count_key="total",
+        )
 
     except Exception as e:
         if ENV == "dev":
@@ -705,30 +556,36 @@ def approve_request(tenant_id: int, request_id: int):
         if not req:
             return jsonify({"error": "Solicitação não encontrada"}), 404
 
-        # Aprovar
-        execute_sql(
-            """
-            UPDATE user_tenant_requests
-            SET status = 'approved', responded_by = :admin_id, responded_at = NOW()
-            WHERE id = :id
-            """,
-            {"id": request_id, "admin_id": g.current_user_id},
-        )
+        with transaction():
+            was_active = lock_membership(tenant_id, req["user_id"])
+            # Aprovar
+            execute_sql(
+                """
+                UPDATE user_tenant_requests
+                SET status = 'approved', responded_by = :admin_id, responded_at = NOW()
+                WHERE id = :id
+                """,
+                {"id": request_id, "admin_id": g.current_user_id},
+            )
 
-        # Criar membership
-        execute_sql(
-            """
-            INSERT INTO user_tenants (user_id, tenant_id, role, approved_by, approved_at)
-            VALUES (:user_id, :tenant_id, 'player', :admin_id, NOW())
-            ON DUPLICATE KEY UPDATE
-                is_active = TRUE, left_at = NULL, approved_by = :admin_id, approved_at = NOW()
-            """,
-            {
-                "user_id": req["user_id"],
-                "tenant_id": tenant_id,
-                "admin_id": g.current_user_id,
-            },
-        )
+            # Criar membership
+            execute_sql(
+                """
+                INSERT INTO user_tenants (user_id, tenant_id, role, approved_by, approved_at)
+                VALUES (:user_id, :tenant_id, 'player', :admin_id, NOW())
+                ON DUPLICATE KEY UPDATE
+                    is_active = TRUE, left_at = NULL, approved_by = :admin_id, approved_at = NOW()
+                """,
+                {
+                    "user_id": req["user_id"],
+                    "tenant_id": tenant_id,
+                    "admin_id": g.current_user_id,
+                },
+                invalidates=["user_tenants"],
+            )
+            apply_membership_change(tenant_id, was_active, True)
+            invalidate_membership(req["user_id"])
+            invalidate_admin_push_tokens(tenant_id)
 
         return jsonify({
             "message": f"{req['user_name']} foi aprovado!",
@@ -23,7 +23,13 @@ from typing import Any, Dict
 
 from flask import Blueprint, jsonify, request
 
-from app.db import execute_sql, fetch_all, fetch_one, safe_db_error
+from app.db import execute_sql, fetch_all, fetch_iter, fetch_one, fetch_rows, safe_db_error, select_list, transaction
+from app.member_counts import apply_membership_change, lock_membership
+from app.membership import invalidate_membership
+from app.push_dispatcher import invalidate_admin_push_tokens
+from app.queries import TenantUserProfileRow, UserProfileRow
+from app.streaming import stream_json_list
+from app.tenants import resolve_tenant
 
 user_bp = Blueprint("users", __name__, url_prefix="/api/users")
 
@@ -42,6 +48,11 @@ def _service_auth_required(f):
     return decorated
 
 
+# Projeções explícitas das listagens (em vez de SELECT * / u.*)
+_USER_PROFILE_COLUMNS = select_list(UserProfileRow)
+_TENANT_USER_COLUMNS = select_list(TenantUserProfileRow, "u", role="ut.role", joined_at="ut.joined_at")
+
+
 def _user_profile_dto(row: Dict[str, Any]) -> Dict[str, Any]:
     """Converte row do banco para DTO de perfil inter-service."""
     return {
@@ -113,32 +124,30 @@ def get_users_by_tenant(slug: str):
     Usado pelo SGQ e outros sistemas para listar membros/clientes.
     """
     try:
-        tenant = fetch_one(
-            "SELECT id FROM tenants WHERE slug = :slug AND is_active = TRUE",
-            {"slug": slug},
-        )
+        tenant = resolve_tenant(slug)
         if not tenant:
             return jsonify({"error": "Tenant não encontrado"}), 404
 
-        rows = fetch_all(
-            """
-            SELECT u.*, ut.role, ut.joined_at
+        rows = fetch_iter(
+            f"""
+            SELECT {_TENANT_USER_COLUMNS}
             FROM user_tenants ut
             INNER JOIN users u ON ut.user_id = u.id
             WHERE ut.tenant_id = :tid AND ut.is_active = TRUE
             ORDER BY u.name
             """,
             {"tid": tenant["id"]},
+            record=TenantUserProfileRow,
         )
 
-        users = []
-        for r in rows:
+        def _member_dto(r):
             dto = _user_profile_dto(r)
             dto["role"] = r.get("role", "player")
             dto["joinedAt"] = r["joined_at"].isoformat() if r.get("joined_at") else None
-            users.append(dto)
+            return dto
 
-        return jsonify({"users": users, "total": len(users)})
+        # Streaming: tenant sem limite de membros não materializa a lista inteira
+        return stream_json_list(rows, _member_dto, key="users", count_key="total")
 
     except Exception as e:
         if ENV == "dev":
@@ -162,26 +171,26 @@ def get_all_active_users():
         limit = min(2000, max(1, int(request.args.get("limit", 500))))
         offset = max(0, int(request.args.get("offset", 0)))
 
-        rows = fetch_all(
-            """
-            SELECT * FROM users
+        total_row = fetch_one("SELECT COUNT(*) AS cnt FROM users WHERE is_active = TRUE")
+        total = total_row["cnt"] if total_row else 0
+
+        rows = fetch_iter(
+            f"""
+            SELECT {_USER_PROFILE_COLUMNS} FROM users
             WHERE is_active = TRUE
             ORDER BY name
             LIMIT :lim OFFSET :off
             """,
             {"lim": limit, "off": offset},
+            record=UserProfileRow,
         )
 
-        total_row = fetch_one("SELECT COUNT(*) AS cnt FROM users WHERE is_active = TRUE")
-        total = total_row["cnt"] if total_row else len(rows)
-
-        users = []
-        for r in rows:
+        def _client_dto(r):
             dto = _user_profile_dto(r)
             dto["role"] = "client"
-            users.append(dto)
+            return dto
 
-        return jsonify({"users": users, "total": total})
+        return stream_json_list(rows, _client_dto, key="users", extra={"total": total})
 
     except Exception as e:
         if ENV == "dev":
@@ -205,9 +214,9 @@ def search_users():
 
         limit = min(100, max(1, int(request.args.get("limit", 20))))
 
-        rows = fetch_all(
-            """
-            SELECT * FROM users
+        rows = fetch_rows(
+            f"""
+            SELECT {_USER_PROFILE_COLUMNS} FROM users
             WHERE is_active = TRUE
               AND (LOWER(name) LIKE :q
                    OR LOWER(email) LIKE :q
@@ -218,6 +227,7 @@ def search_users():
             LIMIT :lim
             """,
             {"q": f"%{q}%", "lim": limit},
+            record=UserProfileRow,
         )
 
         return jsonify({
@@ -239,10 +249,7 @@ def link_user_to_tenant(slug: str, user_id: int):
     Body (opcional): { "role": "client" }
     """
     try:
-        tenant = fetch_one(
-            "SELECT id, display_name FROM tenants WHERE slug = :slug AND is_active = TRUE",
-            {"slug": slug},
-        )
+        tenant = resolve_tenant(slug)
         if not tenant:
             return jsonify({"error": "Tenant não encontrado"}), 404
 
@@ -256,14 +263,20 @@ def link_user_to_tenant(slug: str, user_id: int):
         if role not in valid_roles:
             role = "client"
 
-        execute_sql(
-            """
-            INSERT INTO user_tenants (user_id, tenant_id, role)
-            VALUES (:user_id, :tenant_id, :role)
-            ON DUPLICATE KEY UPDATE is_active = TRUE, left_at = NULL, role = :role
-            """,
-            {"user_id": user_id, "tenant_id": tenant["id"], "role": role},
-        )
+        with transaction():
+            was_active = lock_membership(tenant["id"], user_id)
+            execute_sql(
+                """
+                INSERT INTO user_tenants (user_id, tenant_id, role)
+                VALUES (:user_id, :tenant_id, :role)
+                ON DUPLICATE KEY UPDATE is_active = TRUE, left_at = NULL, role = :role
+                """,
+                {"user_id": user_id, "tenant_id": tenant["id"], "role": role},
+                invalidates=["user_tenants"],
+            )
+            apply_membership_change(tenant["id"], was_active, True)
+            invalidate_membership(user_id)
+            invalidate_admin_push_tokens(tenant["id"])
 
         return jsonify({
             "message": f"Usuário linkado ao {tenant['display_name']}",
@@ -283,21 +296,24 @@ def link_user_to_tenant(slug: str, user_id: int):
 def unlink_user_from_tenant(slug: str, user_id: int):
     """Remove user de um tenant (inter-service)."""
     try:
-        tenant = fetch_one(
-            "SELECT id FROM tenants WHERE slug = :slug",
-            {"slug": slug},
-        )
+        tenant = resolve_tenant(slug, include_inactive=True)
         if not tenant:
             return jsonify({"error": "Tenant não encontrado"}), 404
 
-        execute_sql(
-            """
-            UPDATE user_tenants
-            SET is_active = FALSE, left_at = NOW()
-            WHERE user_id = :user_id AND tenant_id = :tenant_id
-            """,
-            {"user_id": user_id, "tenant_id": tenant["id"]},
-        )
+        with transaction():
+            was_active = lock_membership(tenant["id"], user_id)
+            execute_sql(
+                """
+                UPDATE user_tenants
+                SET is_active = FALSE, left_at = NOW()
+                WHERE user_id = :user_id AND tenant_id = :tenant_id
+                """,
+                {"user_id": user_id, "tenant_id": tenant["id"]},
+                invalidates=["user_tenants"],
+            )
+            apply_membership_change(tenant["id"], was_active, False)
+            invalidate_membership(user_id)
+            invalidate_admin_push_tokens(tenant["id"])
 
         return jsonify({"message": "Usuário removido do tenant"})
 
@@ -314,10 +330,7 @@ def unlink_user_from_tenant(slug: str, user_id: int):
 def list_tenant_requests(slug: str):
     """Lista pedidos pendentes de acesso a um tenant (inter-service)."""
     try:
-        tenant = fetch_one(
-            "SELECT id FROM tenants WHERE slug = :slug AND is_active = TRUE",
-            {"slug": slug},
-        )
+        tenant = resolve_tenant(slug)
         if not tenant:
             return jsonify({"error": "Tenant não encontrado"}), 404
 
@@ -365,10 +378,7 @@ def list_tenant_requests(slug: str):
 def approve_tenant_request(slug: str, request_id: int):
     """Aprova um pedido de acesso (inter-service)."""
     try:
-        tenant = fetch_one(
-            "SELECT id FROM tenants WHERE slug = :slug AND is_active = TRUE",
-            {"slug": slug},
-        )
+        tenant = resolve_tenant(slug)
         if not tenant:
             return jsonify({"error": "Tenant não encontrado"}), 404
 
@@ -386,24 +396,30 @@ def approve_tenant_request(slug: str, request_id: int):
         if req_row["status"] != "pending":
             return jsonify({"error": "Solicitação já foi processada"}), 409
 
-        execute_sql(
-            """
-            UPDATE user_tenant_requests
-            SET status = 'approved', responded_at = NOW()
-            WHERE id = :id
-            """,
-            {"id": request_id},
-        )
-
-        execute_sql(
-            """
-            INSERT INTO user_tenants (user_id, tenant_id, role, approved_at)
-            VALUES (:user_id, :tenant_id, 'player', NOW())
-            ON DUPLICATE KEY UPDATE
-                is_active = TRUE, left_at = NULL, approved_at = NOW()
-            """,
-            {"user_id": req_row["user_id"], "tenant_id": tenant["id"]},
-        )
+        with transaction():
+            was_active = lock_membership(tenant["id"], req_row["user_id"])
+            execute_sql(
+                """
+                UPDATE user_tenant_requests
+                SET status = 'approved', responded_at = NOW()
+                WHERE id = :id
+                """,
+                {"id": request_id},
+            )
+
+            execute_sql(
+                """
+                INSERT INTO user_tenants (user_id, tenant_id, role, approved_at)
+                VALUES (:user_id, :tenant_id, 'player', NOW())
+                ON DUPLICATE KEY UPDATE
+                    is_active = TRUE, left_at = NULL, approved_at = NOW()
+                """,
+                {"user_id": req_row["user_id"], "tenant_id": tenant["id"]},
+                invalidates=["user_tenants"],
+            )
+            apply_membership_change(tenant["id"], was_active, True)
+            invalidate_membership(req_row["user_id"])
+            invalidate_admin_push_tokens(tenant["id"])
 
         return jsonify({
             "message": f"{req_row['name']} foi aprovado!",
@@ -421,10 +437,7 @@ def approve_tenant_request(slug: str, request_id: int):
 def reject_tenant_request(slug: str, request_id: int):
     """Rejeita um pedido de acesso (inter-service)."""
     try:
-        tenant = fetch_one(
-            "SELECT id FROM tenants WHERE slug = :slug AND is_active = TRUE",
-            {"slug": slug},
-        )
+        tenant = resolve_tenant(slug)
         if not tenant:
             return jsonify({"error": "Tenant não encontrado"}), 404
 
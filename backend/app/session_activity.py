@@ -0,0 +1,183 @@
+"""
+Write-behind de user_sessions.last_activity_at.
+
+login_required só registra a atividade em memória (touch); uma thread
+por worker grava o último horário de cada sessão a cada
+SESSION_ACTIVITY_FLUSH_SECONDS, em UPDATEs em lote. O buffer é limitado
+(SESSION_ACTIVITY_MAX_PENDING sessões) e é descarregado no shutdown do
+worker (atexit).
+
+last_activity_at é informativo: um flush perdido (crash do worker) só
+atrasa o horário, não afeta autenticação.
+"""
+from __future__ import annotations
+
+import atexit
+import datetime
+import logging
+import os
+import threading
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+from app.db import execute_sql
+
+logger = logging.getLogger(__name__)
+
+SESSION_ACTIVITY_FLUSH_SECONDS = float(os.getenv("SESSION_ACTIVITY_FLUSH_SECONDS", "10"))
+SESSION_ACTIVITY_MAX_PENDING = int(os.getenv("SESSION_ACTIVITY_MAX_PENDING", "50000"))
+SESSION_ACTIVITY_BATCH_SIZE = int(os.getenv("SESSION_ACTIVITY_BATCH_SIZE", "500"))
+
+
+def _write_batch(items: List[Tuple[int, datetime.datetime]]) -> None:
+    """Um UPDATE para o lote: CASE por id, sem regredir o horário já gravado."""
+    params: Dict[str, Any] = {}
+    whens: List[str] = []
+    ids: List[str] = []
+    for i, (session_id, seen_at) in enumerate(items):
+        params[f"id{i}"] = session_id
+        params[f"ts{i}"] = seen_at
+        whens.append(f"WHEN :id{i} THEN :ts{i}")
+        ids.append(f":id{i}")
+    case = f"CASE id {' '.join(whens)} END"
+    execute_sql(
+        f"""
+        UPDATE user_sessions
+        SET last_activity_at = {case}
+        WHERE id IN ({', '.join(ids)})
+          AND (last_activity_at IS NULL OR last_activity_at < {case})
+        """,
+        params,
+    )
+
+
+class SessionActivityBuffer:
+    """
+    Último horário de atividade por sessão, gravado em lote.
+
+    - touch(): O(1) em memória; com o buffer cheio a atividade é descartada
+      (dropped) e um flush é antecipado.
+    - flush(): grava tudo em lotes de batch_size; se falhar, as entradas
+      voltam para o buffer (respeitando o limite).
+    """
+
+    def __init__(self, flush_seconds: float, max_pending: int, batch_size: int) -> None:
+        self.flush_seconds = flush_seconds
+        self.max_pending = max(1, max_pending)
+        self.batch_size = max(1, batch_size)
+        self._pending: Dict[int, datetime.datetime] = {}
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._pid = 0
+        self.touches = 0
+        self.dropped = 0
+        self.flushes = 0
+        self.rows_written = 0
+        self.errors = 0
+        self.last_flush_ms = 0.0
+
+    def _ensure_thread(self) -> None:
+        # Uma thread por processo (recria após fork do gunicorn)
+        if self._thread is not None and self._pid == os.getpid() and self._thread.is_alive():
+            return
+        with self._lock:
+            if self._thread is not None and self._pid == os.getpid() and self._thread.is_alive():
+                return
+            self._pid = os.getpid()
+            self._thread = threading.Thread(target=self._run, name="session-activity-flush", daemon=True)
+            self._thread.start()
+
+    def _run(self) -> None:
+        while True:
+            self._wakeup.wait(self.flush_seconds)
+            self._wakeup.clear()
+            try:
+                self.flush()
+            except Exception:
+                logger.exception("Falha no flush de last_activity_at")
+
+    def touch(self, session_id: int) -> None:
+        if self.flush_seconds <= 0:
+            # Write-behind desligado: grava na hora
+            _write_batch([(int(session_id), datetime.datetime.utcnow())])
+            return
+
+        now = datetime.datetime.utcnow()
+        with self._lock:
+            self.touches += 1
+            if session_id in self._pending or len(self._pending) < self.max_pending:
+                self._pending[session_id] = now
+                full = len(self._pending) >= self.max_pending
+            else:
+                self.dropped += 1
+                full = True
+        if full:
+            self._wakeup.set()
+        self._ensure_thread()
+
+    def flush(self) -> int:
+        """Grava o buffer atual. Retorna o número de sessões gravadas."""
+        with self._flush_lock:
+            with self._lock:
+                pending, self._pending = self._pending, {}
+            if not pending:
+                return 0
+
+            started = time.perf_counter()
+            items = list(pending.items())
+            written = 0
+            try:
+                for start in range(0, len(items), self.batch_size):
+                    _write_batch(items[start:start + self.batch_size])
+                    written += len(items[start:start + self.batch_size])
+            except Exception:
+                self.errors += 1
+                self._requeue(items[written:])
+                raise
+            finally:
+                self.flushes += 1
+                self.rows_written += written
+                self.last_flush_ms = (time.perf_counter() - started) * 1000
+            return written
+
+    def _requeue(self, items: List[Tuple[int, datetime.datetime]]) -> None:
+        with self._lock:
+            for session_id, seen_at in items:
+                current = self._pending.get(session_id)
+                if current is not None:
+                    if seen_at > current:
+                        self._pending[session_id] = seen_at
+                elif len(self._pending) < self.max_pending:
+                    self._pending[session_id] = seen_at
+                else:
+                    self.dropped += 1
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            pending = len(self._pending)
+        return {
+            "pending": pending,
+            "maxPending": self.max_pending,
+            "flushSeconds": self.flush_seconds,
+            "touches": self.touches,
+            "dropped": self.dropped,
+            "flushes": self.flushes,
+            "rowsWritten": self.rows_written,
+            "errors": self.errors,
+            "lastFlushMs": round(self.last_flush_ms, 2),
+        }
+
+
+session_activity = SessionActivityBuffer(
+    SESSION_ACTIVITY_FLUSH_SECONDS, SESSION_ACTIVITY_MAX_PENDING, SESSION_ACTIVITY_BATCH_SIZE,
+)
+
+
+@atexit.register
+def _flush_on_exit() -> None:
+    try:
+        session_activity.flush()
+    except Exception:
+        logger.exception("Falha no flush final de last_activity_at")
@@ -0,0 +1,115 @@
+"""
+Respostas JSON em streaming para listas grandes.
+
+Os itens vêm de um iterador (ex: app.db.fetch_iter) e são serializados em
+blocos, sem montar a lista inteira em memória. Formatos:
+- JSON (padrão): mesmo shape da resposta com jsonify, enviado em chunks.
+- NDJSON (?format=ndjson ou Accept: application/x-ndjson): um item por linha.
+
+O primeiro bloco é lido antes de devolver a Response: erro logo no início
+(query inválida, banco fora) vira exceção na rota, que responde 500 normal.
+Lista menor que um bloco termina ali e a conexão do fetch_iter volta ao pool
+antes do envio. Nas maiores a conexão fica presa até o fim do download, por
+isso só as listagens grandes (usuários/membros de tenant) usam streaming;
+listas curtas usam jsonify.
+
+Server-Timing (app.db) fecha no after_request: inclui a query e o primeiro
+bloco, não as leituras feitas durante o envio do resto.
+"""
+from __future__ import annotations
+
+import logging
+import os
+import traceback
+from typing import Any, Callable, Dict, Iterable, Optional
+
+from flask import Response, current_app, request, stream_with_context
+
+logger = logging.getLogger(__name__)
+
+ENV = os.getenv("ENV", "dev")
+
+# Itens serializados por chunk enviado ao cliente
+STREAM_FLUSH_ITEMS = 200
+
+
+def wants_ndjson() -> bool:
+    if (request.args.get("format") or "").lower() == "ndjson":
+        return True
+    return "application/x-ndjson" in request.headers.get("Accept", "")
+
+
+def stream_json_list(
+    rows: Iterable[Dict[str, Any]],
+    to_dto: Callable[[Dict[str, Any]], Dict[str, Any]],
+    key: Optional[str] = None,
+    extra: Optional[Dict[str, Any]] = None,
+    count_key: Optional[str] = None,
+) -> Response:
+    """
+    key=None       -> lista pura: [ ... ]
+    key="users"    -> objeto: {**extra, "users": [ ... ], count_key: <n>}
+    count_key      -> total de itens enviados, escrito no fim do objeto.
+
+    Chamar dentro do try da rota: falha no primeiro bloco sobe daqui.
+    """
+    dumps = current_app.json.dumps
+
+    def _items():
+        buf = []
+        count = 0
+        started = False
+        try:
+            for row in rows:
+                buf.append(dumps(to_dto(row)))
+                count += 1
+                if len(buf) >= STREAM_FLUSH_ITEMS:
+                    yield buf, count
+                    started = True
+                    buf = []
+        except Exception:
+            if not started:
+                # Ainda no primeiro bloco: nada foi enviado, a rota responde 500
+                raise
+            # status já foi enviado: resposta sai truncada (JSON inválido) e fica no log
+            logger.exception("Falha durante streaming de %s", request.path)
+            if ENV == "dev":
+                traceback.print_exc()
+            raise
+        yield buf, count
+
+    items = _items()
+    first_chunk = next(items)
+
+    def _chunks():
+        yield first_chunk
+        yield from items
+
+    if wants_ndjson():
+        def gen_ndjson():
+            for buf, _ in _chunks():
+                if buf:
+                    yield "\n".join(buf) + "\n"
+
+        return Response(stream_with_context(gen_ndjson()), mimetype="application/x-ndjson")
+
+    def gen_json():
+        if key is None:
+            yield "["
+        else:
+            head = "".join(f"{dumps(k)}:{dumps(v)}," for k, v in (extra or {}).items())
+            yield "{" + head + dumps(key) + ":["
+        first = True
+        count = 0
+        for buf, count in _chunks():
+            if not buf:
+                continue
+            yield ("" if first else ",") + ",".join(buf)
+            first = False
+        if key is None:
+            yield "]"
+        else:
+            tail = f",{dumps(count_key)}:{count}" if count_key else ""
+            yield "]" + tail + "}"
+
+    return Response(stream_with_context(gen_json()), mimetype="application/json")
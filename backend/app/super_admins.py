@@ -0,0 +1,84 @@
+"""
+Índice em memória dos emails de super admin (tabela super_admins).
+
+A tabela tem poucas linhas e quase nunca muda: o índice carrega no boot e
+recarrega a cada SUPER_ADMIN_REFRESH_SECONDS (ou após invalidate()).
+A recarga é feita por uma thread só; as demais seguem com o conjunto atual.
+Se a recarga falhar, o conjunto anterior continua valendo.
+"""
+from __future__ import annotations
+
+import logging
+import os
+import threading
+import time
+from typing import Any, Dict, FrozenSet, Optional
+
+from app.db import query_all
+
+logger = logging.getLogger(__name__)
+
+SUPER_ADMIN_REFRESH_SECONDS = float(os.getenv("SUPER_ADMIN_REFRESH_SECONDS", "60"))
+
+
+class SuperAdminIndex:
+    def __init__(self, refresh_seconds: float) -> None:
+        self.refresh_seconds = refresh_seconds
+        self._emails: Optional[FrozenSet[str]] = None
+        self._loaded_at = 0.0
+        self._refresh_lock = threading.Lock()
+        self.refreshes = 0
+        self.errors = 0
+
+    def refresh(self) -> None:
+        rows = query_all("auth.active_super_admins", primary=True)
+        self._emails = frozenset((r["email"] or "").strip().lower() for r in rows)
+        self._loaded_at = time.monotonic()
+        self.refreshes += 1
+
+    def _maybe_refresh(self) -> None:
+        stale = time.monotonic() - self._loaded_at >= self.refresh_seconds
+        if self._emails is not None and not stale:
+            return
+        # Primeira carga espera; recargas não bloqueiam quem chega depois
+        blocking = self._emails is None
+        if not self._refresh_lock.acquire(blocking=blocking):
+            return
+        try:
+            if self._emails is None or time.monotonic() - self._loaded_at >= self.refresh_seconds:
+                self.refresh()
+        except Exception:
+            self.errors += 1
+            if self._emails is None:
+                raise
+            logger.exception("Falha ao recarregar super_admins; mantendo conjunto anterior")
+            self._loaded_at = time.monotonic()
+        finally:
+            self._refresh_lock.release()
+
+    def contains(self, email: Optional[str]) -> bool:
+        if not email:
+            return False
+        self._maybe_refresh()
+        return email.strip().lower() in self._emails
+
+    def invalidate(self) -> None:
+        """Força recarga na próxima consulta (chamar após alterar super_admins)."""
+        self._loaded_at = 0.0
+
+    def stats(self) -> Dict[str, Any]:
+        emails = self._emails
+        return {
+            "size": len(emails) if emails is not None else None,
+            "ageSeconds": round(time.monotonic() - self._loaded_at, 1) if emails is not None else None,
+            "refreshSeconds": self.refresh_seconds,
+            "refreshes": self.refreshes,
+            "errors": self.errors,
+        }
+
+
+super_admin_index = SuperAdminIndex(SUPER_ADMIN_REFRESH_SECONDS)
+
+
+def is_super_admin(email: Optional[str]) -> bool:
+    return super_admin_index.contains(email)
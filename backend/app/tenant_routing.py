@@ -0,0 +1,186 @@
+"""
+Roteamento por tenant: header X-Tenant-Slug (ou subdomínio, se configurado).
+
+Só as rotas com @tenant_required passam pelo roteamento: o decorator descobre
+o slug (header X-Tenant-Slug; senão o subdomínio de TENANT_BASE_DOMAIN, ex.:
+copa-aposentados.seudominio.com), resolve o tenant pelo cache de app.tenants
+e barra tenant inexistente (404), inativo (403) ou em manutenção (503). As
+rotas do hub (login, /me, super-admin...) ignoram o header e seguem como
+antes, mesmo que o cliente mande X-Tenant-Slug em toda requisição.
+
+Produção: o nginx só atende varzeaprime.com.br, então vale apenas o header.
+Subdomínio exige server_name/certificado wildcard e TENANT_BASE_DOMAIN.
+
+Com o tenant em g.tenant, tenant_db() abre na primeira chamada uma conexão
+do pool do tenant (app.db.tenant_connection: engine do registry, sem criar
+engine por requisição) e o teardown devolve ao pool com rollback do que não
+foi commitado. A conexão é "commit as you go", igual nos dois modos de
+TENANT_DB_CONNECTION_MODE:
+
+    conn = tenant_db()
+    conn.execute(text("UPDATE ..."), {...})
+    conn.commit()
+"""
+from __future__ import annotations
+
+import os
+import threading
+from functools import wraps
+from typing import Any, Dict, Optional, Tuple
+
+from flask import Flask, g, jsonify, request
+from sqlalchemy.engine import Connection
+
+from app.db import tenant_connection, validate_slug
+from app.tenants import resolve_tenant
+
+TENANT_SLUG_HEADER = "X-Tenant-Slug"
+# Domínio base para tenant por subdomínio (vazio = desligado)
+TENANT_BASE_DOMAIN = os.getenv("TENANT_BASE_DOMAIN", "").strip().lower().lstrip(".")
+TENANT_SUBDOMAIN_IGNORE = {
+    s.strip().lower()
+    for s in os.getenv("TENANT_SUBDOMAIN_IGNORE", "www,api").split(",")
+    if s.strip()
+}
+
+
+class TenantRoutingStats:
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self.routed = 0
+        self.not_found = 0
+        self.inactive = 0
+        self.maintenance = 0
+        self.connections = 0
+
+    def incr(self, field: str) -> None:
+        with self._lock:
+            setattr(self, field, getattr(self, field) + 1)
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "baseDomain": TENANT_BASE_DOMAIN or None,
+                "routed": self.routed,
+                "notFound": self.not_found,
+                "inactive": self.inactive,
+                "maintenance": self.maintenance,
+                "connections": self.connections,
+            }
+
+
+routing_stats = TenantRoutingStats()
+
+
+def _subdomain_slug(host: str) -> Optional[str]:
+    if not TENANT_BASE_DOMAIN:
+        return None
+    host = host.split(":", 1)[0].lower()
+    suffix = "." + TENANT_BASE_DOMAIN
+    if not host.endswith(suffix):
+        return None
+    sub = host[: -len(suffix)]
+    # Só um nível: a.b.seudominio.com não é tenant
+    if not sub or "." in sub or sub in TENANT_SUBDOMAIN_IGNORE:
+        return None
+    return sub
+
+
+def _requested_slug() -> Tuple[Optional[str], bool]:
+    """(slug, veio_do_header). slug None = requisição sem tenant."""
+    header = (request.headers.get(TENANT_SLUG_HEADER) or "").strip()
+    if header:
+        return header, True
+    return _subdomain_slug(request.host or ""), False
+
+
+def _route_tenant():
+    """Resolve o tenant da requisição em g.tenant; resposta de erro se barrado."""
+    raw_slug, from_header = _requested_slug()
+    if raw_slug is None:
+        return jsonify({"error": f"Tenant não informado ({TENANT_SLUG_HEADER} ou subdomínio)"}), 400
+
+    try:
+        slug = validate_slug(raw_slug)
+    except ValueError:
+        if from_header:
+            return jsonify({"error": f"{TENANT_SLUG_HEADER} inválido"}), 400
+        routing_stats.incr("not_found")
+        return jsonify({"error": "Tenant não encontrado"}), 404
+
+    tenant = resolve_tenant(slug, include_inactive=True)
+    if tenant is None:
+        routing_stats.incr("not_found")
+        return jsonify({"error": "Tenant não encontrado"}), 404
+    if not tenant.is_active:
+        routing_stats.incr("inactive")
+        return jsonify({"error": "Tenant inativo"}), 403
+    if tenant.maintenance_mode:
+        routing_stats.incr("maintenance")
+        return jsonify({"error": "Tenant em manutenção"}), 503
+
+    routing_stats.incr("routed")
+    g.tenant = tenant
+    return None
+
+
+def _release_tenant_connection(exc: Optional[BaseException]) -> None:
+    cm = g.pop("_tenant_conn_cm", None)
+    g.pop("_tenant_conn", None)
+    if cm is None:
+        return
+    # Sai do context manager: conexão volta ao pool (rollback do que não foi commitado)
+    if exc is None:
+        cm.__exit__(None, None, None)
+    else:
+        cm.__exit__(type(exc), exc, exc.__traceback__)
+
+
+def current_tenant():
+    """TenantRecord da requisição (None fora de rota @tenant_required)."""
+    return g.get("tenant")
+
+
+def tenant_db() -> Connection:
+    """
+    Conexão do DB do tenant da requisição, aberta na primeira chamada e
+    reaproveitada até o teardown. RuntimeError se a requisição não tem tenant.
+    """
+    conn = g.get("_tenant_conn")
+    if conn is not None:
+        return conn
+
+    tenant = current_tenant()
+    if tenant is None:
+        raise RuntimeError("Requisição sem tenant (rota sem @tenant_required)")
+
+    cm = tenant_connection(tenant.database_host, tenant.database_name)
+    conn = cm.__enter__()
+    g._tenant_conn_cm = cm
+    g._tenant_conn = conn
+    routing_stats.incr("connections")
+    return conn
+
+
+def tenant_required(f):
+    """
+    Rota do tenant: resolve X-Tenant-Slug/subdomínio e barra tenant ausente
+    (400), inexistente (404), inativo (403) ou em manutenção (503).
+    """
+    @wraps(f)
+    def decorated(*args, **kwargs):
+        error = _route_tenant()
+        if error is not None:
+            return error
+        return f(*args, **kwargs)
+
+    return decorated
+
+
+def init_tenant_routing(app: Flask) -> None:
+    """Registra no app Flask o teardown que devolve a conexão do tenant ao pool."""
+    app.teardown_request(_release_tenant_connection)
+
+
+def tenant_routing_stats() -> Dict[str, Any]:
+    return routing_stats.snapshot()
@@ -0,0 +1,122 @@
+"""
+Resolução de tenant por slug ou id (resolve_tenant), com cache por worker.
+
+As rotas que só precisam "achar o tenant" (select, switch-tenant, join,
+detalhes, rotas inter-service /api/users/tenants/<slug>/..., super-admin)
+leem daqui em vez de cada uma repetir o SELECT. O valor guardado é um
+TenantRecord (app.queries): id, system, banco (name/host), flags e branding.
+
+Cache (TTLCache "tenants.resolver"):
+- chaves ("slug", slug) e ("id", id) para o mesmo record, ambas com as tags
+  ("id", id) e ("slug", slug);
+- slug/id inexistente também é guardado (negativo), com TTL menor
+  (TENANT_NEGATIVE_TTL), para slugs inválidos não irem ao banco toda vez;
+- invalidate_tenant(tenant_id, slug) após create/update/delete de tenant e
+  mudanças de member_count; invalidate_all_tenants() quando um system muda.
+
+Nos outros workers a mudança aparece em até TENANT_RESOLVER_TTL segundos.
+"""
+from __future__ import annotations
+
+import os
+import threading
+from typing import Any, Hashable, List, Optional, Tuple
+
+from app.cache import TTLCache
+from app.db import after_commit, fetch_rows, get_query
+from app.queries import TenantRecord
+
+TENANT_RESOLVER_TTL = float(os.getenv("TENANT_RESOLVER_TTL", "60"))
+TENANT_NEGATIVE_TTL = float(os.getenv("TENANT_NEGATIVE_TTL", "10"))
+TENANT_RESOLVER_MAX = int(os.getenv("TENANT_RESOLVER_MAX", "5000"))
+
+_resolved = TTLCache("tenants.resolver", TENANT_RESOLVER_MAX, TENANT_RESOLVER_TTL)
+
+_NOT_FOUND = object()
+
+# Um load iniciado antes de uma invalidação não é guardado
+_generation = 0
+_generation_lock = threading.Lock()
+
+
+def _load(query: str, params: dict) -> Optional[TenantRecord]:
+    # Primário: o load costuma vir logo após a invalidação de uma escrita
+    rows = fetch_rows(get_query(query), params, primary=True, record=TenantRecord)
+    return rows[0] if rows else None
+
+
+def _lookup(key: Tuple[str, Any], query: str, params: dict) -> Optional[TenantRecord]:
+    cached = _resolved.get(key, None)
+    if cached is _NOT_FOUND:
+        return None
+    if cached is not None:
+        return cached
+
+    generation = _generation
+    tenant = _load(query, params)
+    with _generation_lock:
+        if generation != _generation:
+            return tenant
+        if tenant is None:
+            _resolved.set(key, _NOT_FOUND, ttl=TENANT_NEGATIVE_TTL, tags=[key])
+        else:
+            tags: List[Hashable] = [("id", tenant.id), ("slug", tenant.slug)]
+            _resolved.set(("id", tenant.id), tenant, tags=tags)
+            _resolved.set(("slug", tenant.slug), tenant, tags=tags)
+    return tenant
+
+
+def resolve_tenant(
+    slug: Optional[str] = None,
+    *,
+    tenant_id: Any = None,
+    include_inactive: bool = False,
+) -> Optional[TenantRecord]:
+    """
+    Tenant pelo slug ou pelo id (tenant_id tem prioridade; aceita o valor
+    cru do JSON). None se não existir ou, sem include_inactive, se estiver
+    inativo. O record é compartilhado pelo cache: não alterar.
+    """
+    if tenant_id is not None:
+        try:
+            tid = int(tenant_id)
+        except (TypeError, ValueError):
+            return None
+        tenant = _lookup(("id", tid), "tenants.by_id", {"id": tid})
+    elif slug:
+        tenant = _lookup(("slug", slug), "tenants.by_slug", {"slug": slug})
+    else:
+        return None
+
+    if tenant is None or (not include_inactive and not tenant.is_active):
+        return None
+    return tenant
+
+
+def _bump_generation() -> None:
+    global _generation
+    with _generation_lock:
+        _generation += 1
+
+
+def _invalidate(tenant_id: Optional[int], slug: Optional[str]) -> None:
+    _bump_generation()
+    if tenant_id is not None:
+        _resolved.invalidate_tag(("id", int(tenant_id)))
+    if slug:
+        _resolved.invalidate_tag(("slug", slug))
+
+
+def _invalidate_all() -> None:
+    _bump_generation()
+    _resolved.clear()
+
+
+def invalidate_tenant(tenant_id: Optional[int] = None, slug: Optional[str] = None) -> None:
+    """Descarta o tenant (e o negativo do slug/id) deste worker, após o COMMIT."""
+    after_commit(lambda: _invalidate(tenant_id, slug))
+
+
+def invalidate_all_tenants() -> None:
+    """Descarta todos os tenants resolvidos (ex.: system alterado), após o COMMIT."""
+    after_commit(_invalidate_all)
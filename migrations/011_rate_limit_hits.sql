@@ -0,0 +1,10 @@
+-- Migration 011: Shared rate-limit counters (RATE_LIMIT_BACKEND=db)
+-- One row per (hashed key, fixed window); old windows are pruned by the app.
+
+CREATE TABLE IF NOT EXISTS rate_limit_hits (
+    bucket CHAR(64) NOT NULL,
+    window_start BIGINT NOT NULL,
+    hits INT NOT NULL DEFAULT 0,
+    PRIMARY KEY (bucket, window_start),
+    INDEX idx_rate_limit_window (window_start)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4;
@@ -0,0 +1,11 @@
+-- Migration 012: Denormalized per-user membership snapshot (MEMBERSHIP_SNAPSHOT_STORE=db)
+-- payload = JSON of the user's active tenants; NULL = rebuild on next read.
+-- version is bumped on every invalidation so a stale build is never written back.
+
+CREATE TABLE IF NOT EXISTS user_membership_snapshots (
+    user_id INT PRIMARY KEY,
+    version INT NOT NULL DEFAULT 0,
+    payload MEDIUMTEXT NULL,
+    built_at TIMESTAMP NULL,
+    CONSTRAINT fk_membership_snapshot_user FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE CASCADE
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4;
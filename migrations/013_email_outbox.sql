@@ -0,0 +1,22 @@
+-- Migration 013: Durable email outbox drained by the background sender (app/email_outbox.py)
+-- status: pending -> sent | failed. claim_token/locked_until lease a batch to one sender;
+-- an expired lease puts the row back in the queue. Timestamps are UTC set by the app.
+
+CREATE TABLE IF NOT EXISTS email_outbox (
+    id BIGINT AUTO_INCREMENT PRIMARY KEY,
+    to_address VARCHAR(255) NOT NULL,
+    subject VARCHAR(255) NOT NULL,
+    html_body MEDIUMTEXT NOT NULL,
+    text_body MEDIUMTEXT NULL,
+    status ENUM('pending', 'sent', 'failed') NOT NULL DEFAULT 'pending',
+    attempts INT NOT NULL DEFAULT 0,
+    next_attempt_at DATETIME NOT NULL,
+    claim_token CHAR(32) NULL,
+    locked_until DATETIME NULL,
+    last_error VARCHAR(500) NULL,
+    created_at DATETIME NOT NULL,
+    sent_at DATETIME NULL,
+    INDEX idx_email_outbox_due (status, next_attempt_at),
+    INDEX idx_email_outbox_claim (claim_token),
+    INDEX idx_email_outbox_sent (status, sent_at)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4;
@@ -0,0 +1,15 @@
+-- Migration 014: Maintained active-member counter on tenants
+-- Kept in sync by the API (app/member_counts.py) in the same transaction as
+-- every user_tenants.is_active change; a periodic job reconciles drift.
+
+ALTER TABLE tenants
+    ADD COLUMN member_count INT NOT NULL DEFAULT 0;
+
+UPDATE tenants t
+LEFT JOIN (
+    SELECT tenant_id, COUNT(*) AS cnt
+    FROM user_tenants
+    WHERE is_active = TRUE
+    GROUP BY tenant_id
+) m ON m.tenant_id = t.id
+SET t.member_count = COALESCE(m.cnt, 0);